@@ -1,16 +1,64 @@
+import atexit
+import base64
+import bisect
+import csv
+import difflib
+import fcntl
+import hashlib
+import hmac
+import io
+import json
+import mimetypes
+import multiprocessing
 import os
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
 import uuid
-from datetime import datetime
-from flask import Flask, request, redirect, url_for, render_template_string, session, send_from_directory, flash
-from werkzeug.utils import secure_filename
-from sqlalchemy import create_engine, Column, Integer, String, Date, Text
+import zipfile
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from xml.sax.saxutils import escape as xml_escape
+import click
+import jinja2
+from markupsafe import Markup, escape
+from flask import Flask, Request, request, redirect, url_for, session, send_from_directory, flash, g, abort
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+from sqlalchemy import bindparam, create_engine, event, exc, func, or_, select, text, table as sa_table, column as sa_column, inspect as sa_inspect, Column, Index, Integer, Float, String, Date, DateTime, Text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-# Optional BS→AD converter
+# Optional Redis client for DRAFT_STORE=redis
 try:
-    from nepali_datetime import date as nep_date  # noqa: F401
+    import redis
 except Exception:
-    nep_date = None
+    redis = None
+
+# Optional XLSX reader for bulk imports (exports are written without it)
+try:
+    import openpyxl
+except Exception:
+    openpyxl = None
+
+# Optional imaging library for upload previews
+try:
+    from PIL import Image, ImageOps, features as pil_features
+except Exception:
+    Image = ImageOps = pil_features = None
 
 # ------------------------------------------------------------------
 # Flask setup
@@ -19,22 +67,610 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "devkey-jan-membership")
 
 BASE_DIR = os.path.dirname(__file__)
-UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(BASE_DIR, "uploads"))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_DIR
 ALLOWED_EXTS = {"png", "jpg", "jpeg", "pdf"}
 
+# Upload limits. The request cap is checked against Content-Length before
+# the body is read; the per-file cap while the part is streamed to disk.
+UPLOAD_MAX_FILE = int(os.environ.get("UPLOAD_MAX_FILE", 10 * 1024 * 1024))
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("UPLOAD_MAX_REQUEST", 25 * 1024 * 1024))
+UPLOAD_CHUNK = 64 * 1024
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, ".tmp")
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+# How /uploads hands file bytes to the client: "" (from Python),
+# "x-sendfile" (Apache/lighttpd) or "x-accel" (nginx internal location
+# mapped to UPLOAD_DIR at UPLOAD_ACCEL_PREFIX).
+UPLOAD_OFFLOAD = os.environ.get("UPLOAD_OFFLOAD", "")
+UPLOAD_ACCEL_PREFIX = os.environ.get("UPLOAD_ACCEL_PREFIX", "/_uploads/")
+app.config["USE_X_SENDFILE"] = UPLOAD_OFFLOAD == "x-sendfile"
+BLOB_RE = re.compile(r"[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+(\.thumb\.\w+)?")
+
+
+class UploadSpool:
+    """Sink for one multipart file part.
+
+    Werkzeug's parser writes the part here chunk by chunk; the bytes go
+    straight to a temp file next to UPLOAD_DIR (so the final move is an
+    atomic rename) and are hashed on the way through.
+    """
+
+    def __init__(self, max_size=UPLOAD_MAX_FILE):
+        self.max_size = max_size
+        self.size = 0
+        self.path = None
+        self._file = None
+        self._sha = hashlib.sha256()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge(f"File larger than {self.max_size // (1024 * 1024)} MB")
+        if self._file is None:
+            fd, self.path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR)
+            self._file = os.fdopen(fd, "w+b")
+        self._sha.update(chunk)
+        self._file.write(chunk)
+        return len(chunk)
+
+    def seek(self, pos, whence=0):
+        return self._file.seek(pos, whence) if self._file else 0
+
+    def tell(self):
+        return self._file.tell() if self._file else 0
+
+    def read(self, size=-1):
+        return self._file.read(size) if self._file else b""
+
+    @property
+    def sha256(self):
+        return self._sha.hexdigest()
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def commit(self, dest):
+        """Atomically move the finished upload to `dest`."""
+        self._file.close()
+        self._file = None
+        os.chmod(self.path, 0o644)  # mkstemp creates files private to us
+        os.replace(self.path, dest)
+        self.path = None
+
+    def close(self):
+        # Anything not committed by the end of the request is discarded.
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(upload_max_size(filename or ""))
+
+    def _load_form_data(self):
+        if self.mimetype != "multipart/form-data":
+            return super()._load_form_data()
+        # Receiving a multipart body is where upload bytes hit the disk.
+        with metrics.timer("phase_duration_seconds", (("phase", "upload_receive"),)):
+            super()._load_form_data()
+
+
+app.request_class = UploadRequest
+
+# ------------------------------------------------------------------
+# Side SQLite files (rate-limit buckets, drafts, the status cache)
+# ------------------------------------------------------------------
+
+class SQLiteFile:
+    """Connections to a small SQLite file next to the main database, in
+    WAL mode: one per thread, reopened after a fork (gunicorn --preload).
+    Call it for this thread's connection."""
+
+    def __init__(self, path, synchronous="NORMAL", **connect_args):
+        self.path = path
+        self.synchronous = synchronous
+        self.connect_args = connect_args
+        self._local = threading.local()
+
+    def __call__(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, **self.connect_args)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+# ------------------------------------------------------------------
+# Metrics (Prometheus text format at /metrics)
+#
+# Each process keeps its counters and histograms in memory and a
+# background thread writes them to METRICS_DIR/<pid>.json every
+# METRICS_FLUSH seconds. /metrics adds up every process's file, with the
+# serving process's own numbers taken live, so a scrape that lands on
+# any gunicorn worker sees the totals. Files of exited workers are kept:
+# their counts stay in the totals, as counters should. Clear the
+# directory on deploy. /metrics takes the admin login (basic_auth in the
+# Prometheus scrape config).
+# ------------------------------------------------------------------
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(BASE_DIR, "metrics"))
+METRICS_FLUSH = float(os.environ.get("METRICS_FLUSH", 1.0))
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_HELP = {
+    "http_requests_total": ("counter", "Requests by view and status."),
+    "http_request_duration_seconds": ("histogram", "Request latency by view (wizard steps separately)."),
+    "phase_duration_seconds": ("histogram", "Time in render, session, draft, upload and db_commit work."),
+    "upload_bytes_total": ("counter", "Bytes of uploads accepted."),
+    "uploads_total": ("counter", "Uploads accepted."),
+    "submissions_total": ("counter", "Finished applications by mode."),
+    "status_lookups_total": ("counter", "Status lookups by the cache tier (or db) that answered."),
+    "rate_limited_total": ("counter", "Requests refused by the rate limiter, by bucket."),
+}
+
+
+class Metrics:
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._series = {}  # (name, labels) -> value, or [bucket counts..., sum] for histograms
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+        self._ensure_flusher()
+
+    def observe(self, name, seconds, labels=()):
+        key = (name, labels)
+        i = bisect.bisect_left(METRICS_BUCKETS, seconds)
+        with self._lock:
+            h = self._series.get(key)
+            if h is None:
+                h = self._series[key] = [0] * (len(METRICS_BUCKETS) + 2)
+            h[i] += 1  # the slot after the last bucket is +Inf
+            h[-1] += seconds
+        self._ensure_flusher()
+
+    @contextmanager
+    def timer(self, name, labels=()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, list(labels), value if not isinstance(value, list) else list(value)]
+                    for (name, labels), value in self._series.items()]
+
+    def flush(self):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(path + ".tmp", path)
+
+    def _ensure_flusher(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:  # the first requests may arrive on several threads
+            if self._pid == os.getpid():
+                return
+            # One flusher per worker process (threads don't survive a fork).
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._run, name="metrics", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except OSError:
+                app.logger.exception("writing metrics failed")
+
+    def collect(self):
+        """Totals over all processes as Prometheus exposition text."""
+        totals = {}
+        own = f"{os.getpid()}.json"
+        snapshots = [self.snapshot()]
+        for fn in os.listdir(self.directory) if os.path.isdir(self.directory) else ():
+            if fn.endswith(".json") and fn != own:
+                try:
+                    with open(os.path.join(self.directory, fn)) as fh:
+                        snapshots.append(json.load(fh))
+                except (OSError, ValueError):
+                    continue  # being replaced right now
+        for snapshot in snapshots:
+            for name, labels, value in snapshot:
+                key = (name, tuple(map(tuple, labels)))
+                if isinstance(value, list):
+                    have = totals.setdefault(key, [0] * len(value))
+                    totals[key] = [a + b for a, b in zip(have, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        lines = []
+        for metric, (kind, help_) in METRICS_HELP.items():
+            lines += [f"# HELP {metric} {help_}", f"# TYPE {metric} {kind}"]
+            for (name, labels), value in sorted(totals.items()):
+                if name != metric:
+                    continue
+                if kind != "histogram":
+                    lines.append(f"{name}{_label_str(labels)} {value}")
+                    continue
+                cumulative = 0
+                for le, n in zip([*METRICS_BUCKETS, "+Inf"], value[:-1]):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_label_str(labels + (('le', str(le)),))} {cumulative}")
+                lines.append(f"{name}_sum{_label_str(labels)} {value[-1]}")
+                lines.append(f"{name}_count{_label_str(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+metrics = Metrics(METRICS_DIR, METRICS_FLUSH)
+
+
+def request_view():
+    """Metrics label of the current request: its endpoint, with each wizard
+    step on its own. /step/<n> takes any integer, so steps outside the
+    wizard share one label instead of each adding a series."""
+    if request.endpoint == "step":
+        n = request.view_args.get("n")
+        return f"step{n}" if 2 <= n <= REVIEW_STEP else "step_other"
+    return request.endpoint or "unmatched"
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        view = request_view()
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - started, (("view", view),))
+        metrics.inc("http_requests_total", (("view", view), ("status", str(response.status_code))))
+    return response
+
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """The cookie session, with its (de)serialization timed."""
+
+    def open_session(self, app, request):
+        with metrics.timer("phase_duration_seconds", (("phase", "session"),)):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with metrics.timer("phase_duration_seconds", (("phase", "session"),)):
+            return super().save_session(app, session, response)
+
+
+app.session_interface = TimedSessionInterface()
+
+# ------------------------------------------------------------------
+# Rate limiting
+#
+# Token buckets per client IP and per draft for each limited endpoint,
+# plus byte budgets on the bodies POSTed to the wizard (uploads). The
+# check runs before the body is read, so a refused upload never reaches
+# the disk; its cost is the declared Content-Length.
+#
+#   RATE_LIMIT_STORE=memory  buckets in this process (default; with N
+#                            workers a client gets up to N times the limits)
+#   RATE_LIMIT_STORE=sqlite  one table shared by the workers of a host
+#                            (RATE_LIMIT_DB, best on a tmpfs such as /dev/shm)
+#   RATE_LIMIT_STORE=off
+#
+# Behind reverse proxies set TRUSTED_PROXIES to how many of them append
+# to X-Forwarded-For; otherwise every client shares the proxy's address.
+# ------------------------------------------------------------------
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+# endpoint -> ((key, requests per minute, burst), ...); key is "ip" or "draft"
+RATE_LIMITS = {
+    "step": (("ip", 300, 150), ("draft", 60, 40)),
+    "final_submit": (("ip", 20, 10), ("draft", 6, 3)),
+    "uploaded": (("ip", 600, 200),),
+    "application_status": (("ip", 10, 10),),
+}
+# Bytes POSTed to the wizard steps: (key, bytes per hour, burst). A burst
+# must hold at least one request of MAX_CONTENT_LENGTH.
+UPLOAD_BUDGETS = (
+    ("ip", 1024 * 1024 * 1024, 4 * app.config["MAX_CONTENT_LENGTH"]),
+    ("draft", 200 * 1024 * 1024, 2 * app.config["MAX_CONTENT_LENGTH"]),
+)
+
+# The same tables as (bucket prefix, key, tokens per second, burst).
+_RATE_RULES = {
+    endpoint: tuple((f"{endpoint}:{key}", key, per_minute / 60, burst) for key, per_minute, burst in rules)
+    for endpoint, rules in RATE_LIMITS.items()
+}
+_BYTE_RULES = tuple((f"bytes:{key}", key, per_hour / 3600, burst) for key, per_hour, burst in UPLOAD_BUDGETS)
+# A bucket left alone this long is full again and can be forgotten.
+BUCKET_IDLE = max(burst / rate for rule in (*_RATE_RULES.values(), _BYTE_RULES) for _, _, rate, burst in rule)
+
+
+def spend_tokens(items, buckets, now):
+    """Tokens left in each (key, cost, rate, burst) item's bucket after its
+    cost is taken, given `buckets` {key: (tokens, updated_at)}. Returns
+    (None, [(key, tokens left), ...]), or ((index, seconds to wait), None)
+    for the first bucket short of tokens."""
+    left = []
+    for i, (key, cost, rate, burst) in enumerate(items):
+        bucket = buckets.get(key)
+        tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+        if tokens < cost:
+            return (i, (cost - tokens) / rate), None
+        left.append((key, tokens - cost))
+    return None, left
+
+
+class MemoryBuckets:
+    """Token buckets in this process's memory."""
+
+    SWEEP_AT = 100000  # buckets held before idle ones are dropped
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, items):
+        """Take each (key, cost, rate, burst) item's cost from its bucket,
+        all or nothing. Returns None, or (index of the first bucket short
+        of tokens, seconds until it would have enough)."""
+        now = time.monotonic()
+        with self._lock:
+            refused, left = spend_tokens(items, self._buckets, now)
+            if refused:
+                return refused
+            if len(self._buckets) >= self.SWEEP_AT:
+                self._buckets = {k: b for k, b in self._buckets.items() if now - b[1] < BUCKET_IDLE}
+            for key, tokens in left:
+                self._buckets[key] = (tokens, now)
+        return None
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file shared by the workers of a host.
+    A request's buckets are read and written back under one write lock,
+    so concurrent workers can't both spend the same tokens."""
+
+    PURGE_EVERY = 10000  # takes between sweeps of idle buckets
+
+    def __init__(self, path):
+        self.path = path
+        # Losing buckets in a crash is harmless.
+        self._conn = SQLiteFile(path, synchronous="OFF", isolation_level=None)
+        self._takes = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID")
+
+    def take(self, items):
+        """See MemoryBuckets.take()."""
+        if not items:
+            return None
+        now = time.time()
+        db = self._conn()
+        self._takes += 1
+        if self._takes % self.PURGE_EVERY == 0:
+            db.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - BUCKET_IDLE,))
+        keys = [key for key, _, _, _ in items]
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            buckets = {key: (tokens, updated_at) for key, tokens, updated_at in db.execute(
+                f"SELECT key, tokens, updated_at FROM rate_buckets WHERE key IN ({','.join('?' * len(keys))})",
+                keys)}
+            refused, left = spend_tokens(items, buckets, now)
+            if left:
+                db.executemany("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                               [(key, tokens, now) for key, tokens in left])
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return refused
+
+
+def make_rate_buckets(kind):
+    if kind == "memory":
+        return MemoryBuckets()
+    if kind == "sqlite":
+        return SQLiteBuckets(os.environ.get("RATE_LIMIT_DB", os.path.join(BASE_DIR, "ratelimit.db")))
+    if kind == "off":
+        return None
+    raise ValueError(f"Unknown RATE_LIMIT_STORE: {kind}")
+
+
+rate_buckets = make_rate_buckets(RATE_LIMIT_STORE)
+
+
+def client_ip(req):
+    if TRUSTED_PROXIES and "X-Forwarded-For" in req.headers:
+        route = req.access_route
+        if len(route) >= TRUSTED_PROXIES:
+            return route[-TRUSTED_PROXIES]
+    return req.remote_addr
+
+
+@app.before_request
+def rate_limit():
+    req = request._get_current_object()  # one proxy lookup, not one per attribute
+    rules = _RATE_RULES.get(req.endpoint)
+    if rules is None or rate_buckets is None:
+        return None
+    keys = {"ip": client_ip(req), "draft": session.get("draft")}
+    checks = [(prefix, key, 1, rate, burst) for prefix, key, rate, burst in rules if keys[key] is not None]
+    if req.method == "POST" and req.endpoint == "step":
+        # No Content-Length (chunked) is charged as the largest body allowed.
+        limit = app.config["MAX_CONTENT_LENGTH"]
+        size = limit if req.content_length is None else min(req.content_length, limit)
+        checks += [(prefix, key, size, rate, burst) for prefix, key, rate, burst in _BYTE_RULES
+                   if keys[key] is not None]
+    refused = rate_buckets.take([(f"{prefix}:{keys[key]}", cost, rate, burst)
+                                 for prefix, key, cost, rate, burst in checks])
+    if refused and not is_admin():  # admins: e.g. a page of thumbnails in the member list
+        i, wait = refused
+        metrics.inc("rate_limited_total", (("rule", checks[i][0]),))
+        return app.response_class("Too many requests. Please wait a moment and try again.", 429,
+                                  {"Retry-After": str(int(wait) + 1)}, mimetype="text/plain")
+    return None
+
+# ------------------------------------------------------------------
+# Wizard funnel events
+#
+# Requests only append an event to an in-memory buffer; a background
+# thread per process appends the buffer to FUNNEL_DIR/events-<pid>.jsonl
+# every FUNNEL_FLUSH seconds. Events:
+#   view    a step page was shown
+#   leave   a step was posted: action next/prev, ok (passed validation),
+#           uploads {field: stored?} for the files that were sent
+#   reject  an upload was refused as too large
+#   submit  the application was finished
+# Drafts appear under a hash of their id, never the id itself.
+# `flask funnel-report` turns the logs into drop-off and time per step.
+# ------------------------------------------------------------------
+FUNNEL_DIR = os.environ.get("FUNNEL_DIR", os.path.join(BASE_DIR, "funnel"))
+FUNNEL_FLUSH = float(os.environ.get("FUNNEL_FLUSH", 2.0))
+FUNNEL_ENABLED = os.environ.get("FUNNEL_LOG", "1") not in ("", "0")
+
+
+class FunnelLog:
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._pid = None
+
+    def record(self, event, **fields):
+        draft_id = session.get("draft")
+        if not draft_id:
+            return
+        fields.update(t=round(time.time(), 3), e=event, l=current_lang(),
+                      d=hashlib.sha256(draft_id.encode()).hexdigest()[:16])
+        with self._lock:
+            if self._pid != os.getpid():
+                # One flusher per worker process (threads don't survive a
+                # fork), started under the lock so racing threads start one.
+                self._pid = os.getpid()
+                self._buffer = []  # anything buffered was the parent's
+                os.makedirs(self.directory, exist_ok=True)
+                threading.Thread(target=self._run, name="funnel", daemon=True).start()
+                atexit.register(self.flush)
+            self._buffer.append(fields)
+
+    def flush(self):
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if events:
+            data = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in events)
+            with open(os.path.join(self.directory, f"events-{os.getpid()}.jsonl"), "a") as fh:
+                fh.write(data)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except OSError:
+                app.logger.exception("writing funnel events failed")
+
+
+funnel = FunnelLog(FUNNEL_DIR, FUNNEL_FLUSH) if FUNNEL_ENABLED else None
+
+
+def funnel_event(event, **fields):
+    if funnel is not None:
+        funnel.record(event, **fields)
+
 # ------------------------------------------------------------------
 # Database (SQLite via SQLAlchemy ORM)
+#
+# DATABASE_URL may point at any SQLAlchemy URL (e.g. a local Postgres);
+# the SQLite pragmas below only apply to sqlite:// URLs.
 # ------------------------------------------------------------------
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///jan_members.db")
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",     # readers don't block the writer
+    "synchronous": "NORMAL",   # fsync at checkpoints, safe with WAL
+    "cache_size": -20000,      # 20 MB page cache per connection
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 10000)),  # ms
+}
+
+
+def make_engine(url):
+    kwargs = {"echo": False, "future": True, "pool_pre_ping": not url.startswith("sqlite")}
+    if url.startswith("sqlite") and ":memory:" not in url:
+        # SQLAlchemy 1.4 defaults file databases to NullPool (a new
+        # connection, and a fresh page cache, per session); keep a pool.
+        kwargs.update(
+            poolclass=QueuePool,
+            pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+            connect_args={"check_same_thread": False, "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000},
+        )
+    elif not url.startswith("sqlite"):
+        kwargs.update(
+            pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        )
+    eng = create_engine(url, **kwargs)
+
+    @event.listens_for(eng, "connect")
+    def on_connect(dbapi_conn, record):
+        record.info["pid"] = os.getpid()
+        if eng.dialect.name == "sqlite":
+            cur = dbapi_conn.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cur.execute(f"PRAGMA {name}={value}")
+            cur.close()
+
+    @event.listens_for(eng, "checkout")
+    def on_checkout(dbapi_conn, record, proxy):
+        # A connection inherited across a gunicorn fork (--preload) must not
+        # be shared with the parent; make the pool open a fresh one.
+        if record.info["pid"] != os.getpid():
+            record.dbapi_connection = proxy.dbapi_connection = None
+            raise exc.DisconnectionError("connection belongs to another process")
+
+    return eng
+
+
 Base = declarative_base()
-engine = create_engine("sqlite:///jan_members.db", echo=False, future=True)
+engine = make_engine(DATABASE_URL)
 DBSession = sessionmaker(bind=engine)
 
 class Member(Base):
     __tablename__ = "members"
 
     id = Column(Integer, primary_key=True)
+    submission_key = Column(String(64))  # draft id; makes Finish idempotent
+    submitted_at = Column(DateTime, default=datetime.utcnow)
     lang = Column(String(8))
 
     # Member Info
@@ -53,7 +689,8 @@ class Member(Base):
 
     # Govt Doc
     doc_type = Column(String(100))
-    doc_issued_date = Column(String(20))
+    doc_issued_date = Column(String(20))  # as typed (B.S. or A.D.)
+    doc_issued_ad = Column(Date, nullable=True)
     doc_file = Column(String(300))
 
     # Education
@@ -88,666 +725,3595 @@ class Member(Base):
     # Declaration
     declaration = Column(String(10))
 
-Base.metadata.create_all(engine)
+    # Office processing (see STATUSES; NULL reads as "received")
+    status = Column(String(20), default="received")
+    status_updated_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ux_members_submission_key", "submission_key", unique=True),
+        # Admin lookups (SQLite appends the rowid to each index, so these
+        # also serve "... ORDER BY id DESC" keyset pages).
+        Index("ix_members_phone", "phone"),
+        Index("ix_members_email", "email"),
+        Index("ix_members_transaction_id", "transaction_id"),
+        Index("ix_members_membership_type", "membership_type"),
+        Index("ix_members_submitted_at", "submitted_at"),
+        Index("ix_members_dob_ad", "dob_ad"),
+        Index("ix_members_doc_issued_ad", "doc_issued_ad"),
+    )
+
+
+class BackfillCheckpoint(Base):
+    """Progress of a resumable batched backfill (last members.id done)."""
+    __tablename__ = "backfill_checkpoints"
+
+    name = Column(String(100), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class MemberBlock(Base):
+    """Blocking key -> member: the candidate index of duplicate detection."""
+    __tablename__ = "member_blocks"
+
+    key = Column(String(200), primary_key=True)
+    member_id = Column(Integer, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_member_blocks_member_id", "member_id"),  # "already indexed?"
+    )
+
+
+class DuplicateCandidate(Base):
+    """A pair of members that probably are the same person."""
+    __tablename__ = "duplicate_candidates"
+
+    member_id = Column(Integer, primary_key=True)  # the later registration
+    other_id = Column(Integer, primary_key=True)
+    score = Column(Float, nullable=False)
+    reasons = Column(String(200))
+    found_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_duplicate_candidates_other_id", "other_id"),
+        Index("ix_duplicate_candidates_score", "score"),
+    )
+
+
+class MemberStat(Base):
+    """Rolled-up member count for one value of one dashboard dimension."""
+    __tablename__ = "member_stats"
+
+    dimension = Column(String(50), primary_key=True)
+    value = Column(String(200), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# Full-text search over names, addresses and skills (SQLite FTS5, kept in
+# sync with members by triggers).
+FTS_COLUMNS = ("name", "full_name_en", "perm_address", "temp_address", "skills")
+
+
+def ensure_fts(bind):
+    """Create members_fts if missing and bring its triggers up to date.
+    Returns False when the database has no FTS5."""
+    if bind.dialect.name != "sqlite":
+        return False
+    cols = ", ".join(FTS_COLUMNS)
+    new = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    triggers = {
+        "members_fts_ai": f"""CREATE TRIGGER members_fts_ai AFTER INSERT ON members BEGIN
+              INSERT INTO members_fts (rowid, {cols}) VALUES (new.id, {new});
+            END""",
+        "members_fts_ad": f"""CREATE TRIGGER members_fts_ad AFTER DELETE ON members BEGIN
+              INSERT INTO members_fts (members_fts, rowid, {cols}) VALUES ('delete', old.id, {old});
+            END""",
+        # Only the indexed columns: status changes, dedup flags and the
+        # dates backfill leave the index alone.
+        "members_fts_au": f"""CREATE TRIGGER members_fts_au AFTER UPDATE OF {cols} ON members BEGIN
+              INSERT INTO members_fts (members_fts, rowid, {cols}) VALUES ('delete', old.id, {old});
+              INSERT INTO members_fts (rowid, {cols}) VALUES (new.id, {new});
+            END""",
+    }
+    with bind.begin() as conn:
+        created = False
+        if not conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'members_fts'").first():
+            try:
+                conn.exec_driver_sql(
+                    f"CREATE VIRTUAL TABLE members_fts USING fts5({cols}, content='members', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+            except exc.OperationalError:
+                return False
+            created = True
+        have = dict(conn.exec_driver_sql("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").all())
+        for name, sql in triggers.items():
+            if have.get(name) != sql:
+                conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+                conn.exec_driver_sql(sql)
+        if created:
+            conn.exec_driver_sql("INSERT INTO members_fts (members_fts) VALUES ('rebuild')")
+    return True
+
+
+# Importing the app never touches the schema: `flask upgrade-schema` is a
+# deploy step, run once before the new workers start. This lock keeps two
+# upgrades started at once from interleaving.
+SCHEMA_LOCK = os.environ.get("SCHEMA_LOCK", os.path.join(BASE_DIR, ".schema.lock"))
+
+
+def _unless_exists(ddl, *args, **kwargs):
+    """Run a DDL call, skipping it if another process (e.g. on another
+    host, past the file lock) created the object first."""
+    try:
+        ddl(*args, **kwargs)
+    except (exc.OperationalError, exc.ProgrammingError) as e:
+        if "already exists" not in str(e) and "duplicate column" not in str(e):
+            raise
+
+
+def upgrade_schema(bind=engine, attempts=3):
+    """Create missing tables, then add any columns and indexes the models
+    have gained since an existing database was created."""
+    with open(SCHEMA_LOCK, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        for attempt in range(attempts):
+            try:
+                return _upgrade_schema(bind)
+            except (exc.OperationalError, exc.ProgrammingError):
+                # Caught another host's upgrade half done; look again.
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.2 * (attempt + 1))
+
+
+def _upgrade_schema(bind):
+    _unless_exists(Base.metadata.create_all, bind)
+    insp = sa_inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in have:
+                with bind.begin() as conn:
+                    _unless_exists(conn.exec_driver_sql,
+                                   f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(bind.dialect)}")
+        for index in table.indexes:
+            _unless_exists(index.create, bind, checkfirst=True)
+    return ensure_fts(bind)
+
+
+@app.cli.command("upgrade-schema")
+def upgrade_schema_command():
+    """Create missing tables, columns and indexes, and the search index."""
+    if upgrade_schema():
+        click.echo("Schema is up to date.")
+    else:
+        click.echo("Schema is up to date (no FTS5: member search falls back to LIKE).")
+
+
+@lru_cache(maxsize=None)
+def has_fts():
+    """Whether upgrade_schema() created members_fts; looked up once per
+    process, at the first search."""
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'members_fts'").first() is not None
 
 # ------------------------------------------------------------------
 # Language packs (EN / Nepali / Jirel)
 # ------------------------------------------------------------------
-LABELS = {
-    "en": {
-        "lang_name": "English",
-        "take_membership": "Take Membership",
-        "sections": {
-            "language": "Choose Language",
-            "member_info": "Member Information",
-            "contact": "Contact Details",
-            "gov_doc": "Government Document Upload",
-            "education": "Educational Qualification",
-            "professional": "Professional Skills / Expertise",
-            "membership": "Membership Type",
-            "family": "Family Information",
-            "emergency": "Emergency Contact Person",
-            "payment": "Membership Payment",
-            "declaration": "Declaration",
-            "review": "Review & Submit"
-        },
-        "fields": {
-            "name": "Name",
-            "full_name_en": "Full Name in English",
-            "dob": "Date of Birth (B.S.)",
-            "dob_ad": "Date of Birth (A.D.)",
-            "gender": "Gender",
-            "male": "Male",
-            "female": "Female",
-            "others": "Others",
-            "occupation": "Occupation",
-            "perm_address": "Permanent Address",
-            "temp_address": "Temporary Address",
-            "phone": "Phone Number",
-            "email": "Email",
-            "doc_type": "Document Type",
-            "doc_issued": "Issued Date",
-            "upload": "Upload File",
-            "education": "Education Level",
-            "job_title": "Current Job Title / Position",
-            "experience_years": "Years of Work Experience",
-            "skills": "Special Skills",
-            "org_name": "Organization / Company Name",
-            "membership_type": "Select Membership Type",
-            "father": "Father’s Name",
-            "mother": "Mother’s Name",
-            "spouse": "Spouse Name",
-            "children": "Children (Number / Names)",
-            "em_name": "Name",
-            "em_relation": "Relationship",
-            "em_phone": "Phone Number",
-            "em_address": "Address",
-            "pay_method": "Payment Method",
-            "transaction_id": "Transaction ID",
-            "payment_file": "Upload Payment Proof",
-            "agree": "I hereby declare that all information provided is true to the best of my knowledge.",
-            "submit": "Submit"
-        },
-        "doc_types": ["Citizenship", "Driving License", "PAN Card", "Voter ID", "National ID", "Passport"],
-        "education_opts": ["Literate", "SLC / SEE", "10+2", "Bachelors", "Masters", "PhD"],
-        "membership_opts": ["General Member", "Life Member", "Honorary Member"],
-        "payment_opts": ["eSewa", "Khalti", "ConnectIPS", "Bank Transfer"],
-        "success": "Thank you for registering as a member of Jirel Association Nepal.",
-        "next": "Next",
-        "prev": "Previous",
-        "save": "Save & Continue",
-        "finish": "Finish"
-    },
-    "ne": {
-        "lang_name": "नेपाली",
-        "take_membership": "सदस्यता लिनुहोस्",
-        "sections": {
-            "language": "भाषा छान्नुहोस्",
-            "member_info": "सदस्यको विवरण",
-            "contact": "सम्पर्क विवरण",
-            "gov_doc": "सरकारी प्रमाणपत्र अपलोड",
-            "education": "शैक्षिक योग्यता",
-            "professional": "व्यावसायिक सीप / दक्षता",
-            "membership": "सदस्यता प्रकार",
-            "family": "परिवार विवरण",
-            "emergency": "आपतकालीन सम्पर्क व्यक्ति",
-            "payment": "सदस्यता भुक्तानी",
-            "declaration": "घोषणा",
-            "review": "समिक्षा र पेश गर्नुहोस्"
-        },
-        "fields": {
-            "name": "नाम",
-            "full_name_en": "अंग्रेजीमा पूरा नाम",
-            "dob": "जन्म मिति (वि.सं.)",
-            "dob_ad": "जन्म मिति (ई.सं.)",
-            "gender": "लिङ्ग",
-            "male": "पुरुष",
-            "female": "महिला",
-            "others": "अन्य",
-            "occupation": "पेशा",
-            "perm_address": "स्थायी ठेगाना",
-            "temp_address": "अस्थायी ठेगाना",
-            "phone": "फोन नं.",
-            "email": "इमेल",
-            "doc_type": "कागजातको प्रकार",
-            "doc_issued": "जारि मिति",
-            "upload": "फाइल अपलोड",
-            "education": "शैक्षिक स्तर",
-            "job_title": "हालको पद / पदनाम",
-            "experience_years": "कामको अनुभव (वर्ष)",
-            "skills": "विशेष सीप",
-            "org_name": "संस्था / कम्पनीको नाम",
-            "membership_type": "सदस्यता प्रकार छान्नुहोस्",
-            "father": "बाबुको नाम",
-            "mother": "आमाको नाम",
-            "spouse": "पति/पत्नीको नाम",
-            "children": "सन्तान (संख्या / नाम)",
-            "em_name": "नाम",
-            "em_relation": "सम्बन्ध",
-            "em_phone": "फोन नं.",
-            "em_address": "ठेगाना",
-            "pay_method": "भुक्तानी विधि",
-            "transaction_id": "ट्रान्ज्याक्सन आईडी",
-            "payment_file": "भुक्तानी प्रमाण अपलोड",
-            "agree": "मैले दिएको सम्पूर्ण जानकारी मेरो जानकारी अनुसार सत्य हो भन्ने म घोषणा गर्दछु।",
-            "submit": "पेश गर्नुहोस्"
-        },
-        "doc_types": ["नागरिकता", "सवारी चालक अनुमतिपत्र", "पान कार्ड", "मतदाता परिचयपत्र", "रास्ट्रिय परिचयपत्र", "पासपोर्ट"],
-        "education_opts": ["साधारण लेखपढ", "SLC / SEE", "१०+२", "स्नातक", "स्नातकोत्तर", "पिएचडी"],
-        "membership_opts": ["साधारण सदस्य", "आजीवन सदस्य", "मानार्थ सदस्य"],
-        "payment_opts": ["इसेवा", "खल्ती", "कनेक्टआईपीएस", "बैंक ट्रान्सफर"],
-        "success": "जिरेल संघ नेपालको सदस्य बन्नु भएकोमा धन्यवाद।",
-        "next": "अर्को",
-        "prev": "अघिल्लो",
-        "save": "सेभ गरी अघि बढ्नुहोस्",
-        "finish": "समाप्त"
-    },
-    "ji": {
-        "lang_name": "जिरेल",
-        "take_membership": "सदस्यता लोङ्ग",
-        "sections": {
-            "language": "भाषा चुन",
-            "member_info": "सदस्यते विवरण",
-            "contact": "सम्पर्क विवरण",
-            "gov_doc": "सरकारी प्रमाणपत्र अपलोड",
-            "education": "शैक्षिक थ्योबो",
-            "professional": "व्यावसायिक सीप",
-            "membership": "सदस्यते प्रकार",
-            "family": "परिवार विवरण",
-            "emergency": "आपतकालीन सम्पर्क व्यक्ति",
-            "payment": "सदस्यता भुक्तानी",
-            "declaration": "घोषणा",
-            "review": "हेलाइ र पेश लोङ्ग"
-        },
-        "fields": {
-            "name": "म्यिन",
-            "full_name_en": "अंग्रेजीला पूरा म्यिन",
-            "dob": "केबाते मिति (वि.सं.)",
-            "dob_ad": "केबाते मिति (ई.सं.)",
-            "gender": "लिङ्ग",
-            "male": "ख्योबो म्यी",
-            "female": "फेम्बे म्यी",
-            "others": "जेन",
-            "occupation": "पेशा",
-            "perm_address": "स्थायी थलो",
-            "temp_address": "अस्थायी थलो",
-            "phone": "फोन नं.",
-            "email": "इमेल",
-            "doc_type": "कागजात प्रकार",
-            "doc_issued": "जारी खाबते मिति",
-            "upload": "फाइल अपलोड",
-            "education": "शैक्षिक स्तर",
-            "job_title": "हालको पद",
-            "experience_years": "काम अनुभव (वर्ष)",
-            "skills": "विशेष सीप",
-            "org_name": "संस्था / कम्पनी",
-            "membership_type": "सदस्यते प्रकार छान्नुहोस्",
-            "father": "बुबा म्यिन",
-            "mother": "आमा म्यिन",
-            "spouse": "जोडी म्यिन",
-            "children": "सन्तान (संख्या / नाम)",
-            "em_name": "म्यिन",
-            "em_relation": "सम्बन्ध",
-            "em_phone": "फोन नं.",
-            "em_address": "ठेगाना",
-            "pay_method": "भुक्तानी विधि",
-            "transaction_id": "लेनदेन आईडी",
-            "payment_file": "भुक्तानी प्रमाण अपलोड",
-            "agree": "ङा दिआ जानकारी सारा सत्य बा थोक मा घोषणा लाङ।",
-            "submit": "पेश लोङ्ग"
-        },
-        "doc_types": ["नागरिकता", "सवारी चालक अनुमतिपत्र", "पान कार्ड", "मतदाता परिचयपत्र", "रास्ट्रिय परिचयपत्र", "पासपोर्ट"],
-        "education_opts": ["साधारण लेखापढी", "SLC / SEE", "१०+२", "स्नातक", "स्नातकोत्तर", "पिएचडी"],
-        "membership_opts": ["साधारण सदस्य", "आजीवन सदस्य", "मानार्थ सदस्य"],
-        "payment_opts": ["इसेवा", "खल्ती", "कनेक्टआईपीएस", "बैंक ट्रान्सफर"],
-        "success": "जिरेल संघ नेपाल ला धन्यवाद।",
-        "next": "अगाडि",
-        "prev": "पाछाडि",
-        "save": "सेभ करी अघि जाम",
-        "finish": "समाप्त"
-    }
+LANG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lang")
+
+# Select fields and where each language pack keeps their choices.
+OPTION_SOURCES = {
+    "gender": lambda p: [p["fields"]["male"], p["fields"]["female"], p["fields"]["others"]],
+    "doc_type": lambda p: p["doc_types"],
+    "education": lambda p: p["education_opts"],
+    "membership_type": lambda p: p["membership_opts"],
+    "pay_method": lambda p: p["payment_opts"],
 }
 
-# ------------------------------------------------------------------
-# Helper functions
-# ------------------------------------------------------------------
 
-def allowed_file(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTS
+class LanguagePacks:
+    """Language packs read from lang/<code>.json on first use.
 
+    Adding a language is dropping a file in LANG_DIR. Sections a pack
+    leaves out (say, untranslated error messages) are taken from the pack
+    its "fallback" key names, English by default. Alongside each pack
+    the rendered <option> lists of its select fields are built once, with
+    one variant per selected value, so a page render picks its list by a
+    dict lookup.
+    """
 
-def save_upload(file_storage):
-    if not file_storage or file_storage.filename == "":
-        return None
-    if not allowed_file(file_storage.filename):
-        return None
-    safe = secure_filename(file_storage.filename)
-    unique_name = f"{uuid.uuid4().hex}_{safe}"
-    path = os.path.join(app.config["UPLOAD_FOLDER"], unique_name)
-    file_storage.save(path)
-    return unique_name
+    def __init__(self, directory):
+        self.directory = directory
+        self.codes = sorted(fn[:-5] for fn in os.listdir(directory) if fn.endswith(".json"))
+        self._packs = {}
+        self._options = {}
 
+    def __contains__(self, code):
+        return code in self.codes
 
-def L():
-    """Current labels based on session language."""
-    lang = session.get("lang", "en")
-    return LABELS.get(lang, LABELS["en"])
+    def __iter__(self):
+        return iter(self.codes)
 
+    def __getitem__(self, code):
+        pack = self._packs.get(code)
+        if pack is None:
+            if code not in self.codes:
+                raise KeyError(code)
+            with open(os.path.join(self.directory, f"{code}.json"), encoding="utf-8") as fh:
+                pack = json.load(fh)
+            base = pack.get("fallback", "en")
+            if base != code:
+                pack = {**self[base], **pack}
+            for field, source in OPTION_SOURCES.items():
+                self._options[code, field] = option_variants(source(pack))
+            self._packs[code] = pack
+        return pack
 
-def get_form():
-    session.setdefault("form", {})
-    return session["form"]
+    def options(self, code, field, selected=None):
+        """The <option> list of `field` in `code` with `selected` marked."""
+        variants = self._options.get((code, field))
+        if variants is None:
+            self[code]
+            variants = self._options[code, field]
+        return variants.get(selected) or variants[None]
+
+
+def option_variants(values):
+    """{selected value or None: rendered <option> list}."""
+    items = [(v, f"value='{escape(v)}'>{escape(v)}</option>") for v in values]
+    variants = {None: Markup("".join(f"<option {tail}" for _, tail in items))}
+    for value in values:
+        variants[value] = Markup("".join(
+            f"<option selected {tail}" if v == value else f"<option {tail}" for v, tail in items))
+    return variants
+
+
+LABELS = LanguagePacks(LANG_DIR)
 
 # ------------------------------------------------------------------
-# Templates (inline via render_template_string for single-file simplicity)
+# Wizard schema
+#
+# Steps 2-8 as (step, ((section, fields), ...)). A field is
+# Field(name, label, kind, required, rule, unique): `name` is both the
+# form input and the members column, `label` its key in a language pack's
+# "fields", `rule` a key of RULES, `unique` set when no two members may
+# share the value.
+# Step dispatch, form extraction, the step/review pages and the Member
+# mapping are all compiled from this, so adding a field is one line here
+# plus its column and label.
+#
+# kinds: text, wide (full-width text), textarea, bsdate (typed B.S./A.D.
+# date), date, email, select (choices in OPTION_SOURCES), file, check
 # ------------------------------------------------------------------
+Field = namedtuple("Field", "name label kind required rule unique", defaults=(None, "text", False, None, False))
 
-BASE_TPL = """
-<!doctype html>
-<html>
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <title>{{ title }}</title>
-  <style>
-    body{font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial; margin: 2rem;}
-    .card{max-width: 900px; margin: 0 auto; padding: 1.5rem; border: 1px solid #ddd; border-radius: 14px;}
-    h1{margin-top:0}
-    .row{display:grid; grid-template-columns: 1fr 1fr; gap: 1rem;}
-    label{display:block; font-weight:600; margin-bottom: .35rem}
-    input, select, textarea{width:100%; padding:.6rem .7rem; border:1px solid #ccc; border-radius:10px}
-    textarea{min-height:90px}
-    .actions{display:flex; gap:.5rem; margin-top:1rem}
-    button{padding:.7rem 1rem; border-radius:10px; border:1px solid #999; background:#111; color:#fff; cursor:pointer}
-    .ghost{background:#fff; color:#111}
-    .hint{color:#666; font-size:.9rem}
-    .divider{height:1px; background:#eee; margin:1.25rem 0}
-    .success{padding:1rem; background:#f0fff4; border:1px solid #c6f6d5; border-radius:10px}
-  </style>
-</head>
-<body>
-  <div class="card">
-    {% with m = get_flashed_messages() %}
-      {% if m %}<div class="success">{{ m[0] }}</div>{% endif %}
-    {% endwith %}
-    {{ body|safe }}
-  </div>
-</body>
-</html>
-"""
-
+WIZARD = (
+    (2, (("member_info", (
+        Field("name", required=True),
+        Field("full_name_en"),
+        Field("dob_bs", "dob", "bsdate", rule="bs_date"),
+        Field("dob_ad", kind="date", rule="ad_date"),
+        Field("gender", kind="select"),
+        Field("occupation"),
+    )),)),
+    (3, (("contact", (
+        Field("perm_address"),
+        Field("temp_address"),
+        # Not unique: family members often share a phone or email, so
+        # duplicate detection flags matches instead.
+        Field("phone", rule="phone"),
+        Field("email", kind="email", rule="email"),
+    )),)),
+    (4, (("gov_doc", (
+        Field("doc_type", kind="select"),
+        Field("doc_issued_date", "doc_issued", "bsdate", rule="any_date"),
+        Field("doc_file", "upload", "file"),
+    )),)),
+    (5, (("education", (
+        Field("education", kind="select"),
+    )),)),
+    (6, (("professional", (
+        Field("job_title"),
+        Field("experience_years"),
+        Field("skills", kind="textarea"),
+        Field("org_name", kind="wide"),
+    )),)),
+    (7, (("family", (
+        Field("father_name", "father"),
+        Field("mother_name", "mother"),
+        Field("spouse_name", "spouse"),
+        Field("children"),
+    )), ("emergency", (
+        Field("em_name"),
+        Field("em_relation"),
+        Field("em_phone", rule="phone"),
+        Field("em_address"),
+    )))),
+    (8, (("membership", (
+        Field("membership_type", kind="select"),
+    )), ("payment", (
+        Field("pay_method", kind="select"),
+        Field("transaction_id", rule="txid", unique=True),
+        Field("payment_file", kind="file"),
+        Field("declaration", "agree", "check", required=True),
+    )))),
+)
+REVIEW_STEP = 9
 
-def page(title: str, body: str):
-    return render_template_string(BASE_TPL, title=title, body=body)
+FIELDS = {}        # name -> Field, in wizard order
+STEP_INPUTS = {}   # step -> names read from request.form
+STEP_UPLOADS = {}  # step -> names read from request.files
+for _n, _sections in WIZARD:
+    for _section, _fields in _sections:
+        for _f in _fields:
+            FIELDS[_f.name] = _f._replace(label=_f.label or _f.name)
+            (STEP_UPLOADS if _f.kind == "file" else STEP_INPUTS).setdefault(_n, []).append(_f.name)
+REQUIRED_FIELDS = tuple(k for k, f in FIELDS.items() if f.required)
+UNIQUE_FIELDS = tuple(k for k, f in FIELDS.items() if f.unique)
+FILE_FIELDS = tuple(k for k, f in FIELDS.items() if f.kind == "file")
 
 # ------------------------------------------------------------------
-# Routes
+# Draft store (wizard state lives server-side; the cookie only holds
+# an opaque draft id)
+#
+#   DRAFT_STORE=sqlite  shared by all gunicorn workers (default)
+#   DRAFT_STORE=memory  in-process LRU, single worker / development
+#   DRAFT_STORE=redis   Redis or a compatible local server at REDIS_URL
 # ------------------------------------------------------------------
+DRAFT_TTL = int(os.environ.get("DRAFT_TTL", 2 * 24 * 3600))  # seconds
 
-@app.route("/")
-def index():
-    # Step 1: choose language
-    body = f"""
-    <h1>{L()['sections']['language']}</h1>
-    <form method=post action="{url_for('set_language')}">
-      <div class=row>
-        <div>
-          <label>Language</label>
-          <select name="lang">
-            <option value="en">English</option>
-            <option value="ne">नेपाली</option>
-            <option value="ji">जिरेल</option>
-          </select>
-        </div>
-      </div>
-      <div class=actions>
-        <button type=submit>{L()['next']}</button>
-      </div>
-    </form>
-    """
-    return page("Choose Language", body)
 
+class MemoryDraftStore:
+    """In-process LRU of drafts with TTL eviction."""
 
-@app.route("/set-language", methods=["POST"])
-def set_language():
-    lang = request.form.get("lang", "en")
-    session["lang"] = lang
-    session["form"] = {}
-    return redirect(url_for("step", n=2))
+    def __init__(self, max_drafts=10000, ttl=DRAFT_TTL):
+        self.max_drafts = max_drafts
+        self.ttl = ttl
+        self._drafts = OrderedDict()  # draft_id -> (expires_at, fields)
+        self._lock = threading.Lock()
 
+    def load(self, draft_id):
+        with self._lock:
+            entry = self._drafts.get(draft_id)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._drafts[draft_id]
+                return None
+            self._drafts.move_to_end(draft_id)
+            return dict(entry[1])
 
-@app.route("/step/<int:n>", methods=["GET", "POST"])
-def step(n: int):
-    f = get_form()
+    def update(self, draft_id, changes):
+        with self._lock:
+            entry = self._drafts.pop(draft_id, None)
+            fields = entry[1] if entry else {}
+            fields.update(changes)
+            self._drafts[draft_id] = (time.time() + self.ttl, fields)
+            while len(self._drafts) > self.max_drafts:
+                self._drafts.popitem(last=False)
 
-    # handle navigation for POST
-    if request.method == "POST":
-        action = request.form.get("action", "next")
-        # collect fields based on step
-        if n == 2:
-            for k in ["name", "full_name_en", "dob_bs", "dob_ad", "gender", "occupation"]:
-                f[k] = request.form.get(k, "")
-        elif n == 3:
-            for k in ["perm_address", "temp_address", "phone", "email"]:
-                f[k] = request.form.get(k, "")
-        elif n == 4:
-            for k in ["doc_type", "doc_issued_date"]:
-                f[k] = request.form.get(k, "")
-            # upload doc file
-            doc_file = request.files.get("doc_file")
-            saved = save_upload(doc_file)
-            if saved:
-                f["doc_file"] = saved
-        elif n == 5:
-            for k in ["education"]:
-                f[k] = request.form.get(k, "")
-        elif n == 6:
-            for k in ["job_title", "experience_years", "skills", "org_name"]:
-                f[k] = request.form.get(k, "")
-        elif n == 7:
-            for k in ["father_name", "mother_name", "spouse_name", "children", "em_name", "em_relation", "em_phone", "em_address"]:
-                f[k] = request.form.get(k, "")
-        elif n == 8:
-            for k in ["membership_type", "pay_method", "transaction_id", "declaration"]:
-                f[k] = request.form.get(k, "")
-            pay_file = request.files.get("payment_file")
-            saved = save_upload(pay_file)
-            if saved:
-                f["payment_file"] = saved
-        session.modified = True
+    def delete(self, draft_id):
+        with self._lock:
+            self._drafts.pop(draft_id, None)
 
-        if action == "prev":
-            return redirect(url_for("step", n=max(2, n-1)))
-        else:
-            return redirect(url_for("step", n=min(9, n+1)))
+    def referenced_files(self):
+        now = time.time()
+        with self._lock:
+            return {fields[k] for expires_at, fields in self._drafts.values() if expires_at >= now
+                    for k in FILE_FIELDS if fields.get(k)}
 
-    # render step pages
-    S = L()["sections"]
-    F = L()["fields"]
 
-    if n == 2:
-        body = f"""
-        <h1>{S['member_info']}</h1>
-        <form method=post>
-          <div class=row>
-            <div><label>{F['name']}</label><input name=name value="{f.get('name','')}" required></div>
-            <div><label>{F['full_name_en']}</label><input name=full_name_en value="{f.get('full_name_en','')}"></div>
-            <div><label>{F['dob']}</label><input name=dob_bs placeholder="YYYY-MM-DD" value="{f.get('dob_bs','')}"></div>
-            <div><label>{F['dob_ad']}</label><input type=date name=dob_ad value="{f.get('dob_ad','')}"></div>
-            <div><label>{F['gender']}</label>
-              <select name=gender>
-                <option { 'selected' if f.get('gender')==F['male'] else '' } value="{F['male']}">{F['male']}</option>
-                <option { 'selected' if f.get('gender')==F['female'] else '' } value="{F['female']}">{F['female']}</option>
-                <option { 'selected' if f.get('gender')==F['others'] else '' } value="{F['others']}">{F['others']}</option>
-              </select>
-            </div>
-            <div><label>{F['occupation']}</label><input name=occupation value="{f.get('occupation','')}"></div>
-          </div>
-          <div class=actions>
-            <button class=ghost name=action value=prev type=submit>{L()['prev']}</button>
-            <button name=action value=next type=submit>{L()['next']}</button>
-          </div>
-        </form>
-        """
-        return page(S['member_info'], body)
+class SQLiteDraftStore:
+    """Drafts in a small SQLite file, one row per field, so a step only
+    writes the fields that changed."""
 
-    if n == 3:
-        body = f"""
-        <h1>{S['contact']}</h1>
-        <form method=post>
-          <div class=row>
-            <div><label>{F['perm_address']}</label><input name=perm_address value="{f.get('perm_address','')}"></div>
-            <div><label>{F['temp_address']}</label><input name=temp_address value="{f.get('temp_address','')}"></div>
-            <div><label>{F['phone']}</label><input name=phone value="{f.get('phone','')}"></div>
-            <div><label>{F['email']}</label><input type=email name=email value="{f.get('email','')}"></div>
-          </div>
-          <div class=actions>
-            <button class=ghost name=action value=prev type=submit>{L()['prev']}</button>
-            <button name=action value=next type=submit>{L()['next']}</button>
-          </div>
-        </form>
-        """
-        return page(S['contact'], body)
+    PURGE_EVERY = 500  # writes between expiry sweeps
 
-    if n == 4:
-        opts = "".join([f"<option {'selected' if f.get('doc_type')==o else ''} value='{o}'>{o}</option>" for o in L()['doc_types']])
-        body = f"""
-        <h1>{S['gov_doc']}</h1>
-        <form method=post enctype=multipart/form-data>
-          <div class=row>
-            <div><label>{F['doc_type']}</label><select name=doc_type>{opts}</select></div>
-            <div><label>{F['doc_issued']}</label><input name=doc_issued_date placeholder="YYYY-MM-DD" value="{f.get('doc_issued_date','')}"></div>
-            <div><label>{F['upload']}</label><input type=file name=doc_file></div>
-            { f"<div><span class='hint'>Saved: {f.get('doc_file')}</span></div>" if f.get('doc_file') else '' }
-          </div>
-          <div class=actions>
-            <button class=ghost name=action value=prev type=submit>{L()['prev']}</button>
-            <button name=action value=next type=submit>{L()['next']}</button>
-          </div>
-        </form>
-        """
-        return page(S['gov_doc'], body)
+    def __init__(self, path, ttl=DRAFT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = SQLiteFile(path)
+        self._writes = 0
+        with self._conn() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS drafts (
+                    draft_id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_drafts_expires ON drafts (expires_at);
+                CREATE TABLE IF NOT EXISTS draft_fields (
+                    draft_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (draft_id, key)
+                ) WITHOUT ROWID;
+            """)
 
-    if n == 5:
-        opts = "".join([f"<option {'selected' if f.get('education')==o else ''} value='{o}'>{o}</option>" for o in L()['education_opts']])
-        body = f"""
-        <h1>{S['education']}</h1>
-        <form method=post>
-          <div class=row>
-            <div><label>{F['education']}</label><select name=education>{opts}</select></div>
-          </div>
-          <div class=actions>
-            <button class=ghost name=action value=prev type=submit>{L()['prev']}</button>
-            <button name=action value=next type=submit>{L()['next']}</button>
-          </div>
-        </form>
-        """
-        return page(S['education'], body)
+    def load(self, draft_id):
+        db = self._conn()
+        row = db.execute("SELECT expires_at FROM drafts WHERE draft_id = ?", (draft_id,)).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        return dict(db.execute("SELECT key, value FROM draft_fields WHERE draft_id = ?", (draft_id,)))
 
-    if n == 6:
-        body = f"""
-        <h1>{S['professional']}</h1>
-        <form method=post>
-          <div class=row>
-            <div><label>{F['job_title']}</label><input name=job_title value="{f.get('job_title','')}"></div>
-            <div><label>{F['experience_years']}</label><input name=experience_years value="{f.get('experience_years','')}"></div>
-            <div style="grid-column:1/-1"><label>{F['skills']}</label><textarea name=skills>{f.get('skills','')}</textarea></div>
-            <div style="grid-column:1/-1"><label>{F['org_name']}</label><input name=org_name value="{f.get('org_name','')}"></div>
-          </div>
-          <div class=actions>
-            <button class=ghost name=action value=prev type=submit>{L()['prev']}</button>
-            <button name=action value=next type=submit>{L()['next']}</button>
-          </div>
-        </form>
-        """
-        return page(S['professional'], body)
+    def update(self, draft_id, changes):
+        with self._conn() as db:
+            db.execute(
+                "INSERT INTO drafts (draft_id, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(draft_id) DO UPDATE SET expires_at = excluded.expires_at",
+                (draft_id, time.time() + self.ttl),
+            )
+            if changes:
+                db.executemany(
+                    "INSERT OR REPLACE INTO draft_fields (draft_id, key, value) VALUES (?, ?, ?)",
+                    [(draft_id, k, v) for k, v in changes.items()],
+                )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
 
-    if n == 7:
-        body = f"""
-        <h1>{S['family']} & {S['emergency']}</h1>
-        <form method=post>
-          <div class=row>
-            <div><label>{F['father']}</label><input name=father_name value="{f.get('father_name','')}"></div>
-            <div><label>{F['mother']}</label><input name=mother_name value="{f.get('mother_name','')}"></div>
-            <div><label>{F['spouse']}</label><input name=spouse_name value="{f.get('spouse_name','')}"></div>
-            <div><label>{F['children']}</label><input name=children value="{f.get('children','')}"></div>
-            <div><label>{F['em_name']}</label><input name=em_name value="{f.get('em_name','')}"></div>
-            <div><label>{F['em_relation']}</label><input name=em_relation value="{f.get('em_relation','')}"></div>
-            <div><label>{F['em_phone']}</label><input name=em_phone value="{f.get('em_phone','')}"></div>
-            <div><label>{F['em_address']}</label><input name=em_address value="{f.get('em_address','')}"></div>
-          </div>
-          <div class=actions>
-            <button class=ghost name=action value=prev type=submit>{L()['prev']}</button>
-            <button name=action value=next type=submit>{L()['next']}</button>
-          </div>
-        </form>
-        """
-        return page(S['family'], body)
-
-    if n == 8:
-        m_opts = "".join([f"<option {'selected' if f.get('membership_type')==o else ''} value='{o}'>{o}</option>" for o in L()['membership_opts']])
-        p_opts = "".join([f"<option {'selected' if f.get('pay_method')==o else ''} value='{o}'>{o}</option>" for o in L()['payment_opts']])
-        checked = "checked" if f.get("declaration") == "yes" else ""
-        body = f"""
-        <h1>{S['membership']} & {S['payment']}</h1>
-        <form method=post enctype=multipart/form-data>
-          <div class=row>
-            <div><label>{F['membership_type']}</label><select name=membership_type>{m_opts}</select></div>
-            <div><label>{F['pay_method']}</label><select name=pay_method>{p_opts}</select></div>
-            <div><label>{F['transaction_id']}</label><input name=transaction_id value="{f.get('transaction_id','')}"></div>
-            <div><label>{F['payment_file']}</label><input type=file name=payment_file></div>
-            { f"<div><span class='hint'>Saved: {f.get('payment_file')}</span></div>" if f.get('payment_file') else '' }
-          </div>
-          <div class=divider></div>
-          <label><input type=checkbox name=declaration value=yes {checked}> {F['agree']}</label>
-          <div class=actions>
-            <button class=ghost name=action value=prev type=submit>{L()['prev']}</button>
-            <button name=action value=next type=submit>{L()['next']}</button>
-          </div>
-        </form>
-        """
-        return page(S['payment'], body)
-
-    if n == 9:
-        # Review page
-        def fmt_file(key):
-            fname = get_form().get(key)
-            if not fname:
-                return "—"
-            return f"<a href='{url_for('uploaded', filename=fname)}' target=_blank>{fname}</a>"
-
-        body = f"""
-        <h1>{S['review']}</h1>
-        <div class=hint>Review your details below. Click Previous to make changes or Finish to submit.</div>
-        <div class=divider></div>
-        <h3>{S['member_info']}</h3>
-        <ul>
-          <li>{F['name']}: {f.get('name','')}</li>
-          <li>{F['full_name_en']}: {f.get('full_name_en','')}</li>
-          <li>{F['dob']}: {f.get('dob_bs','')}</li>
-          <li>{F['dob_ad']}: {f.get('dob_ad','')}</li>
-          <li>{F['gender']}: {f.get('gender','')}</li>
-          <li>{F['occupation']}: {f.get('occupation','')}</li>
-        </ul>
-        <h3>{S['contact']}</h3>
-        <ul>
-          <li>{F['perm_address']}: {f.get('perm_address','')}</li>
-          <li>{F['temp_address']}: {f.get('temp_address','')}</li>
-          <li>{F['phone']}: {f.get('phone','')}</li>
-          <li>{F['email']}: {f.get('email','')}</li>
-        </ul>
-        <h3>{S['gov_doc']}</h3>
-        <ul>
-          <li>{F['doc_type']}: {f.get('doc_type','')}</li>
-          <li>{F['doc_issued']}: {f.get('doc_issued_date','')}</li>
-          <li>{F['upload']}: {fmt_file('doc_file')}</li>
-        </ul>
-        <h3>{S['education']}</h3>
-        <ul>
-          <li>{F['education']}: {f.get('education','')}</li>
-        </ul>
-        <h3>{S['professional']}</h3>
-        <ul>
-          <li>{F['job_title']}: {f.get('job_title','')}</li>
-          <li>{F['experience_years']}: {f.get('experience_years','')}</li>
-          <li>{F['skills']}: {f.get('skills','')}</li>
-          <li>{F['org_name']}: {f.get('org_name','')}</li>
-        </ul>
-        <h3>{S['family']}</h3>
-        <ul>
-          <li>{F['father']}: {f.get('father_name','')}</li>
-          <li>{F['mother']}: {f.get('mother_name','')}</li>
-          <li>{F['spouse']}: {f.get('spouse_name','')}</li>
-          <li>{F['children']}: {f.get('children','')}</li>
-        </ul>
-        <h3>{S['emergency']}</h3>
-        <ul>
-          <li>{F['em_name']}: {f.get('em_name','')}</li>
-          <li>{F['em_relation']}: {f.get('em_relation','')}</li>
-          <li>{F['em_phone']}: {f.get('em_phone','')}</li>
-          <li>{F['em_address']}: {f.get('em_address','')}</li>
-        </ul>
-        <h3>{S['payment']}</h3>
-        <ul>
-          <li>{F['pay_method']}: {f.get('pay_method','')}</li>
-          <li>{F['transaction_id']}: {f.get('transaction_id','')}</li>
-          <li>{F['payment_file']}: {fmt_file('payment_file')}</li>
-        </ul>
-        <div class=divider></div>
-        <form method=post action="{url_for('final_submit')}">
-          <div class=actions>
-            <a href="{url_for('step', n=8)}"><button class=ghost type=button>{L()['prev']}</button></a>
-            <button type=submit>{L()['finish']}</button>
-          </div>
-        </form>
-        """
-        return page(S['review'], body)
+    def delete(self, draft_id):
+        with self._conn() as db:
+            db.execute("DELETE FROM draft_fields WHERE draft_id = ?", (draft_id,))
+            db.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
 
-    # fallback redirect
-    return redirect(url_for("index"))
+    def referenced_files(self):
+        marks = ",".join("?" * len(FILE_FIELDS))
+        rows = self._conn().execute(
+            f"SELECT value FROM draft_fields JOIN drafts USING (draft_id) "
+            f"WHERE key IN ({marks}) AND expires_at >= ?", (*FILE_FIELDS, time.time()))
+        return {value for value, in rows if value}
 
+    def purge(self):
+        """Drop expired drafts."""
+        with self._conn() as db:
+            now = time.time()
+            db.execute(
+                "DELETE FROM draft_fields WHERE draft_id IN "
+                "(SELECT draft_id FROM drafts WHERE expires_at < ?)", (now,))
+            db.execute("DELETE FROM drafts WHERE expires_at < ?", (now,))
 
-@app.route("/submit", methods=["POST"])  # not used directly in wizard, kept for safety
 
-def final_submit():
+class RedisDraftStore:
+    """Drafts as Redis hashes (HSET only the changed fields, EXPIRE for TTL)."""
+
+    def __init__(self, url, ttl=DRAFT_TTL):
+        if redis is None:
+            raise RuntimeError("DRAFT_STORE=redis needs the 'redis' package")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+
+    def _key(self, draft_id):
+        return f"draft:{draft_id}"
+
+    def load(self, draft_id):
+        key = self._key(draft_id)
+        pipe = self.client.pipeline()
+        pipe.exists(key)
+        pipe.hgetall(key)
+        exists, fields = pipe.execute()
+        if not exists:
+            return None
+        fields.pop("", None)
+        return fields
+
+    def update(self, draft_id, changes):
+        key = self._key(draft_id)
+        pipe = self.client.pipeline()
+        # "" is a placeholder so a draft with no fields yet still exists
+        pipe.hset(key, mapping={**changes, "": ""})
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def delete(self, draft_id):
+        self.client.delete(self._key(draft_id))
+
+    def referenced_files(self):
+        names = set()
+        for key in self.client.scan_iter(match=self._key("*"), count=1000):
+            names.update(v for v in self.client.hmget(key, FILE_FIELDS) if v)
+        return names
+
+
+def make_draft_store(kind):
+    if kind == "memory":
+        return MemoryDraftStore()
+    if kind == "redis":
+        return RedisDraftStore(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    if kind == "sqlite":
+        return SQLiteDraftStore(os.environ.get("DRAFT_DB", os.path.join(BASE_DIR, "drafts.db")))
+    raise ValueError(f"Unknown DRAFT_STORE: {kind}")
+
+
+drafts = make_draft_store(os.environ.get("DRAFT_STORE", "sqlite"))
+
+# ------------------------------------------------------------------
+# Bikram Sambat ⇄ Gregorian dates
+#
+# Month lengths per BS year (Baisakh … Chaitra); 1975-01-01 BS is
+# 1918-04-13 AD. Both directions are table lookups: BS→AD adds the
+# precomputed start offset of the month, AD→BS indexes a per-day array.
+# ------------------------------------------------------------------
+BS_EPOCH_AD = date(1918, 4, 13)
+BS_MONTH_DAYS = {
+    1975: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    1976: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    1977: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    1978: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1979: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    1980: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    1981: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    1982: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1983: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    1984: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    1985: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    1986: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1987: (31, 32, 31, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    1988: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    1989: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    1990: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1991: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30),
+    1992: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    1993: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1994: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1995: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30),
+    1996: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    1997: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1998: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    1999: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2000: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2001: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2002: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2003: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2004: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2005: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2006: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2007: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2008: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 29, 31),
+    2009: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2010: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2011: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2012: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    2013: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2014: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2015: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2016: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    2017: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2018: (31, 32, 31, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2019: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2020: (31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30),
+    2021: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2022: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30),
+    2023: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2024: (31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30),
+    2025: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2026: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2027: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2028: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2029: (31, 31, 32, 31, 32, 30, 30, 29, 30, 29, 30, 30),
+    2030: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2031: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2032: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2033: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2034: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2035: (30, 32, 31, 32, 31, 31, 29, 30, 30, 29, 29, 31),
+    2036: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2037: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2038: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2039: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    2040: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2041: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2042: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2043: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    2044: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2045: (31, 32, 31, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2046: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2047: (31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30),
+    2048: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2049: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30),
+    2050: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2051: (31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30),
+    2052: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2053: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30),
+    2054: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2055: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2056: (31, 31, 32, 31, 32, 30, 30, 29, 30, 29, 30, 30),
+    2057: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2058: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2059: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2060: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2061: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2062: (31, 31, 31, 32, 31, 31, 29, 30, 29, 30, 29, 31),
+    2063: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2064: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2065: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2066: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 29, 31),
+    2067: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2068: (31, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2069: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2070: (31, 31, 31, 32, 31, 31, 29, 30, 30, 29, 30, 30),
+    2071: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2072: (31, 32, 31, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2073: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 31),
+    2074: (31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30),
+    2075: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2076: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30),
+    2077: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2078: (31, 31, 31, 32, 31, 31, 30, 29, 30, 29, 30, 30),
+    2079: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2080: (31, 32, 31, 32, 31, 30, 30, 30, 29, 29, 30, 30),
+    2081: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 29, 31),
+    2082: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2083: (31, 31, 32, 31, 31, 31, 30, 29, 30, 29, 30, 30),
+    2084: (31, 31, 32, 31, 31, 30, 30, 30, 29, 30, 30, 30),
+    2085: (31, 32, 31, 32, 30, 31, 30, 30, 29, 30, 30, 30),
+    2086: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 30, 30),
+    2087: (31, 31, 32, 31, 31, 31, 30, 29, 30, 30, 30, 30),
+    2088: (30, 31, 32, 32, 30, 31, 30, 30, 29, 30, 30, 30),
+    2089: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 30, 30),
+    2090: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 30, 30),
+    2091: (31, 31, 32, 31, 31, 31, 30, 30, 29, 30, 30, 30),
+    2092: (30, 31, 32, 32, 31, 30, 30, 30, 29, 30, 30, 30),
+    2093: (30, 32, 31, 32, 31, 30, 30, 30, 29, 30, 30, 30),
+    2094: (31, 31, 32, 31, 31, 30, 30, 30, 29, 30, 30, 30),
+    2095: (31, 31, 32, 31, 31, 31, 30, 29, 30, 30, 30, 30),
+    2096: (30, 31, 32, 32, 31, 30, 30, 29, 30, 29, 30, 30),
+    2097: (31, 32, 31, 32, 31, 30, 30, 30, 29, 30, 30, 30),
+    2098: (31, 31, 32, 31, 31, 31, 29, 30, 29, 30, 29, 31),
+    2099: (31, 31, 32, 31, 31, 31, 30, 29, 29, 30, 30, 30),
+    2100: (31, 32, 31, 32, 30, 31, 30, 29, 30, 29, 30, 30),
+}
+BS_MIN_YEAR, BS_MAX_YEAR = min(BS_MONTH_DAYS), max(BS_MONTH_DAYS)
+
+# Days from the epoch to the first day of each BS month, indexed by
+# (year - BS_MIN_YEAR) * 12 + month - 1, and the month index of every day.
+_bs_month_start = array("l")
+_bs_month_of_day = array("H")
+for _days in BS_MONTH_DAYS.values():
+    for _n in _days:
+        _bs_month_of_day.extend([len(_bs_month_start)] * _n)
+        _bs_month_start.append(len(_bs_month_of_day) - _n)
+_BS_EPOCH_ORD = BS_EPOCH_AD.toordinal()
+BS_MIN_AD = BS_EPOCH_AD
+BS_MAX_AD = date.fromordinal(_BS_EPOCH_ORD + len(_bs_month_of_day) - 1)
+
+# Applicants type Devanagari digits and various separators.
+_DIGITS = str.maketrans("०१२३४५६७८९", "0123456789")
+_DATE_RE = re.compile(r"\s*(\d{4})\s*[-/.]\s*(\d{1,2})\s*[-/.]\s*(\d{1,2})\s*")
+
+
+def bs_to_ad(year: int, month: int, day: int) -> date:
+    """Gregorian date of BS year-month-day. Raises ValueError if invalid."""
+    if year not in BS_MONTH_DAYS or not 1 <= month <= 12:
+        raise ValueError(f"BS date out of range: {year}-{month}-{day}")
+    if not 1 <= day <= BS_MONTH_DAYS[year][month - 1]:
+        raise ValueError(f"day out of range for BS {year}-{month}: {day}")
+    idx = (year - BS_MIN_YEAR) * 12 + month - 1
+    return date.fromordinal(_BS_EPOCH_ORD + _bs_month_start[idx] + day - 1)
+
+
+def ad_to_bs(d: date):
+    """(year, month, day) in BS for Gregorian date `d`."""
+    offset = d.toordinal() - _BS_EPOCH_ORD
+    if not 0 <= offset < len(_bs_month_of_day):
+        raise ValueError(f"AD date out of range: {d}")
+    idx = _bs_month_of_day[offset]
+    return BS_MIN_YEAR + idx // 12, idx % 12 + 1, offset - _bs_month_start[idx] + 1
+
+
+def parse_ymd(value):
+    """(year, month, day) from 'YYYY-MM-DD' (also / or . separators and
+    Devanagari digits), or None."""
+    m = _DATE_RE.fullmatch((value or "").translate(_DIGITS))
+    return tuple(int(x) for x in m.groups()) if m else None
+
+
+@lru_cache(maxsize=8192)
+def bs_string_to_ad(value):
+    """Gregorian date for a typed BS date string, or None if it isn't one."""
+    ymd = parse_ymd(value)
+    try:
+        return bs_to_ad(*ymd) if ymd else None
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=8192)
+def ad_string_to_bs(value):
+    """'YYYY-MM-DD' BS string for a typed AD date string, or None."""
+    ymd = parse_ymd(value)
+    try:
+        return "%04d-%02d-%02d" % ad_to_bs(date(*ymd)) if ymd else None
+    except ValueError:
+        return None
+
+
+# "2015-03-10 B.S.", "२०७०/०१/०१ वि.सं.", "2013-04-14 (AD)"
+_CALENDAR_RE = re.compile(r"(.*?)(?:\s*\(?(b\.?\s?s|a\.?\s?d|वि\.?\s?सं|ई\.?\s?सं|ई)\.?\)?)?", re.I)
+
+
+def issued_date_readings(value, dob=None):
+    """Plausible Gregorian readings of a typed document issue date.
+
+    Applicants write either calendar, optionally followed by B.S. / A.D.
+    (वि.सं. / ई.सं.). A reading is plausible if it falls between 1950
+    A.D. (or `dob`, if later) and today. Returns the B.S. reading first.
+    """
+    m = _CALENDAR_RE.fullmatch((value or "").strip())
+    ymd = parse_ymd(m.group(1))
+    if not ymd:
+        return []
+    marker = (m.group(2) or "").lower()
+    converters = {"": (bs_to_ad, date), "b": (bs_to_ad,), "व": (bs_to_ad,)}.get(marker[:1], (date,))
+    today = date.today()
+    earliest = max(date(1950, 1, 1), dob or date.min)
+    readings = []
+    for convert in converters:
+        try:
+            d = convert(*ymd)
+        except ValueError:
+            continue
+        if earliest <= d <= today:
+            readings.append(d)
+    return readings
+
+
+def issued_date_to_ad(value, dob=None):
+    """Gregorian date for a typed document issue date, or None if it is
+    not a date or reads as a plausible date in both calendars (B.S. 2015
+    and A.D. 2015 both lie in the past): those need a calendar marker."""
+    readings = issued_date_readings(value, dob)
+    return readings[0] if len(readings) == 1 else None
+
+
+def bs_to_ad_many(values):
+    """Convert a column of BS date strings; None where a value isn't a
+    valid BS date. Each distinct value is converted once."""
+    seen = {}
+    out = []
+    for v in values:
+        if v not in seen:
+            seen[v] = bs_string_to_ad(v)
+        out.append(seen[v])
+    return out
+
+
+def ad_to_bs_many(values):
+    """Convert a column of AD dates or date strings to BS strings."""
+    seen = {}
+    out = []
+    for v in values:
+        if v not in seen:
+            if isinstance(v, date):
+                try:
+                    seen[v] = "%04d-%02d-%02d" % ad_to_bs(v)
+                except ValueError:
+                    seen[v] = None
+            else:
+                seen[v] = ad_string_to_bs(v)
+        out.append(seen[v])
+    return out
+
+
+# ------------------------------------------------------------------
+# Helper functions
+# ------------------------------------------------------------------
+
+def upload_ext(filename: str) -> str:
+    """Lower-case extension of the name as sent. Blobs are stored under
+    their hash, so the rest of the name is never used (and may well be
+    Devanagari)."""
+    return os.path.splitext(filename)[1][1:].lower()
+
+
+def allowed_file(filename: str) -> bool:
+    return upload_ext(filename) in ALLOWED_EXTS
+
+
+def spool_upload(file_storage):
+    """The upload as an UploadSpool, streaming it to disk if the request
+    parser didn't already."""
+    stream = file_storage.stream
+    if isinstance(stream, UploadSpool):
+        return stream
+    spool = UploadSpool()
+    try:
+        for chunk in iter(lambda: stream.read(UPLOAD_CHUNK), b""):
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+
+def blob_name(digest: str, ext: str) -> str:
+    """Content-addressed name of an upload, sharded two levels deep
+    (ab/cd/abcd…) so no directory grows past a few hundred entries."""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+def save_upload(file_storage):
+    if not file_storage or file_storage.filename == "":
+        return None
+    if not allowed_file(file_storage.filename):
+        return None
+    with metrics.timer("phase_duration_seconds", (("phase", "upload_store"),)):
+        name = store_upload(file_storage)
+    return name
+
+
+def store_upload(file_storage):
+    spool = spool_upload(file_storage)
+    if not spool.size:
+        return None
+    metrics.inc("uploads_total")
+    metrics.inc("upload_bytes_total", value=spool.size)
+    ext = original_ext = upload_ext(file_storage.filename)
+    processed = source_link = None
+    if IMAGE_PROCESSING and ext in IMAGE_EXTS and spool.path:
+        # A photo processed before (re-upload on step 4/8) is found by the
+        # hash of the bytes as received, without encoding it again.
+        source_link = os.path.join(app.config["UPLOAD_FOLDER"], blob_name(spool.sha256, ext) + ".src")
+        if os.path.exists(source_link):
+            spool.close()
+            path = os.path.realpath(source_link)
+            os.utime(path)
+            return os.path.relpath(path, os.path.realpath(app.config["UPLOAD_FOLDER"])).replace(os.sep, "/")
+        processed = process_image(spool)
+    if processed:
+        tmp, digest, ext = processed
+    elif spool.size > UPLOAD_MAX_FILE:
+        # Only an image that shrinks may arrive above the stored-file cap.
+        spool.close()
+        raise RequestEntityTooLarge(f"File larger than {UPLOAD_MAX_FILE // (1024 * 1024)} MB")
+    else:
+        digest = spool.sha256
+    name = blob_name(digest, ext)
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    if os.path.exists(path):
+        # Same bytes already stored (e.g. re-upload on step 4/8): reuse the
+        # blob and bump its mtime so the GC grace period starts over.
+        if processed:
+            os.unlink(tmp)
+        spool.close()
+        os.utime(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if processed:
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+            if IMAGE_KEEP_ORIGINAL:
+                spool.commit(f"{path}.orig.{original_ext}")
+            else:
+                spool.close()
+        else:
+            spool.commit(path)
+    if processed:
+        os.makedirs(os.path.dirname(source_link), exist_ok=True)
+        tmp_link = f"{source_link}.{uuid.uuid4().hex[:8]}.tmp"
+        os.symlink(os.path.relpath(path, os.path.dirname(source_link)), tmp_link)
+        os.replace(tmp_link, source_link)  # also replaces a link left dangling
+    schedule_preview(name)
+    return name
+
+
+def current_lang() -> str:
+    lang = session.get("lang", "en")
+    return lang if lang in LABELS else "en"
+
+
+def L():
+    """Current labels based on session language."""
+    return LABELS[current_lang()]
+
+
+FINISHED = "_finished"  # draft key marking a submitted draft
+
+
+def get_form():
+    """The current draft's fields, loaded once per request."""
+    if "form" not in g:
+        draft_id = session.get("draft")
+        with metrics.timer("phase_duration_seconds", (("phase", "draft"),)):
+            f = drafts.load(draft_id) if draft_id else None
+        if f is not None and FINISHED in f:
+            # Already submitted: remember it for a retried Finish, and give
+            # anything else a fresh draft.
+            g.finished = draft_id
+            f = draft_id = None
+        if f is None:
+            f = {}
+            if not draft_id:
+                # An id with nothing stored yet (or expired) is kept, so a
+                # draft keeps one id from its first page view on.
+                session["draft"] = uuid.uuid4().hex
+        g.form = f
+    return g.form
+
+
+def update_form(values):
+    """Merge `values` into the draft, writing only the fields that changed."""
     f = get_form()
-    if not f.get("name"):
-        flash("Session expired or incomplete. Please start again.")
-        return redirect(url_for("index"))
+    changes = {k: v for k, v in values.items() if f.get(k) != v}
+    f.update(changes)
+    with metrics.timer("phase_duration_seconds", (("phase", "draft"),)):
+        drafts.update(session["draft"], changes)
 
-    # Create DB row
-    db = DBSession()
+
+def discard_form(finished=False):
+    draft_id = session.pop("draft", None)
+    if draft_id:
+        drafts.delete(draft_id)
+        if finished:
+            # Leave a marker under the old id, so a Finish retried with the
+            # old cookie (its first response lost) still gets its reference.
+            drafts.update(draft_id, {FINISHED: "1"})
+    g.pop("form", None)
+
+# ------------------------------------------------------------------
+# Validation
+#
+# A rule takes a stripped, non-empty value and returns (value, error
+# key); the value may come back normalized (phone numbers are kept as
+# bare digits). Error keys index the language pack's "errors". Unique
+# fields are then looked up in their members index.
+# ------------------------------------------------------------------
+# Mobile, or landline with area code; abroad the trunk 0 is dropped
+# (+977-1-4123456), and we store the domestic form.
+PHONE_RE = re.compile(r"(?:\+?977)?(9[678]\d{8}|0\d{7,9})|\+?977([1-9]\d{6,8})")
+PHONE_JUNK = str.maketrans("", "", " -().")
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[a-z]{2,}")
+TXID_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{3,63}")
+
+
+def check_phone(value):
+    m = PHONE_RE.fullmatch(value.translate(_DIGITS).translate(PHONE_JUNK))
+    if not m:
+        return value, "phone"
+    return m.group(1) or "0" + m.group(2), None
+
+
+def check_email(value):
+    value = value.lower()
+    return value, None if EMAIL_RE.fullmatch(value) else "email"
+
+
+def check_txid(value):
+    return value, None if TXID_RE.fullmatch(value) else "txid"
+
+
+def check_bs_date(value):
+    return value, None if bs_string_to_ad(value) else "date"
+
+
+def check_ad_date(value):
     try:
-        dob_ad_val = None
-        if f.get("dob_ad"):
-            try:
-                dob_ad_val = datetime.strptime(f["dob_ad"], "%Y-%m-%d").date()
-            except ValueError:
-                dob_ad_val = None
-
-        m = Member(
-            lang=session.get("lang", "en"),
-            name=f.get("name"),
-            full_name_en=f.get("full_name_en"),
-            dob_bs=f.get("dob_bs"),
-            dob_ad=dob_ad_val,
-            gender=f.get("gender"),
-            occupation=f.get("occupation"),
-            perm_address=f.get("perm_address"),
-            temp_address=f.get("temp_address"),
-            phone=f.get("phone"),
-            email=f.get("email"),
-            doc_type=f.get("doc_type"),
-            doc_issued_date=f.get("doc_issued_date"),
-            doc_file=f.get("doc_file"),
-            education=f.get("education"),
-            job_title=f.get("job_title"),
-            experience_years=f.get("experience_years"),
-            skills=f.get("skills"),
-            org_name=f.get("org_name"),
-            membership_type=f.get("membership_type"),
-            father_name=f.get("father_name"),
-            mother_name=f.get("mother_name"),
-            spouse_name=f.get("spouse_name"),
-            children=f.get("children"),
-            em_name=f.get("em_name"),
-            em_relation=f.get("em_relation"),
-            em_phone=f.get("em_phone"),
-            em_address=f.get("em_address"),
-            pay_method=f.get("pay_method"),
-            transaction_id=f.get("transaction_id"),
-            payment_file=f.get("payment_file"),
-            declaration=f.get("declaration"),
-        )
-        db.add(m)
-        db.commit()
-        session.pop("form", None)
-        return redirect(url_for("thankyou"))
+        date.fromisoformat(value)
+        return value, None
+    except ValueError:
+        return value, "date"
+
+
+def check_any_date(value):
+    readings = issued_date_readings(value)
+    if not readings:
+        return value, "date"
+    return value, None if len(readings) == 1 else "date_calendar"
+
+
+RULES = {
+    "phone": check_phone,
+    "email": check_email,
+    "txid": check_txid,
+    "bs_date": check_bs_date,
+    "ad_date": check_ad_date,
+    "any_date": check_any_date,
+}
+# step -> ((name, required, rule function, unique), ...)
+STEP_CHECKS = {
+    n: tuple((f.name, f.required, RULES.get(f.rule), f.unique)
+             for f in map(FIELDS.get, STEP_INPUTS.get(n, ())) if f.required or f.rule or f.unique)
+    for n, _ in WIZARD
+}
+# A member saved under the draft's own key doesn't count: that is this
+# applicant's Finish, committed before a retry.
+_taken_sql = {k: text(f"SELECT 1 FROM members WHERE {k} = :v AND COALESCE(submission_key, '') <> :key LIMIT 1")
+              for k in UNIQUE_FIELDS}
+
+
+def validate_step(n, values, key=None):
+    """Check step `n`'s collected values, normalizing them in place.
+    `key` is the draft's submission key.
+
+    Returns {field: error key}; empty when the step is fine.
+    """
+    errors, unique = check_step(n, values)
+    if unique:
+        with engine.connect() as conn:
+            for name, value in unique:
+                if conn.execute(_taken_sql[name], {"v": value, "key": key or ""}).first():
+                    errors[name] = "taken"
+    return errors
+
+
+def check_step(n, values):
+    """The part of validate_step() that needs no database: returns
+    (errors, [(field, value) that must not be taken yet])."""
+    errors = {}
+    unique = []
+    for name, required, rule, is_unique in STEP_CHECKS.get(n, ()):
+        value = values.get(name, "").strip()
+        values[name] = value
+        if not value:
+            if required:
+                errors[name] = "required"
+            continue
+        if rule:
+            value, error = rule(value)
+            values[name] = value
+            if error:
+                errors[name] = error
+                continue
+        if is_unique:
+            unique.append((name, value))
+    return errors, unique
+
+
+def validate_form(f, key=None):
+    """(step, {field: error key}) of the first step of draft `f` that fails
+    validation, or (None, {})."""
+    for n, _ in WIZARD:
+        values = {k: f.get(k) or "" for k in STEP_INPUTS.get(n, ())}
+        errors = validate_step(n, values, key)
+        if errors:
+            return n, errors
+    return None, {}
+
+
+def error_messages(errors):
+    """{field: message in the current language}."""
+    texts = L()["errors"]
+    return {k: texts[v] for k, v in errors.items()}
+
+
+# ------------------------------------------------------------------
+# Image recompression (IMAGE_PROCESSING=1, needs Pillow)
+#
+# Phone photos of documents arrive as 8-12 MB JPEGs. Before an image
+# upload is stored it is rotated upright from its EXIF orientation,
+# stripped of metadata (EXIF, GPS), capped at IMAGE_MAX_SIDE pixels and
+# re-encoded at IMAGE_QUALITY. This runs in a process pool so the CPU work
+# stays off the web worker's interpreter. The original is kept next to the
+# blob as <blob>.orig.<ext> only with IMAGE_KEEP_ORIGINAL=1.
+#
+# Image parts may be received up to IMAGE_MAX_FILE; UPLOAD_MAX_FILE then
+# applies only to an image stored as received (processing failed). A
+# symlink named after the hash of the received bytes (<raw blob>.src)
+# points at the processed blob, so the same photo uploaded again is not
+# re-encoded.
+# ------------------------------------------------------------------
+IMAGE_PROCESSING = os.environ.get("IMAGE_PROCESSING", "") not in ("", "0") and Image is not None
+IMAGE_EXTS = {"png", "jpg", "jpeg"}
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", 2000))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 80))
+IMAGE_KEEP_ORIGINAL = os.environ.get("IMAGE_KEEP_ORIGINAL", "") not in ("", "0")
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+IMAGE_TIMEOUT = 60  # seconds; past this the upload is stored as received
+# Images may arrive this large; UPLOAD_MAX_FILE applies to what is stored.
+IMAGE_MAX_FILE = int(os.environ.get("IMAGE_MAX_FILE", 20 * 1024 * 1024))
+_image_pool = None
+_image_pool_pid = None
+_image_pool_lock = threading.Lock()
+
+
+def upload_max_size(filename):
+    """Bytes a file part may have while it is received."""
+    if IMAGE_PROCESSING and upload_ext(filename) in IMAGE_EXTS:
+        return max(IMAGE_MAX_FILE, UPLOAD_MAX_FILE)
+    return UPLOAD_MAX_FILE
+
+
+def recompress_image(src, dest, max_side, quality):
+    """Write a normalized copy of image `src` to `dest` (runs in the pool).
+
+    Returns the extension of the written format, or None if re-encoding
+    wouldn't help (a PNG that would only grow).
+    """
+    with Image.open(src) as im:
+        fmt = im.format
+        im.draft("RGB", (max_side, max_side))  # JPEGs decode at reduced scale
+        im = ImageOps.exif_transpose(im)
+        if max(im.size) > max_side:
+            im.thumbnail((max_side, max_side), Image.LANCZOS)
+        if fmt == "PNG":
+            # Screenshots (payment proofs) stay lossless.
+            im.save(dest, "PNG", optimize=True)
+            if os.path.getsize(dest) >= os.path.getsize(src):
+                return None
+            return "png"
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        # No exif= argument: metadata is dropped.
+        im.save(dest, "JPEG", quality=quality, optimize=True, progressive=True)
+        return "jpg"
+
+
+def process_image(spool):
+    """Recompress an uploaded image in the worker pool.
+
+    Returns (temp_path, sha256, ext) of the processed file, or None to
+    store the upload as received.
+    """
+    global _image_pool, _image_pool_pid
+    if _image_pool_pid != os.getpid():
+        with _image_pool_lock:  # first uploads may arrive on several threads
+            if _image_pool_pid != os.getpid():
+                # forkserver: children don't inherit this process's threads/locks.
+                _image_pool = ProcessPoolExecutor(IMAGE_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+                _image_pool_pid = os.getpid()
+    spool.flush()
+    fd, out = tempfile.mkstemp(dir=UPLOAD_TMP_DIR)
+    os.close(fd)
+    try:
+        ext = _image_pool.submit(recompress_image, spool.path, out, IMAGE_MAX_SIDE, IMAGE_QUALITY) \
+            .result(timeout=IMAGE_TIMEOUT)
+        if ext is None:
+            os.unlink(out)
+            return None
+        with open(out, "rb") as fh:
+            digest = hashlib.file_digest(fh, "sha256").hexdigest()
+        return out, digest, ext
+    except Exception as e:
+        app.logger.warning("image processing failed, keeping original: %s", e)
+        os.unlink(out)
+        return None
+
+
+# ------------------------------------------------------------------
+# Upload previews
+#
+# Small thumbnails of uploaded images (needs Pillow) and of a PDF's first
+# page (needs poppler's pdftoppm), rendered by a background pool and
+# cached next to the blob as <blob>.thumb.<ext>. Pages show a preview
+# once it exists and a plain link until then.
+# ------------------------------------------------------------------
+PREVIEW_SIZE = (320, 320)
+PREVIEW_EXT = "webp" if Image is not None and pil_features.check("webp") else "jpg"
+PREVIEW_WORKERS = int(os.environ.get("PREVIEW_WORKERS", 2))
+PDFTOPPM = shutil.which("pdftoppm")
+_preview_pool = None
+_preview_pool_pid = None
+_preview_pool_lock = threading.Lock()
+
+
+def preview_name(name: str) -> str:
+    return f"{name}.thumb.{PREVIEW_EXT}"
+
+
+def can_preview(name: str) -> bool:
+    ext = name.rsplit(".", 1)[-1].lower()
+    if ext == "pdf":
+        return PDFTOPPM is not None
+    return ext in ALLOWED_EXTS and Image is not None
+
+
+def _thumbnail(src, dest):
+    with Image.open(src) as im:
+        im.draft("RGB", PREVIEW_SIZE)  # JPEGs decode at reduced scale
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail(PREVIEW_SIZE)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        im.save(dest, "WEBP" if PREVIEW_EXT == "webp" else "JPEG", quality=75)
+
+
+def make_preview(name):
+    """Render the preview of upload `name` unless it already exists.
+    Returns True if a preview was written."""
+    src = os.path.join(UPLOAD_DIR, name)
+    dest = os.path.join(UPLOAD_DIR, preview_name(name))
+    if os.path.exists(dest) or not os.path.exists(src):
+        return False
+    fd, tmp = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, suffix="." + PREVIEW_EXT)
+    os.close(fd)
+    try:
+        if name.lower().endswith(".pdf"):
+            with tempfile.TemporaryDirectory(dir=UPLOAD_TMP_DIR) as work:
+                page1 = os.path.join(work, "page")
+                subprocess.run(
+                    [PDFTOPPM, "-f", "1", "-l", "1", "-singlefile", "-jpeg",
+                     "-scale-to", str(max(PREVIEW_SIZE)), src, page1],
+                    check=True, capture_output=True, timeout=60,
+                )
+                if Image is None:
+                    os.replace(page1 + ".jpg", tmp)
+                else:
+                    _thumbnail(page1 + ".jpg", tmp)
+        else:
+            _thumbnail(src, tmp)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dest)
+        return True
     except Exception as e:
+        app.logger.warning("preview of %s failed: %s", name, e)
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def schedule_preview(name):
+    """Queue `name` for preview rendering; never blocks the request."""
+    global _preview_pool, _preview_pool_pid
+    if not can_preview(name) or os.path.exists(os.path.join(UPLOAD_DIR, preview_name(name))):
+        return
+    if _preview_pool_pid != os.getpid():
+        with _preview_pool_lock:  # first uploads may arrive on several threads
+            if _preview_pool_pid != os.getpid():
+                # One pool per worker process (threads don't survive a fork).
+                _preview_pool = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix="preview")
+                _preview_pool_pid = os.getpid()
+    _preview_pool.submit(make_preview, name)
+
+
+@app.template_global()
+def preview_url(name):
+    """URL of the preview for upload `name`, or None if there isn't one yet."""
+    if name and os.path.exists(os.path.join(UPLOAD_DIR, preview_name(name))):
+        return url_for("uploaded", filename=preview_name(name))
+    return None
+
+
+@app.cli.command("make-previews")
+def make_previews_command():
+    """Render missing previews for every stored upload."""
+    n = 0
+    for root, dirs, files in os.walk(UPLOAD_DIR):
+        if root == UPLOAD_DIR:
+            dirs[:] = [d for d in dirs if d != ".tmp"]
+        for fn in files:
+            name = os.path.relpath(os.path.join(root, fn), UPLOAD_DIR).replace(os.sep, "/")
+            if ".thumb." not in fn and ".orig." not in fn and can_preview(name) \
+                    and not os.path.exists(os.path.join(UPLOAD_DIR, preview_name(name))):
+                n += make_preview(name)
+    click.echo(f"Rendered {n} preview(s).")
+
+
+# ------------------------------------------------------------------
+# Submissions
+#
+# SUBMIT_MODE=sync (default) inserts the member inside the Finish
+# request. SUBMIT_MODE=write-behind appends it to a local journal
+# instead and a background thread inserts journaled members in batches.
+# Either way the draft id is the submission's idempotency key, so a
+# retried Finish can never create a second member; the finished draft
+# is kept as a marker until DRAFT_TTL, so the retry gets the same
+# reference back.
+# ------------------------------------------------------------------
+SUBMIT_MODE = os.environ.get("SUBMIT_MODE", "sync")
+SUBMIT_JOURNAL_DIR = os.environ.get("SUBMIT_JOURNAL_DIR", os.path.join(BASE_DIR, "journal"))
+
+
+def member_values(f, lang, key):
+    """Column values for a Member row built from a draft."""
+    dob_ad_val = None
+    if f.get("dob_ad"):
+        try:
+            dob_ad_val = datetime.strptime(f["dob_ad"], "%Y-%m-%d").date()
+        except ValueError:
+            dob_ad_val = None
+    if dob_ad_val is None:
+        dob_ad_val = bs_string_to_ad(f.get("dob_bs"))
+
+    values = {k: f.get(k) for k in FIELDS}
+    values.update(
+        submission_key=key,
+        lang=lang,
+        dob_ad=dob_ad_val,
+        doc_issued_ad=issued_date_to_ad(f.get("doc_issued_date"), dob_ad_val),
+    )
+    return values
+
+
+def insert_members(conn, rows):
+    """Insert many member rows at once, skipping submission keys that are
+    already in the table."""
+    table = Member.__table__
+    if conn.dialect.name == "sqlite":
+        conn.execute(sqlite_insert(table).on_conflict_do_nothing(index_elements=["submission_key"]), rows)
+    elif conn.dialect.name == "postgresql":
+        conn.execute(pg_insert(table).on_conflict_do_nothing(index_elements=["submission_key"]), rows)
+    else:
+        keys = [r["submission_key"] for r in rows]
+        seen = set(conn.execute(select(table.c.submission_key).where(table.c.submission_key.in_(keys))).scalars())
+        new = [r for r in rows if r["submission_key"] not in seen]
+        if new:
+            conn.execute(table.insert(), new)
+
+
+def save_member(f, lang, key):
+    """Insert one member synchronously; a repeated key is a no-op."""
+    db = DBSession()
+    member_id = None
+    try:
+        member = Member(**member_values(f, lang, key))
+        db.add(member)
+        with metrics.timer("phase_duration_seconds", (("phase", "db_commit"),)):
+            db.flush()
+            new_id = member.id  # before commit() expires it
+            db.commit()
+        member_id = new_id
+    except IntegrityError:
         db.rollback()
-        flash(f"Error saving submission: {e}")
-        return redirect(url_for("step", n=9))
+        if not db.query(Member.id).filter_by(submission_key=key).first():
+            raise
     finally:
         db.close()
+    if member_id is not None:
+        index_member_quietly(member_id)
+    catch_up.kick()
 
 
-@app.route("/thank-you")
-def thankyou():
-    msg = L()["success"]
-    body = f"""
-    <h1>✔️ {msg}</h1>
-    <p><a href="{url_for('index')}">Start a new submission</a></p>
+class SubmitJournal:
+    """Durable write-behind queue for finished applications.
+
+    Each process appends JSON lines to its own journal file, held under an
+    exclusive flock, and fsyncs before Finish returns. A background thread
+    reads new entries, inserts them in one transaction per batch and then
+    records the committed offset in `<journal>.offset`. Replaying after a
+    crash is safe because inserts skip known submission keys. Journals of
+    dead processes are drained by whichever worker can lock them.
     """
-    return page("Thank You", body)
 
+    def __init__(self, directory, batch_size=500, interval=0.5):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.path = None
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()  # the writer thread vs close() at exit
+        self._wake = threading.Event()
+        os.makedirs(directory, exist_ok=True)
 
-@app.route("/uploads/<path:filename>")
-def uploaded(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    def append(self, f, lang, key):
+        self._ensure_started()
+        line = json.dumps({"form": f, "lang": lang, "key": key}, ensure_ascii=False).encode() + b"\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._wake.set()
+
+    def _ensure_started(self):
+        # Started lazily so that each forked worker gets its own file/thread.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+            self._file = open(self.path, "ab")
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="submit-writer", daemon=True).start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.drain()
+                self._adopt_orphans()
+            except Exception:
+                app.logger.exception("write-behind flush failed; will retry")
+
+    def drain(self):
+        """Insert everything appended to this process's journal so far."""
+        if self.path is None:
+            return
+        with self._drain_lock:
+            self._drain_file(self.path)
+            with self._lock:
+                # Fully drained and nobody appending: start the file over.
+                if os.path.getsize(self.path) == self._read_offset(self.path):
+                    self._file.truncate(0)
+                    self._write_offset(self.path, 0)
+
+    def close(self):
+        """Final drain at interpreter exit; an empty journal is removed."""
+        try:
+            self.drain()
+        except Exception:
+            app.logger.exception("write-behind flush at exit failed; journal kept")
+            return
+        if os.path.getsize(self.path) == 0:
+            os.unlink(self.path)
+            if os.path.exists(self.path + ".offset"):
+                os.unlink(self.path + ".offset")
+
+    def _drain_file(self, path):
+        offset = self._read_offset(path)
+        with open(path, "rb") as fh:
+            fh.seek(offset)
+            while True:
+                rows = []
+                end = offset
+                for line in iter(fh.readline, b""):
+                    if not line.endswith(b"\n"):
+                        break  # partial write still in progress
+                    end += len(line)
+                    entry = json.loads(line)
+                    rows.append(member_values(entry["form"], entry["lang"], entry["key"]))
+                    if len(rows) >= self.batch_size:
+                        break
+                if not rows:
+                    return
+                with metrics.timer("phase_duration_seconds", (("phase", "db_commit"),)):
+                    with engine.begin() as conn:
+                        insert_members(conn, rows)
+                offset = end
+                self._write_offset(path, offset)
+                catch_up.kick()
+                fh.seek(offset)
+
+    def _adopt_orphans(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".jsonl") or path == self.path:
+                continue
+            with open(path, "ab") as fh:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # owner is alive
+                self._drain_file(path)
+                os.unlink(path)
+                if os.path.exists(path + ".offset"):
+                    os.unlink(path + ".offset")
+
+    @staticmethod
+    def _read_offset(path):
+        try:
+            with open(path + ".offset") as fh:
+                return int(fh.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _write_offset(path, offset):
+        tmp = path + ".offset.tmp"
+        with open(tmp, "w") as fh:
+            fh.write(str(offset))
+        os.replace(tmp, path + ".offset")
+
+
+submit_journal = None
+if SUBMIT_MODE == "write-behind":
+    submit_journal = SubmitJournal(
+        SUBMIT_JOURNAL_DIR,
+        batch_size=int(os.environ.get("SUBMIT_BATCH", 500)),
+        interval=float(os.environ.get("SUBMIT_FLUSH_INTERVAL", 0.5)),
+    )
+
+    @app.before_request
+    def start_submit_writer():
+        # Starts this worker's writer on its first request, which also
+        # recovers journals left behind by crashed workers.
+        submit_journal._ensure_started()
+
+# ------------------------------------------------------------------
+# Templates
+#
+# Pages are compiled in two phases. Phase 1 runs once per (page, language)
+# and bakes the language labels (written as [[ ... ]] / [% ... %]) into
+# the source. Phase 2 is a normal Jinja template compiled by Flask's
+# environment; per request it only fills in the form values ({{ f.* }}).
+# ------------------------------------------------------------------
+
+BASE_TPL = """
+<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1" />
+  <title>[[ title ]]</title>
+  <style>
+    body{font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial; margin: 2rem;}
+    .card{max-width: 900px; margin: 0 auto; padding: 1.5rem; border: 1px solid #ddd; border-radius: 14px;}
+    h1{margin-top:0}
+    .row{display:grid; grid-template-columns: 1fr 1fr; gap: 1rem;}
+    label{display:block; font-weight:600; margin-bottom: .35rem}
+    input, select, textarea{width:100%; padding:.6rem .7rem; border:1px solid #ccc; border-radius:10px}
+    textarea{min-height:90px}
+    .actions{display:flex; gap:.5rem; margin-top:1rem}
+    button{padding:.7rem 1rem; border-radius:10px; border:1px solid #999; background:#111; color:#fff; cursor:pointer}
+    .ghost{background:#fff; color:#111}
+    .hint{color:#666; font-size:.9rem}
+    .error{display:block; color:#c53030; font-size:.9rem; margin-top:.25rem}
+    .divider{height:1px; background:#eee; margin:1.25rem 0}
+    .success{padding:1rem; background:#f0fff4; border:1px solid #c6f6d5; border-radius:10px}
+    .thumb{max-width:160px; max-height:160px; border:1px solid #ddd; border-radius:6px}
+    table{width:100%; border-collapse:collapse} th, td{text-align:left; padding:.4rem; border-bottom:1px solid #eee; vertical-align:top}
+  </style>
+</head>
+<body>
+  <div class="card">
+    {% with m = get_flashed_messages() %}
+      {% if m %}<div class="success">{{ m[0] }}</div>{% endif %}
+    {% endwith %}
+    [[ body ]]
+  </div>
+</body>
+</html>
+"""
+
+# Shared phase-1 snippets, prepended to every page body.
+MACROS_TPL = """
+[%- macro options(field) -%]
+{{ option_html([[ lang|literal ]], [[ field|literal ]], f.[[ field ]]) }}
+[%- endmacro -%]
+[%- macro nav() -%]
+<div class=actions>
+  <button class=ghost name=action value=prev type=submit formnovalidate>[[ L.prev ]]</button>
+  <button name=action value=next type=submit>[[ L.next ]]</button>
+</div>
+[%- endmacro -%]
+[%- macro file_link(key) -%]
+{% if f.[[ key ]] %}<a href='{{ url_for('uploaded', filename=f.[[ key ]]) }}' target=_blank>
+{%- with p = preview_url(f.[[ key ]]) %}{% if p %}<img class=thumb src="{{ p }}" alt=""><br>{% endif %}{% endwith -%}
+{{ f.[[ key ]] }}</a>{% else %}—{% endif %}
+[%- endmacro -%]
+"""
+
+# page name -> (title, body)
+PAGE_TPLS = {
+    "index": ("Choose Language", """
+    <h1>[[ S.language ]]</h1>
+    <form method=post action="{{ url_for('set_language') }}">
+      <div class=row>
+        <div>
+          <label>Language</label>
+          <select name="lang">
+          [%- for code, name in LANGS %]
+            <option value="[[ code ]]"[% if code == lang %] selected[% endif %]>[[ name|e ]]</option>
+          [%- endfor %]
+          </select>
+        </div>
+      </div>
+      <div class=actions>
+        <button type=submit>[[ L.next ]]</button>
+      </div>
+    </form>
+    <p class=hint><a href="{{ url_for('application_status') }}">[[ L.status.check ]]</a></p>
+    """),
+    "status": ("[[ L.status.title ]]", """
+    <h1>[[ L.status.title ]]</h1>
+    {% set states = [[ L.status.states|literal ]] %}
+    {% if entry %}
+    <div class=success>
+      <strong>{{ states.get(entry.status, entry.status) }}</strong><br>
+      [[ L.status.reference ]]: {{ ref }}<br>
+      [[ L.status.submitted ]]: {{ entry.submitted or '—' }}
+      {%- if entry.updated %}<br>[[ L.status.updated ]]: {{ entry.updated }}{% endif %}
+    </div>
+    {% else %}
+    <p class=hint>[[ L.status.intro ]]</p>
+    <form method=post>
+      <div class=row>
+        <div><label>[[ L.status.reference ]]</label><input name=reference value="{{ ref }}" required>
+          {% if not_found %}<span class=error>[[ L.status.not_found ]]</span>{% endif %}</div>
+        <div><label>[[ L.status.phone ]]</label><input name=phone value="{{ phone }}" required></div>
+      </div>
+      <div class=actions><button type=submit>[[ L.status.check ]]</button></div>
+    </form>
+    {% endif %}
+    """),
+    "admin_members": ("Members", """
+    <h1>Members</h1>
+    <form method=get>
+      <div class=row>
+        <div><label>Search</label><input name=q value="{{ args.q }}" placeholder="name, address, skills"></div>
+        {% for k in filters %}<div><label>{{ k }}</label><input name={{ k }} value="{{ args[k] }}"></div>{% endfor %}
+        <div><label>From</label><input type=date name=from value="{{ args['from'] }}"></div>
+        <div><label>To</label><input type=date name=to value="{{ args.to }}"></div>
+      </div>
+      <div class=actions><button type=submit>Search</button></div>
+    </form>
+    <div class=divider></div>
+    <table>
+      <tr><th>#</th><th>Submitted</th><th>Name</th><th>Phone</th><th>Email</th><th>Membership</th><th>Transaction</th><th>Files</th></tr>
+      {% for m in rows %}
+      <tr>
+        <td>{{ m.id }}</td><td>{{ m.submitted_at.strftime('%Y-%m-%d %H:%M') if m.submitted_at else '' }}</td>
+        <td>{{ m.name }}<br><span class=hint>{{ m.full_name_en or '' }}</span></td>
+        <td>{{ m.phone }}</td><td>{{ m.email }}</td><td>{{ m.membership_type }}</td><td>{{ m.transaction_id }}</td>
+        <td>{% for key, label in (("doc_file", "doc"), ("payment_file", "payment")) if m[key] %}
+            <a href="{{ url_for('uploaded', filename=m[key]) }}" target=_blank>
+            {%- with p = preview_url(m[key]) %}{% if p %}<img class=thumb src="{{ p }}" alt="{{ label }}">{% else %}{{ label }}{% endif %}{% endwith -%}
+            </a>{% endfor %}</td>
+      </tr>
+      {% else %}
+      <tr><td colspan=8 class=hint>No members found.</td></tr>
+      {% endfor %}
+    </table>
+    {% if next_url %}<div class=actions><a href="{{ next_url }}"><button type=button>Next page</button></a></div>{% endif %}
+    """),
+    "admin_stats": ("Membership statistics", """
+    <h1>Membership statistics</h1>
+    <p class=hint>{{ stats.total }} member(s) as of {{ stats.as_of }} UTC
+      {%- if stats.pending %}; {{ stats.pending }} newer not counted yet{% endif %}.
+      <a href="{{ url_for('admin_stats_api') }}">JSON</a></p>
+    {% for dim, items in stats.dimensions.items() %}
+    <h3>{{ dim.replace('_', ' ')|capitalize }}</h3>
+    <table>
+      <tr><th>Value</th><th>Members</th><th>%</th></tr>
+      {% for value, n in items %}
+      <tr><td>{{ value or '—' }}</td><td>{{ n }}</td><td>{{ '%.1f'|format(100 * n / stats.total) if stats.total else '' }}</td></tr>
+      {% else %}
+      <tr><td colspan=3 class=hint>No members yet.</td></tr>
+      {% endfor %}
+    </table>
+    {% endfor %}
+    """),
+    "thankyou": ("Thank You", """
+    <h1>✔️ [[ L.success ]]</h1>
+    {% if reference %}<p>[[ L.status.your_reference ]]: <strong>{{ reference }}</strong><br>
+      <span class=hint>[[ L.status.keep ]]</span></p>{% endif %}
+    <p><a href="{{ url_for('application_status') }}">[[ L.status.check ]]</a></p>
+    <p><a href="{{ url_for('index') }}">Start a new submission</a></p>
+    """),
+}
+
+# Phase-0: the wizard pages are generated from WIZARD. %(name)s etc. are
+# filled in here; [[ ]] and {{ }} are left for the later phases.
+WIDGETS = {
+    "text": '<div><label>[[ F.%(label)s ]]</label><input name=%(name)s value="{{ f.%(name)s }}"%(required)s></div>',
+    "wide": '<div style="grid-column:1/-1"><label>[[ F.%(label)s ]]</label>'
+            '<input name=%(name)s value="{{ f.%(name)s }}"%(required)s></div>',
+    "textarea": '<div style="grid-column:1/-1"><label>[[ F.%(label)s ]]</label>'
+                '<textarea name=%(name)s%(required)s>{{ f.%(name)s }}</textarea></div>',
+    "bsdate": '<div><label>[[ F.%(label)s ]]</label>'
+              '<input name=%(name)s placeholder="YYYY-MM-DD" value="{{ f.%(name)s }}"%(required)s></div>',
+    "date": '<div><label>[[ F.%(label)s ]]</label><input type=date name=%(name)s value="{{ f.%(name)s }}"%(required)s></div>',
+    "email": '<div><label>[[ F.%(label)s ]]</label><input type=email name=%(name)s value="{{ f.%(name)s }}"%(required)s></div>',
+    "select": '<div><label>[[ F.%(label)s ]]</label><select name=%(name)s>[[ options("%(name)s") ]]</select></div>',
+    "file": '<div><label>[[ F.%(label)s ]]</label><input type=file name=%(name)s></div>\n'
+            '            {%% if f.%(name)s %%}<div><span class=\'hint\'>Saved: {{ f.%(name)s }}</span></div>{%% endif %%}',
+}
+ERROR_SLOT = '{%% if errors.%(name)s %%}<span class=error>{{ errors.%(name)s }}</span>{%% endif %%}'
+WIDGETS = {kind: w.replace("</div>", ERROR_SLOT + "</div>", 1) for kind, w in WIDGETS.items()}
+# Checkboxes sit below the grid.
+CHECK_WIDGET = """<div class=divider></div>
+          <label><input type=checkbox name=%(name)s value=yes {%% if f.%(name)s == "yes" %%}checked{%% endif %%}%(required)s> [[ F.%(label)s ]]</label>""" + ERROR_SLOT
+
+
+def _widget_args(field):
+    return {"name": field.name, "label": field.label, "required": " required" if field.required else ""}
+
+
+def step_page(n, sections):
+    """(title, body) of the form page for step `n`."""
+    fields = [FIELDS[f.name] for _, fs in sections for f in fs]
+    heading = " & ".join(f"[[ S.{section} ]]" for section, _ in sections)
+    rows = "\n".join("            " + WIDGETS[f.kind] % _widget_args(f) for f in fields if f.kind != "check")
+    checks = "".join("\n          " + CHECK_WIDGET % _widget_args(f) for f in fields if f.kind == "check")
+    enctype = " enctype=multipart/form-data" if n in STEP_UPLOADS else ""
+    return f"[[ S.{sections[0][0]} ]]", f"""
+        <h1>{heading}</h1>
+        <form method=post{enctype}>
+          <div class=row>
+{rows}
+          </div>{checks}
+          [[ nav() ]]
+        </form>
+        """
+
+
+def review_page():
+    """(title, body) of the review step: every section, every field."""
+    parts = []
+    for _, sections in WIZARD:
+        for section, fields in sections:
+            items = []
+            for f in map(FIELDS.get, (f.name for f in fields)):
+                if f.kind == "file":
+                    items.append(f'          <li>[[ F.{f.label} ]]: [[ file_link("{f.name}") ]]</li>')
+                elif f.kind != "check":
+                    items.append(f"          <li>[[ F.{f.label} ]]: {{{{ f.{f.name} }}}}</li>")
+            parts.append(f"        <h3>[[ S.{section} ]]</h3>\n        <ul>\n" + "\n".join(items) + "\n        </ul>")
+    body = "\n".join(parts)
+    return "[[ S.review ]]", f"""
+        <h1>[[ S.review ]]</h1>
+        <div class=hint>Review your details below. Click Previous to make changes or Finish to submit.</div>
+        <div class=divider></div>
+{body}
+        <div class=divider></div>
+        <form method=post action="{{{{ url_for('final_submit') }}}}">
+          <div class=actions>
+            <a href="{{{{ url_for('step', n={REVIEW_STEP - 1}) }}}}"><button class=ghost type=button>[[ L.prev ]]</button></a>
+            <button type=submit>[[ L.finish ]]</button>
+          </div>
+        </form>
+        """
+
+
+PAGE_TPLS.update((f"step{n}", step_page(n, sections)) for n, sections in WIZARD)
+PAGE_TPLS[f"step{REVIEW_STEP}"] = review_page()
+
+# Phase-1 environment: its delimiters don't clash with Jinja's defaults, so
+# the {{ }} / {% %} parts pass through untouched for phase 2.
+_label_env = jinja2.Environment(
+    block_start_string="[%", block_end_string="%]",
+    variable_start_string="[[", variable_end_string="]]",
+    comment_start_string="[#", comment_end_string="#]",
+    keep_trailing_newline=True,
+)
+_label_env.filters["literal"] = repr
+
+_compiled = {}
+
+
+def compile_page(name: str, lang: str):
+    """Compile page `name` for `lang`, or return the cached template."""
+    key = (name, lang)
+    tpl = _compiled.get(key)
+    if tpl is None:
+        labels = LABELS[lang]
+        title, body = PAGE_TPLS[name]
+        ctx = {"lang": lang, "L": labels, "S": labels["sections"], "F": labels["fields"],
+               "LANGS": [(code, LABELS[code]["lang_name"]) for code in LABELS]}
+        body = _label_env.from_string(MACROS_TPL + body).render(ctx)
+        title = _label_env.from_string(title).render(ctx)
+        source = _label_env.from_string(BASE_TPL).render(title=title, body=body)
+        tpl = _compiled[key] = app.jinja_env.from_string(source)
+    return tpl
+
+
+@app.template_global()
+def option_html(lang, field, selected):
+    return LABELS.options(lang, field, selected)
+
+
+def warm_templates():
+    """Load every language pack and compile its pages (gunicorn runs this
+    after forking a worker; the CLI commands never need it)."""
+    for lang in LABELS:
+        for name in PAGE_TPLS:
+            compile_page(name, lang)
+
+
+def page(name: str, **context):
+    with metrics.timer("phase_duration_seconds", (("phase", "render"),)):
+        tpl = compile_page(name, current_lang())
+        app.update_template_context(context)
+        return tpl.render(context)
+
+
+# ------------------------------------------------------------------
+# Routes
+# ------------------------------------------------------------------
+
+@app.route("/")
+def index():
+    # Step 1: choose language
+    return page("index")
+
+
+@app.route("/set-language", methods=["POST"])
+def set_language():
+    lang = request.form.get("lang", "en")
+    session["lang"] = lang
+    discard_form()
+    return redirect(url_for("step", n=2))
+
+
+def sync_birth_dates(values):
+    # Keep the two birth dates consistent; a valid B.S. date wins.
+    dob_ad = bs_string_to_ad(values["dob_bs"])
+    if dob_ad:
+        values["dob_ad"] = dob_ad.isoformat()
+    elif not values["dob_bs"].strip() and values["dob_ad"]:
+        values["dob_bs"] = ad_string_to_bs(values["dob_ad"]) or ""
+
+
+# step -> fix-ups applied to the collected values before they're saved
+STEP_HOOKS = {2: sync_birth_dates}
+
+
+@app.route("/step/<int:n>", methods=["GET", "POST"])
+def step(n: int):
+    f = get_form()
+
+    # handle navigation for POST
+    if request.method == "POST":
+        action = request.form.get("action", "next")
+        values = {k: request.form.get(k, "") for k in STEP_INPUTS.get(n, ())}
+        for k in STEP_UPLOADS.get(n, ()):
+            saved = save_upload(request.files.get(k))
+            if saved:
+                values[k] = saved
+        hook = STEP_HOOKS.get(n)
+        if hook:
+            hook(values)
+        # Going back never blocks; moving on needs a valid step.
+        errors = validate_step(n, values, session.get("draft")) if action != "prev" else {}
+        update_form(values)
+        sent = [k for k in STEP_UPLOADS.get(n, ()) if request.files.get(k) and request.files[k].filename]
+        funnel_event("leave", s=n, a=action, ok=not errors, uploads={k: k in values for k in sent})
+        if errors:
+            return page(f"step{n}", f=f, errors=error_messages(errors))
+
+        if action == "prev":
+            return redirect(url_for("step", n=max(2, n-1)))
+        else:
+            return redirect(url_for("step", n=min(REVIEW_STEP, n+1)))
+
+    # render step pages
+    if 2 <= n <= REVIEW_STEP:
+        funnel_event("view", s=n)
+        return page(f"step{n}", f=f, errors={})
+
+    # fallback redirect
+    return redirect(url_for("index"))
+
+
+
+@app.route("/submit", methods=["POST"])  # not used directly in wizard, kept for safety
+
+def final_submit():
+    f = get_form()
+    if g.get("finished"):
+        session["reference"] = submission_reference(g.finished)
+        return redirect(url_for("thankyou"))
+    if not all(f.get(k) for k in REQUIRED_FIELDS):
+        flash("Session expired or incomplete. Please start again.")
+        return redirect(url_for("index"))
+    # Re-checked here: a duplicate may have been submitted since the step.
+    n, errors = validate_form(f, session["draft"])
+    if errors:
+        name, message = next(iter(error_messages(errors).items()))
+        flash(f"{L()['fields'][FIELDS[name].label]}: {message}")
+        return redirect(url_for("step", n=n))
+
+    try:
+        if submit_journal is not None:
+            with metrics.timer("phase_duration_seconds", (("phase", "journal_append"),)):
+                submit_journal.append(f, current_lang(), session["draft"])
+        else:
+            save_member(f, current_lang(), session["draft"])
+        metrics.inc("submissions_total", (("mode", SUBMIT_MODE),))
+        funnel_event("submit")
+    except Exception as e:
+        flash(f"Error saving submission: {e}")
+        return redirect(url_for("step", n=9))
+    session["reference"] = submission_reference(session["draft"])
+    discard_form(finished=True)
+    return redirect(url_for("thankyou"))
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    # Send the applicant back to the step they were on instead of a bare 413.
+    flash(e.description)
+    if request.path.startswith("/step/"):
+        funnel_event("reject", s=request.view_args.get("n") if request.view_args else None)
+        return redirect(request.path)
+    return redirect(url_for("index"))
+
+
+@app.route("/thank-you")
+def thankyou():
+    return page("thankyou", reference=session.get("reference"))
+
+
+def blob_etag(m):
+    """Strong ETag of a content-addressed upload (or of its preview)."""
+    return m.group(1) + ("-thumb" if m.group(2) else "")
+
+
+@app.route("/uploads/<path:filename>")
+def uploaded(filename):
+    m = BLOB_RE.fullmatch(filename)
+    if UPLOAD_OFFLOAD == "x-accel":
+        # nginx serves the bytes (and Range requests) from an internal
+        # location; we only answer revalidations.
+        path = safe_join(app.config["UPLOAD_FOLDER"], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        resp = app.response_class(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        resp.headers["X-Accel-Redirect"] = UPLOAD_ACCEL_PREFIX + filename
+        if m:
+            resp.set_etag(blob_etag(m))
+        resp = resp.make_conditional(request)
+    else:
+        # Range and If-None-Match are handled by send_file; with
+        # UPLOAD_OFFLOAD=x-sendfile the body is left to the front proxy.
+        resp = send_from_directory(app.config["UPLOAD_FOLDER"], filename, etag=blob_etag(m) if m else True)
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    if m:
+        # Content-addressed blobs never change under the same name.
+        resp.cache_control.no_cache = None
+        resp.cache_control.max_age = 365 * 24 * 3600
+        resp.cache_control.immutable = True
+    return resp
+
+
+# ------------------------------------------------------------------
+# Admin: member listing and search
+#
+# Protected by HTTP Basic auth (ADMIN_USER / ADMIN_PASSWORD); without
+# ADMIN_PASSWORD the admin pages stay closed. Pages are keyset-paginated
+# on id (newest first): pass the returned `next` as `after`.
+# ------------------------------------------------------------------
+ADMIN_USER = os.environ.get("ADMIN_USER", "admin")
+ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD")
+ADMIN_FILTERS = ("phone", "email", "transaction_id", "membership_type")
+ADMIN_PAGE_SIZE = 50
+
+
+def is_admin():
+    auth = request.authorization
+    return bool(
+        ADMIN_PASSWORD and auth is not None and auth.type == "basic"
+        and hmac.compare_digest(auth.username or "", ADMIN_USER)
+        and hmac.compare_digest(auth.password or "", ADMIN_PASSWORD)
+    )
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return app.response_class("Admin login required", 401, {"WWW-Authenticate": 'Basic realm="admin"'})
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def fts_query(q: str) -> str:
+    """User text as an FTS5 query: every word must match; a trailing *
+    makes a word a prefix match ("jir*")."""
+    terms = []
+    for tok in q.split():
+        prefix = tok.endswith("*")
+        tok = tok.rstrip("*").replace('"', '""')
+        if tok:
+            terms.append(f'"{tok}"*' if prefix else f'"{tok}"')
+    return " ".join(terms)
+
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        abort(400, f"Bad date: {value!r} (expected YYYY-MM-DD)")
+
+
+def search_members(args, limit=ADMIN_PAGE_SIZE):
+    """One page of members matching the admin filters in `args`.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    t = Member.__table__
+    key_col = t.c.id
+    query = select(t)
+    if fts_query(args.get("q", "")):
+        match = fts_query(args["q"])
+        fts = sa_table("members_fts", sa_column("rowid"), sa_column("members_fts"))
+        if has_fts() and any(args.get(k) for k in ("phone", "email", "transaction_id")):
+            # A near-unique lookup narrows the rows first; check each one
+            # against the FTS index by rowid.
+            query = query.where(
+                select(fts.c.rowid).where(fts.c.members_fts.match(match), fts.c.rowid == t.c.id).exists())
+        elif has_fts():
+            # Drive the query from the FTS index walked in rowid order, so a
+            # common word stops after one page instead of collecting every hit.
+            key_col = fts.c.rowid
+            query = (query.select_from(fts.join(t, t.c.id == fts.c.rowid))
+                     .where(fts.c.members_fts.match(match)))
+        else:
+            like = f"%{args['q'].strip().rstrip('*')}%"
+            query = query.where(or_(*(t.c[c].ilike(like) for c in FTS_COLUMNS)))
+    query = query.order_by(key_col.desc()).limit(limit + 1)
+    for key in ADMIN_FILTERS:
+        if args.get(key):
+            query = query.where(t.c[key] == args[key])
+    if args.get("from"):
+        query = query.where(t.c.submitted_at >= parse_day(args["from"]))
+    if args.get("to"):
+        query = query.where(t.c.submitted_at < parse_day(args["to"]) + timedelta(days=1))
+    if args.get("after"):
+        try:
+            query = query.where(key_col < int(args["after"]))
+        except ValueError:
+            abort(400, "Bad cursor")
+    with engine.connect() as conn:
+        rows = conn.execute(query).mappings().all()
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def member_dict(row):
+    return {k: (v.isoformat() if isinstance(v, (date, datetime)) else v) for k, v in row.items()}
+
+
+@app.route("/admin/api/members")
+@admin_required
+def admin_members_api():
+    limit = min(max(request.args.get("limit", ADMIN_PAGE_SIZE, type=int), 1), 500)
+    rows, next_cursor = search_members(request.args, limit)
+    return {"items": [member_dict(r) for r in rows], "next": next_cursor}
+
+
+@app.route("/metrics")
+@admin_required
+def metrics_endpoint():
+    return app.response_class(metrics.collect(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/members")
+@admin_required
+def admin_members():
+    rows, next_cursor = search_members(request.args)
+    next_args = {**request.args.to_dict(), "after": next_cursor}
+    return page("admin_members", rows=rows, args=request.args, filters=ADMIN_FILTERS,
+                next_url=url_for("admin_members", **next_args) if next_cursor else None)
+
+
+# ------------------------------------------------------------------
+# Application status lookup
+#
+# The thank-you page shows a reference derived from the draft id, so
+# nothing new is stored. At /status applicants enter it with their phone
+# number. Answers come from a read-through cache:
+#
+#   in-process LRU (STATUS_LOCAL_TTL)
+#   -> shared tier, if STATUS_CACHE=sqlite (one host) or redis (STATUS_SHARED_TTL)
+#   -> members table
+#
+# Setting a status drops the member from this worker's LRU and from the
+# shared tier; other workers' LRUs keep an entry for at most
+# STATUS_LOCAL_TTL seconds.
+# ------------------------------------------------------------------
+STATUSES = ("received", "in_review", "approved", "rejected")
+STATUS_CACHE = os.environ.get("STATUS_CACHE", "")
+STATUS_CACHE_SIZE = int(os.environ.get("STATUS_CACHE_SIZE", 10000))
+STATUS_LOCAL_TTL = float(os.environ.get("STATUS_LOCAL_TTL", 30))
+STATUS_SHARED_TTL = int(os.environ.get("STATUS_SHARED_TTL", 3600))
+# Read-alikes applicants type for base32 letters.
+_REFERENCE_FIXES = str.maketrans("018", "OIB")
+
+
+def submission_reference(key):
+    """A reference an applicant can read out over the phone: 10 base32
+    characters of the submission key's hash, e.g. "K7QXM-2RDPA"."""
+    ref = base64.b32encode(hashlib.sha256(key.encode()).digest()).decode()[:10]
+    return f"{ref[:5]}-{ref[5:]}"
+
+
+def parse_reference(value):
+    ref = re.sub(r"[^A-Z0-9]", "", (value or "").upper()).translate(_REFERENCE_FIXES)
+    return f"{ref[:5]}-{ref[5:]}" if re.fullmatch(r"[A-Z2-7]{10}", ref) else None
+
+
+class LocalStatusCache:
+    """In-process LRU with TTL eviction."""
+
+    def __init__(self, size=STATUS_CACHE_SIZE, ttl=STATUS_LOCAL_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class SQLiteStatusCache:
+    """Shared tier for the workers of one host: JSON values in a small
+    SQLite file."""
+
+    PURGE_EVERY = 500  # writes between expiry sweeps
+
+    def __init__(self, path, ttl=STATUS_SHARED_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = SQLiteFile(path)
+        self._writes = 0
+        with self._conn() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS status_cache "
+                       "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID")
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM status_cache WHERE key = ? AND expires_at >= ?",
+                                   (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        with self._conn() as db:
+            db.execute("INSERT OR REPLACE INTO status_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                       (key, json.dumps(value), time.time() + self.ttl))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            with self._conn() as db:
+                db.execute("DELETE FROM status_cache WHERE expires_at < ?", (time.time(),))
+
+    def delete(self, key):
+        with self._conn() as db:
+            db.execute("DELETE FROM status_cache WHERE key = ?", (key,))
+
+
+class RedisStatusCache:
+    """Shared tier in Redis (SET with EX for the TTL)."""
+
+    def __init__(self, url, ttl=STATUS_SHARED_TTL):
+        if redis is None:
+            raise RuntimeError("STATUS_CACHE=redis needs the 'redis' package")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(f"status:{key}")
+        return json.loads(value) if value else None
+
+    def put(self, key, value):
+        self.client.set(f"status:{key}", json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(f"status:{key}")
+
+
+class StatusCache:
+    """Read-through over the local LRU and the optional shared tier. A
+    failing shared tier is logged and skipped, never shown to applicants."""
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key, load):
+        """The cached value of `key`, or `load()` stored in every tier
+        (None is not cached)."""
+        source = "local"
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            source = "shared"
+            value = self._shared("get", key)
+            if value is not None:
+                self.local.put(key, value)
+        if value is None:
+            source = "db"
+            value = load()
+            if value is not None:
+                self.put(key, value)
+        metrics.inc("status_lookups_total", (("source", source),))
+        return value
+
+    def put(self, key, value):
+        self.local.put(key, value)
+        if self.shared is not None:
+            self._shared("put", key, value)
+
+    def invalidate(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self._shared("delete", key)
+
+    def _shared(self, op, *args):
+        try:
+            return getattr(self.shared, op)(*args)
+        except Exception:
+            app.logger.exception("status cache: shared tier %s failed", op)
+            return None
+
+
+def make_status_cache(kind):
+    if kind == "sqlite":
+        shared = SQLiteStatusCache(os.environ.get("STATUS_CACHE_DB", os.path.join(BASE_DIR, "status_cache.db")))
+    elif kind == "redis":
+        shared = RedisStatusCache(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    elif kind in ("", "memory"):
+        shared = None
+    else:
+        raise ValueError(f"Unknown STATUS_CACHE: {kind}")
+    return StatusCache(LocalStatusCache(), shared)
+
+
+status_cache = make_status_cache(STATUS_CACHE)
+
+
+def load_statuses(phones):
+    """{reference: status entry} of the members with any of `phones`."""
+    t = Member.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(select(t.c.submission_key, t.c.phone, t.c.status, t.c.status_updated_at,
+                                   t.c.submitted_at).where(t.c.phone.in_(phones))).all()
+    return {
+        submission_reference(r.submission_key): {
+            "phone": check_phone(r.phone)[0],
+            "status": r.status or "received",
+            "submitted": r.submitted_at.date().isoformat() if r.submitted_at else None,
+            "updated": r.status_updated_at.date().isoformat() if r.status_updated_at else None,
+        }
+        for r in rows if r.submission_key
+    }
+
+
+def lookup_status(ref, phone):
+    """The status entry of reference `ref` if `phone` is the applicant's."""
+    phone = phone.strip()
+    phones = {phone, check_phone(phone)[0]}
+    entry = status_cache.get(ref, lambda: load_statuses(phones).get(ref))
+    return entry if entry is not None and entry["phone"] in phones else None
+
+
+@app.route("/status", methods=["GET", "POST"])
+def application_status():
+    ref, phone, entry = request.form.get("reference", ""), request.form.get("phone", ""), None
+    if request.method == "POST":
+        parsed = parse_reference(ref)
+        if parsed and phone.strip():
+            entry = lookup_status(parsed, phone)
+            ref = parsed
+    resp = app.make_response(page("status", entry=entry, ref=ref, phone=phone,
+                                  not_found=request.method == "POST" and entry is None))
+    resp.cache_control.no_store = True
+    return resp
+
+
+@app.route("/admin/api/members/<int:member_id>/status", methods=["POST"])
+@admin_required
+def admin_set_status(member_id):
+    """Set a member's application status (form or JSON field `status`)."""
+    new = (request.get_json(silent=True) or request.form).get("status")
+    if new not in STATUSES:
+        abort(400, f"status must be one of: {', '.join(STATUSES)}")
+    t = Member.__table__
+    with engine.begin() as conn:
+        row = conn.execute(select(t.c.submission_key).where(t.c.id == member_id)).first()
+        if row is None:
+            abort(404)
+        conn.execute(t.update().where(t.c.id == member_id).values(status=new, status_updated_at=datetime.utcnow()))
+    if row.submission_key:
+        status_cache.invalidate(submission_reference(row.submission_key))
+    return {"id": member_id, "status": new}
+
+
+# ------------------------------------------------------------------
+# Member export (CSV / JSON Lines / XLSX), streamed row by row so memory
+# stays flat however large the table is.
+# ------------------------------------------------------------------
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+EXPORT_BATCH = 1000
+
+
+def export_rows(start=None, end=None, membership_type=None):
+    """Yield member rows (as tuples, in column order) matching the filters.
+
+    `end` is exclusive. Rows are fetched EXPORT_BATCH at a time from a
+    server-side cursor rather than materialized as ORM objects.
+    """
+    t = Member.__table__
+    query = select(t).order_by(t.c.id)
+    if start:
+        query = query.where(t.c.submitted_at >= start)
+    if end:
+        query = query.where(t.c.submitted_at < end)
+    if membership_type:
+        query = query.where(t.c.membership_type == membership_type)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        for batch in result.partitions(EXPORT_BATCH):
+            yield from batch
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_chunks(columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("﻿")  # BOM, so Excel reads the Devanagari correctly
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_cell_text(v) for v in row])
+        if i % EXPORT_BATCH == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+
+def jsonl_chunks(columns, rows):
+    lines = []
+    for row in rows:
+        rec = {c: (v.isoformat() if isinstance(v, (date, datetime)) else v) for c, v in zip(columns, row)}
+        lines.append(json.dumps(rec, ensure_ascii=False))
+        if len(lines) >= EXPORT_BATCH:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are handed out as chunks."""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Members" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'),
+}
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_row(values):
+    cells = []
+    for v in values:
+        if isinstance(v, int):
+            cells.append(f"<c><v>{v}</v></c>")
+        else:
+            t = xml_escape(_XML_ILLEGAL.sub("", _cell_text(v)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{t}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>".encode()
+
+
+def xlsx_chunks(columns, rows):
+    """A minimal single-sheet XLSX, written through a streaming zip so
+    rows are compressed and sent as they are read."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in _XLSX_PARTS.items():
+            zf.writestr(name, xml)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(columns))
+            for row in rows:
+                sheet.write(_xlsx_row(row))
+                if sink.size >= 64 * 1024:
+                    yield sink.take()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.take()
+
+
+def export_chunks(fmt, start=None, end=None, membership_type=None):
+    columns = [c.name for c in Member.__table__.columns]
+    writer = {"csv": csv_chunks, "jsonl": jsonl_chunks, "xlsx": xlsx_chunks}[fmt]
+    return writer(columns, export_rows(start, end, membership_type))
+
+
+@app.route("/admin/export")
+@admin_required
+def admin_export():
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        abort(400, f"Unknown format: {fmt}")
+    start = parse_day(request.args["from"]) if request.args.get("from") else None
+    end = parse_day(request.args["to"]) + timedelta(days=1) if request.args.get("to") else None
+    chunks = export_chunks(fmt, start, end, request.args.get("membership_type") or None)
+    filename = f"members-{datetime.now():%Y%m%d}.{fmt}"
+    return app.response_class(chunks, mimetype=EXPORT_FORMATS[fmt],
+                              headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.cli.command("export-members")
+@click.option("--format", "fmt", type=click.Choice(list(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--output", "-o", type=click.File("wb"), default="-", help="File to write (default: stdout).")
+@click.option("--from", "start", type=click.DateTime(["%Y-%m-%d"]), help="Submitted on or after this day.")
+@click.option("--to", "end", type=click.DateTime(["%Y-%m-%d"]), help="Submitted on or before this day.")
+@click.option("--membership-type", help="Only this membership type.")
+def export_members_command(fmt, output, start, end, membership_type):
+    """Export members as CSV, JSON Lines or XLSX."""
+    if end:
+        end += timedelta(days=1)
+    for chunk in export_chunks(fmt, start, end, membership_type):
+        output.write(chunk)
+
+
+# ------------------------------------------------------------------
+# Bulk import of paper forms (CSV, or XLSX with openpyxl installed)
+#
+# Columns are matched to member fields by field name or by the field's
+# label in any language pack (case and spacing ignored); "lang" and
+# "submitted_at" (YYYY-MM-DD) are recognized too and anything else is
+# ignored. Rows are validated with the wizard's rules in a process pool,
+# IMPORT_CHUNK at a time, and each chunk is inserted in one transaction
+# together with a checkpoint, so a rerun of the same file resumes after
+# the last committed row. Each row's submission key is derived from the
+# file's hash and row number, so a row is never inserted twice. Rejected
+# rows go to IMPORT_DIR/<file id>.errors.csv.
+# ------------------------------------------------------------------
+IMPORT_DIR = os.environ.get("IMPORT_DIR", os.path.join(BASE_DIR, "imports"))
+IMPORT_CHUNK = 5000
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", os.cpu_count() or 2))
+
+
+def _column_key(text_):
+    return re.sub(r"[\s_]+", " ", str(text_ or "")).strip().lower()
+
+
+def import_columns(header, mapping=None):
+    """The field each column fills (None: ignored). `mapping` overrides
+    {column header: field}."""
+    known = {_column_key(k): k for k in (*FIELDS, "lang", "submitted_at")}
+    for code in LABELS:
+        labels = LABELS[code]["fields"]
+        for k, f in FIELDS.items():
+            if labels.get(f.label):
+                known.setdefault(_column_key(labels[f.label]), k)
+    mapping = {_column_key(k): v for k, v in (mapping or {}).items()}
+    return [mapping.get(_column_key(h)) or known.get(_column_key(h)) for h in header]
+
+
+def read_sheet(path):
+    """Rows of a .csv or .xlsx file as lists of strings."""
+    if path.lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise RuntimeError("Importing .xlsx needs openpyxl (pip install openpyxl); or save the sheet as CSV.")
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for row in wb.active.iter_rows(values_only=True):
+                yield ["" if v is None else v.date().isoformat() if isinstance(v, datetime)
+                       else v.isoformat() if isinstance(v, date) else str(v) for v in row]
+        finally:
+            wb.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as fh:
+            yield from csv.reader(fh)
+
+
+def check_import_rows(rows, columns, default_lang, file_id):
+    """Validate (row number, cells) pairs (runs in the pool).
+
+    Returns (row number, member values or None, {field: error key},
+    [(field, value) that must not be taken]) per row.
+    """
+    out = []
+    for rownum, cells in rows:
+        f = {k: v.strip() for k, v in zip(columns, cells) if k}
+        lang = f.pop("lang", "") or default_lang
+        submitted = f.pop("submitted_at", "")
+        if not any(f.values()):
+            continue  # blank line
+        if "declaration" not in columns:
+            f["declaration"] = "yes"  # paper forms are signed; sheets rarely carry the box
+        errors, unique = {}, []
+        for n, _ in WIZARD:
+            step_errors, step_unique = check_step(n, f)
+            errors.update(step_errors)
+            unique += step_unique
+        values = None
+        if not errors:
+            values = member_values(f, lang, f"import-{file_id}-{rownum}")
+            if submitted:
+                try:
+                    values["submitted_at"] = datetime.strptime(submitted[:10], "%Y-%m-%d")
+                except ValueError:
+                    errors["submitted_at"] = "date"
+                    values = None
+        out.append((rownum, values, errors, unique))
+    return out
+
+
+def import_members(path, default_lang="en", mapping=None, log=None):
+    """Import (or resume importing) a spreadsheet of members.
+
+    Returns a summary dict.
+    """
+    with open(path, "rb") as fh:
+        file_id = hashlib.file_digest(fh, "sha256").hexdigest()[:16]
+    checkpoint = f"import:{file_id}"
+    with engine.begin() as conn:
+        done = conn.execute(select(BackfillCheckpoint.last_id).where(BackfillCheckpoint.name == checkpoint)).scalar()
+        if done is None:
+            done = 0
+            conn.execute(BackfillCheckpoint.__table__.insert().values(name=checkpoint, last_id=0))
+    rows = read_sheet(path)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("The file is empty.")
+    columns = import_columns(header, mapping)
+    if "name" not in columns:
+        raise ValueError("No column maps to the member's name; check the header row.")
+
+    def chunks():
+        chunk = []
+        for rownum, cells in enumerate(rows, start=2):  # row 1 is the header
+            if rownum <= done:
+                continue
+            chunk.append((rownum, cells))
+            if len(chunk) >= IMPORT_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    errors_path = os.path.join(IMPORT_DIR, f"{file_id}.errors.csv")
+    summary = {"file": file_id, "resumed_after_row": done or None, "accepted": 0, "rejected": 0,
+               "errors_csv": errors_path}
+    seen = {k: set() for k in UNIQUE_FIELDS}  # unique values earlier in this file
+    pool = ProcessPoolExecutor(IMPORT_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    new_errors_file = not os.path.exists(errors_path)
+    with pool, open(errors_path, "a", newline="", encoding="utf-8") as errors_file:
+        errors_csv = csv.writer(errors_file)
+        if new_errors_file:
+            errors_csv.writerow(["row", "field", "error"])
+        pending = deque()
+        source = chunks()
+        while True:
+            # Keep every worker busy without reading the whole file ahead.
+            while len(pending) < IMPORT_WORKERS * 2:
+                chunk = next(source, None)
+                if chunk is None:
+                    break
+                pending.append(pool.submit(check_import_rows, chunk, columns, default_lang, file_id))
+            if not pending:
+                break
+            checked = pending.popleft().result()
+            if not checked:
+                continue
+            taken = import_taken(checked)
+            good = []
+            for rownum, values, errors, unique in checked:
+                for field, value in unique:
+                    if (field, value) in taken or value in seen[field]:
+                        errors[field] = "taken"
+                if errors:
+                    errors_csv.writerows([rownum, field, error] for field, error in errors.items())
+                    summary["rejected"] += 1
+                    continue
+                for field, value in unique:
+                    seen[field].add(value)
+                good.append(values)
+            last = checked[-1][0]
+            with engine.begin() as conn:
+                if good:
+                    insert_members(conn, good)
+                conn.execute(BackfillCheckpoint.__table__.update()
+                             .where(BackfillCheckpoint.name == checkpoint)
+                             .values(last_id=last, updated_at=datetime.utcnow()))
+            summary["accepted"] += len(good)
+            if good:
+                roll_up_stats_quietly(IMPORT_CHUNK)
+                catch_up.kick()
+            if log:
+                log(f"row {last}: {summary['accepted']} accepted, {summary['rejected']} rejected")
+    return summary
+
+
+def import_taken(checked):
+    """{(field, value)} among a checked chunk's unique values that members
+    already have."""
+    wanted = {}
+    for _, _, _, unique in checked:
+        for field, value in unique:
+            wanted.setdefault(field, set()).add(value)
+    taken = set()
+    t = Member.__table__
+    with engine.connect() as conn:
+        for field, values in wanted.items():
+            values = list(values)
+            for start in range(0, len(values), 500):
+                batch = values[start:start + 500]
+                taken.update((field, v) for v in conn.execute(
+                    select(t.c[field]).where(t.c[field].in_(batch))).scalars())
+    return taken
+
+
+@app.cli.command("import-members")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--lang", default="en", show_default=True, help="Language of rows without a lang column.")
+@click.option("--map", "mappings", multiple=True, metavar="COLUMN=FIELD",
+              help="Map a column header to a member field (repeatable).")
+def import_members_command(path, lang, mappings):
+    """Import members from a CSV or XLSX file of paper forms (resumable)."""
+    mapping = dict(m.split("=", 1) for m in mappings)
+    try:
+        summary = import_members(path, lang, mapping, log=click.echo)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Done: {summary['accepted']} accepted, {summary['rejected']} rejected"
+               + (f" (see {summary['errors_csv']})" if summary["rejected"] else "") + ".")
+    click.echo("Run `flask find-duplicates` to index the new members for duplicate detection.")
+
+
+_import_threads = {}
+
+
+@app.route("/admin/import", methods=["POST"])
+@admin_required
+def admin_import():
+    """Start importing an uploaded CSV/XLSX in the background."""
+    upload = request.files.get("file")
+    ext = (upload.filename.rsplit(".", 1)[-1].lower() if upload and "." in upload.filename else "")
+    if ext not in ("csv", "xlsx"):
+        abort(400, "Upload a .csv or .xlsx file as `file`.")
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    spool = spool_upload(upload)
+    path = os.path.join(IMPORT_DIR, f"{spool.sha256[:16]}.{ext}")
+    spool.commit(path)
+    file_id = spool.sha256[:16]
+    lang = request.form.get("lang", "en")
+
+    def run():
+        try:
+            result = import_members(path, lang)
+        except Exception as e:
+            app.logger.exception("import %s failed", file_id)
+            result = {"file": file_id, "error": str(e)}
+        with open(os.path.join(IMPORT_DIR, f"{file_id}.json"), "w") as fh:
+            json.dump(result, fh)
+
+    thread = _import_threads.get(file_id)
+    if thread is None or not thread.is_alive():
+        if os.path.exists(os.path.join(IMPORT_DIR, f"{file_id}.json")):
+            os.unlink(os.path.join(IMPORT_DIR, f"{file_id}.json"))  # result of an earlier run
+        _import_threads[file_id] = thread = threading.Thread(target=run, name=f"import-{file_id}", daemon=True)
+        thread.start()
+    return {"file": file_id, "status": url_for("admin_import_status", file_id=file_id)}, 202
+
+
+@app.route("/admin/import/<file_id>")
+@admin_required
+def admin_import_status(file_id):
+    if not re.fullmatch(r"[0-9a-f]{16}", file_id):
+        abort(404)
+    result_path = os.path.join(IMPORT_DIR, f"{file_id}.json")
+    with engine.connect() as conn:
+        last_row = conn.execute(select(BackfillCheckpoint.last_id)
+                                .where(BackfillCheckpoint.name == f"import:{file_id}")).scalar()
+    if last_row is None and not any(os.path.exists(os.path.join(IMPORT_DIR, f"{file_id}.{ext}"))
+                                    for ext in ("csv", "xlsx")):
+        abort(404)
+    status = {"file": file_id, "last_committed_row": last_row or 0, "done": False}
+    if os.path.exists(result_path):
+        with open(result_path) as fh:
+            status.update(json.load(fh), done=True)
+    return status
+
+
+# ------------------------------------------------------------------
+# Date backfill: fills the typed dob_ad / doc_issued_ad columns from the
+# hand-typed strings of older rows. Runs in short batches keyed on id and
+# records a checkpoint with each batch, so it can run against a live
+# database and resume where it stopped. An issue date that fits both
+# calendars is not guessed: doc_issued_ad stays empty and the row is
+# reported so someone can ask the member.
+# ------------------------------------------------------------------
+
+def backfill_dates(batch_size=1000, pause=0.05, name="dates", log=None, ambiguous=None):
+    """Run (or resume) the date backfill. Returns the number of rows updated.
+
+    Ids of rows whose issue date fits both calendars are appended to the
+    `ambiguous` list, if given.
+    """
+    t = Member.__table__
+    updated = 0
+    with DBSession() as db:
+        checkpoint = db.get(BackfillCheckpoint, name)
+        if checkpoint is None:
+            checkpoint = BackfillCheckpoint(name=name, last_id=0)
+            db.add(checkpoint)
+            db.commit()
+        last_id = checkpoint.last_id
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(t.c.id, t.c.dob_bs, t.c.dob_ad, t.c.doc_issued_date, t.c.doc_issued_ad)
+                .where(t.c.id > last_id).order_by(t.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            from_bs = bs_to_ad_many([r.dob_bs for r in rows])
+            changes = []
+            for r, dob_from_bs in zip(rows, from_bs):
+                dob = r.dob_ad or dob_from_bs
+                issued = r.doc_issued_ad
+                if r.doc_issued_date:
+                    # Re-read even if set: older code guessed B.S. for
+                    # dates that fit both calendars.
+                    readings = issued_date_readings(r.doc_issued_date, dob)
+                    issued = readings[0] if len(readings) == 1 else None
+                    if len(readings) > 1 and ambiguous is not None:
+                        ambiguous.append(r.id)
+                if dob != r.dob_ad or issued != r.doc_issued_ad:
+                    changes.append({"_id": r.id, "dob_ad": dob, "doc_issued_ad": issued})
+            if changes:
+                conn.execute(
+                    t.update().where(t.c.id == bindparam("_id"))
+                    .values(dob_ad=bindparam("dob_ad"), doc_issued_ad=bindparam("doc_issued_ad")),
+                    changes,
+                )
+            last_id = rows[-1].id
+            conn.execute(
+                BackfillCheckpoint.__table__.update()
+                .where(BackfillCheckpoint.name == name)
+                .values(last_id=last_id, updated_at=datetime.utcnow())
+            )
+        updated += len(changes)
+        if log:
+            log(f"up to id {last_id}: {updated} row(s) updated")
+        # Let other writers in between batches.
+        time.sleep(pause)
+    return updated
+
+
+@app.cli.command("backfill-dates")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--pause", default=0.05, show_default=True, help="Seconds to sleep between batches.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start from the first row.")
+def backfill_dates_command(batch_size, pause, restart):
+    """Fill dob_ad / doc_issued_ad from the typed date strings."""
+    if restart:
+        with engine.begin() as conn:
+            conn.execute(BackfillCheckpoint.__table__.delete().where(BackfillCheckpoint.name == "dates"))
+    ambiguous = []
+    n = backfill_dates(batch_size, pause, log=click.echo, ambiguous=ambiguous)
+    click.echo(f"Done: {n} row(s) updated.")
+    if ambiguous:
+        click.echo(f"{len(ambiguous)} issue date(s) fit both B.S. and A.D. and were left empty; "
+                   f"add B.S. or A.D. to doc_issued_date and run again with --restart. Member ids:")
+        click.echo(" ".join(map(str, ambiguous)))
+
+
+# ------------------------------------------------------------------
+# Duplicate applicants
+#
+# The same person often registers more than once, in another language or
+# with the name spelled differently. Every member gets a few blocking keys
+# (phone, email, birth date, phonetic skeleton of first + last name, the
+# Devanagari name transliterated first) kept in member_blocks. Only
+# members sharing a key are compared, by fuzzy name similarity plus the
+# exact matches, so the work per member stays bounded; blocks larger than
+# DEDUP_BLOCK_LIMIT (a very common name) are ignored. Pairs scoring at
+# least DEDUP_THRESHOLD land in duplicate_candidates for an admin to check.
+#
+# A Finish indexes its own member right after the commit. Everything else
+# (imports, the write-behind journal, a Finish whose indexing failed) is
+# picked up from a checkpoint by the background catch-up thread or by
+# `flask find-duplicates`, which skip members already indexed; `flask
+# find-duplicates --rebuild` scans the whole table. Names are compared
+# outside any transaction; only the short writes of the results take the
+# database's write lock.
+# ------------------------------------------------------------------
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.6))
+DEDUP_BLOCK_LIMIT = 100
+# Score = 0.5 x name similarity + these for exact matches.
+DEDUP_WEIGHTS = {"phone": 0.15, "email": 0.1, "dob": 0.25, "txid": 0.3}
+DEDUP_BATCH = 500
+DEDUP_WRITE_BATCH = 100  # members written per transaction
+
+_DEVANAGARI = {
+    **dict(zip("कखगघङचछजझञटठडढणतथदधनपफबभमयरलवशषसह",
+               "k kh g gh ng ch chh j jh n t th d dh n t th d dh n p ph b bh m y r l w sh sh s h".split())),
+    **dict(zip("अआइईउऊऋएऐओऔ", "a aa i i u u ri e ai o au".split())),
+    **dict(zip("ािीुूृेैोौ", "aa i i u u ri e ai o au".split())),
+    "ं": "n", "ँ": "n", "ः": "h",
+}
+_MATRAS = set("ािीुूृेैोौ्")
+_FOLD = [(re.compile(p), r) for p, r in (
+    (r"[^a-z ]", ""),
+    (r"(?<=[bcdgjkpst])h", ""),  # aspirates and sh: bh, chh, kh, sh, ...
+    (r"[vw]", "b"), (r"z", "j"), (r"f", "p"), (r"q", "k"), (r"x", "ks"), (r"ee", "i"), (r"oo", "u"),
+    (r"([a-z])\1+", r"\1"),
+)]
+
+
+def transliterate(text_):
+    """Rough Latin spelling of Devanagari text; other characters pass through."""
+    out = []
+    for i, ch in enumerate(text_):
+        latin = _DEVANAGARI.get(ch)
+        if latin is None:
+            if ch not in _MATRAS:  # ् and unknown marks add nothing
+                out.append(ch)
+            continue
+        out.append(latin)
+        # A consonant carries an inherent "a" unless a vowel sign follows;
+        # it isn't pronounced at the end of a word.
+        if ch in "कखगघङचछजझञटठडढणतथदधनपफबभमयरलवशषसह":
+            nxt = text_[i + 1] if i + 1 < len(text_) else ""
+            if nxt not in _MATRAS and "\u0900" <= nxt <= "\u097f":
+                out.append("a")
+    return "".join(out)
+
+
+@lru_cache(maxsize=65536)
+def fold_token(token):
+    """Lowercase Latin, phonetically folded spelling of one name."""
+    token = transliterate(token).lower()
+    for pattern, repl in _FOLD:
+        token = pattern.sub(repl, token)
+    return token
+
+
+def fold_tokens(name):
+    return [t for t in map(fold_token, (name or "").split()) if t]
+
+
+def name_skeleton(token):
+    return re.sub(r"[aeiouyh]", "", token)
+
+
+def dedup_features(row):
+    """(blocking keys, folded names, exact-match values) of a member row."""
+    names = set()
+    keys = set()
+    for original in (row.name, row.full_name_en):
+        tokens = fold_tokens(original)
+        if tokens:
+            names.add(" ".join(sorted(tokens)))
+            # first and last name, in either order
+            ends = sorted({name_skeleton(tokens[0]), name_skeleton(tokens[-1])} - {""})
+            if ends:
+                keys.add("n:" + "|".join(ends))
+    phone = check_phone(row.phone.strip())[0] if row.phone else None
+    email = row.email.strip().lower() if row.email else None
+    if phone:
+        keys.add("p:" + phone)
+    if email:
+        keys.add("e:" + email)
+    if row.dob_ad:
+        keys.add(f"d:{row.dob_ad}")
+    exact = {"phone": phone, "email": email, "dob": row.dob_ad, "txid": row.transaction_id or None}
+    return keys, names, exact
+
+
+def name_similarity(a, b, need=0.0):
+    """Similarity of two folded names; a name that is the other plus a
+    middle name or initial still scores high (token-set ratio, once at
+    least two names agree; a shared surname alone proves nothing).
+
+    Below `need` the result is only an upper bound, which is cheaper.
+    """
+    ratio = lambda x, y: difflib.SequenceMatcher(None, x, y).ratio()
+    ta, tb = set(a.split()), set(b.split())
+    if len(ta & tb) < 2:
+        sm = difflib.SequenceMatcher(None, a, b)
+        bound = sm.quick_ratio()
+        return bound if bound < need else sm.ratio()
+    common = " ".join(sorted(ta & tb))
+    rest_a = (common + " " + " ".join(sorted(ta - tb))).strip()
+    rest_b = (common + " " + " ".join(sorted(tb - ta))).strip()
+    return max(ratio(a, b), ratio(common, rest_a), ratio(common, rest_b), ratio(rest_a, rest_b))
+
+
+def duplicate_score(a, b):
+    """(score 0..1, reasons) for two dedup_features() results."""
+    _, names_a, exact_a = a
+    _, names_b, exact_b = b
+    same = [k for k in DEDUP_WEIGHTS if exact_a[k] and exact_a[k] == exact_b[k]]
+    exact = sum(DEDUP_WEIGHTS[k] for k in same)
+    if exact + 0.5 < DEDUP_THRESHOLD:
+        # Can't reach the threshold whatever the names: skip comparing them.
+        return round(exact, 3), ",".join(same)
+    need = (DEDUP_THRESHOLD - exact) / 0.5
+    name = max((name_similarity(x, y, need) for x in names_a for y in names_b), default=0.0)
+    score = min(1.0, 0.5 * name + exact)
+    return round(score, 3), ",".join(same + [f"name={name:.2f}"])
+
+
+_DEDUP_COLUMNS = ("id", "name", "full_name_en", "phone", "email", "dob_ad", "transaction_id")
+
+
+def _block_ids(conn, keys):
+    """{key: ids of the members indexed under it}, at most
+    DEDUP_BLOCK_LIMIT + 1 of them (a longer block is ignored anyway)."""
+    mb = MemberBlock.__table__
+    return {key: conn.execute(select(mb.c.member_id).where(mb.c.key == key)
+                              .limit(DEDUP_BLOCK_LIMIT + 1)).scalars().all()
+            for key in keys}
+
+
+def _load_features(conn, ids, features):
+    """Add the dedup_features() of members `ids` missing from `features`."""
+    t = Member.__table__
+    missing = [i for i in ids if i not in features]
+    for start in range(0, len(missing), 500):
+        for row in conn.execute(select(*[t.c[k] for k in _DEDUP_COLUMNS])
+                                .where(t.c.id.in_(missing[start:start + 500]))):
+            features[row.id] = dedup_features(row)
+
+
+def _match(member_id, others, features):
+    """duplicate_candidates rows of `member_id` among members `others`."""
+    out = []
+    for other in sorted(others):
+        score, reasons = duplicate_score(features[member_id], features[other])
+        if score >= DEDUP_THRESHOLD:
+            out.append({"member_id": member_id, "other_id": other, "score": score, "reasons": reasons})
+    return out
+
+
+def index_rows(rows, skip=frozenset(), checkpoint=None, pause=0.0):
+    """Index member `rows` (in id order, ids in `skip` excluded) and record
+    their likely duplicates among the indexed members and each other.
+
+    Names are compared in a read-only pass. Blocking keys and candidates
+    are then written DEDUP_WRITE_BATCH rows per transaction, sleeping
+    `pause` seconds between them, so the write lock is never held while
+    scoring. Each write first picks up members another process indexed
+    since the read pass (a Finish). With `checkpoint` (the "dedup"
+    checkpoint as it was when `rows` were read) each write also moves it
+    past its rows, or raises _CheckpointRaced.
+    """
+    features = {row.id: dedup_features(row) for row in rows if row.id not in skip}
+    own = set(features)
+    with engine.connect() as conn:
+        blocks = _block_ids(conn, {k for f in features.values() for k in f[0]})
+        _load_features(conn, {i for ids in blocks.values() if len(ids) <= DEDUP_BLOCK_LIMIT for i in ids},
+                       features)
+    seen = {key: set(ids) | own for key, ids in blocks.items()}
+    pending = []  # (member id, keys, candidates)
+    for row in rows:
+        if row.id not in own:
+            pending.append((row.id, (), []))
+            continue
+        keys = features[row.id][0]
+        others = set()
+        for key in keys:
+            ids = blocks[key]
+            if len(ids) <= DEDUP_BLOCK_LIMIT:
+                others.update(ids)
+            ids.append(row.id)  # visible to the rows after it
+        pending.append((row.id, keys, _match(row.id, others, features)))
+
+    mb, dc, cp = MemberBlock.__table__, DuplicateCandidate.__table__, BackfillCheckpoint.__table__
+    for start in range(0, len(pending), DEDUP_WRITE_BATCH):
+        if start and pause:
+            time.sleep(pause)
+        batch = pending[start:start + DEDUP_WRITE_BATCH]
+        with engine.begin() as conn:
+            if checkpoint is not None:
+                # Written first: takes the write lock before the re-read below.
+                moved = conn.execute(cp.update().where(cp.c.name == "dedup", cp.c.last_id == checkpoint)
+                                     .values(last_id=batch[-1][0], updated_at=datetime.utcnow())).rowcount
+                if not moved:
+                    raise _CheckpointRaced()
+            keys = {k for _, row_keys, _ in batch for k in row_keys}
+            late = {key: set(ids) - seen[key] for key, ids in _block_ids(conn, keys).items()
+                    if len(ids) <= DEDUP_BLOCK_LIMIT}
+            if any(late.values()):
+                _load_features(conn, set().union(*late.values()), features)
+            block_rows, candidates = [], []
+            for member_id, row_keys, found in batch:
+                block_rows += [{"key": k, "member_id": member_id} for k in row_keys]
+                candidates += found
+                others = set().union(*(late.get(k, ()) for k in row_keys))
+                if others:
+                    candidates += _match(member_id, others, features)
+            if block_rows:
+                conn.execute(mb.insert(), block_rows)
+            if candidates:
+                conn.execute(dc.insert(), candidates)
+        if checkpoint is not None:
+            checkpoint = batch[-1][0]
+
+
+def index_member(member_id):
+    """Index one just-saved member (the Finish path)."""
+    t, mb = Member.__table__, MemberBlock.__table__
+    with engine.connect() as conn:
+        if conn.execute(select(mb.c.member_id).where(mb.c.member_id == member_id).limit(1)).first():
+            return
+        row = conn.execute(select(*[t.c[k] for k in _DEDUP_COLUMNS]).where(t.c.id == member_id)).first()
+    if row is not None:
+        index_rows([row])
+
+
+def index_member_quietly(member_id):
+    """index_member() for the submit path: never fails a submission."""
+    try:
+        index_member(member_id)
+    except IntegrityError:
+        pass  # the catch-up thread indexed it meanwhile
+    except Exception:
+        app.logger.exception("duplicate indexing failed; the catch-up run indexes member %s", member_id)
+
+
+def index_new_members(limit=DEDUP_BATCH, pause=0.0):
+    """Index members added since the last run and record their likely
+    duplicates (see index_rows()). Returns the number of members looked at."""
+    t, mb = Member.__table__, MemberBlock.__table__
+    with engine.connect() as conn:
+        last_id = conn.execute(select(BackfillCheckpoint.last_id)
+                               .where(BackfillCheckpoint.name == "dedup")).scalar()
+        rows = conn.execute(select(*[t.c[k] for k in _DEDUP_COLUMNS])
+                            .where(t.c.id > (last_id or 0)).order_by(t.c.id).limit(limit)).all()
+        # Submissions indexed by their own Finish.
+        done = set(conn.execute(select(mb.c.member_id).distinct()
+                                .where(mb.c.member_id.in_([r.id for r in rows]))).scalars()) if rows else set()
+    if last_id is None:
+        try:
+            with engine.begin() as conn:
+                conn.execute(BackfillCheckpoint.__table__.insert().values(name="dedup", last_id=0))
+        except IntegrityError:
+            pass  # another process created it
+        last_id = 0
+    if rows:
+        index_rows(rows, done, last_id, pause)
+    return len(rows)
+
+
+class _CheckpointRaced(Exception):
+    """Another process moved a checkpoint while this batch was running."""
+
+
+def rebuild_duplicates(log=None):
+    """Recompute member_blocks and duplicate_candidates from scratch.
+
+    One pass over members groups them by blocking key in memory; then
+    each block is scored pairwise. Returns (members, candidate pairs).
+    """
+    t = Member.__table__
+    features = {}
+    blocks = {}
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(
+            select(*[t.c[k] for k in _DEDUP_COLUMNS]).order_by(t.c.id))
+        for row in result:
+            features[row.id] = f = dedup_features(row)
+            for key in f[0]:
+                blocks.setdefault(key, []).append(row.id)
+    if log:
+        log(f"{len(features)} member(s), {len(blocks)} block(s)")
+    pairs = {}
+    for ids in blocks.values():
+        if len(ids) < 2 or len(ids) > DEDUP_BLOCK_LIMIT:
+            continue
+        for i, a in enumerate(ids):
+            for b in ids[i + 1:]:
+                if (b, a) in pairs:
+                    continue
+                score, reasons = duplicate_score(features[b], features[a])
+                pairs[b, a] = (score, reasons)
+    candidates = [{"member_id": b, "other_id": a, "score": score, "reasons": reasons}
+                  for (b, a), (score, reasons) in pairs.items() if score >= DEDUP_THRESHOLD]
+    with engine.begin() as conn:
+        conn.execute(MemberBlock.__table__.delete())
+        conn.execute(DuplicateCandidate.__table__.delete())
+        rows = [{"key": k, "member_id": i} for k, ids in blocks.items() for i in ids]
+        for start in range(0, len(rows), 10000):
+            conn.execute(MemberBlock.__table__.insert(), rows[start:start + 10000])
+        if candidates:
+            conn.execute(DuplicateCandidate.__table__.insert(), candidates)
+        conn.execute(BackfillCheckpoint.__table__.delete().where(BackfillCheckpoint.name == "dedup"))
+        conn.execute(BackfillCheckpoint.__table__.insert().values(name="dedup", last_id=max(features, default=0)))
+    return len(features), len(candidates)
+
+
+@app.cli.command("find-duplicates")
+@click.option("--rebuild", is_flag=True, help="Rescan the whole members table.")
+def find_duplicates_command(rebuild):
+    """Index new members (or all, with --rebuild) for duplicate detection."""
+    if rebuild:
+        members, pairs = rebuild_duplicates(log=click.echo)
+        click.echo(f"Done: {members} member(s), {pairs} likely duplicate pair(s).")
+        return
+    total = 0
+    while True:
+        n = index_new_members()
+        if not n:
+            break
+        total += n
+        click.echo(f"{total} member(s) indexed")
+    click.echo("Done.")
+
+
+@app.route("/admin/api/duplicates")
+@admin_required
+def admin_duplicates_api():
+    """Likely duplicate pairs, best first, with both members' details."""
+    limit = min(max(request.args.get("limit", ADMIN_PAGE_SIZE, type=int), 1), 500)
+    min_score = request.args.get("min_score", DEDUP_THRESHOLD, type=float)
+    dc, t = DuplicateCandidate.__table__, Member.__table__
+    with engine.connect() as conn:
+        pairs = conn.execute(select(dc).where(dc.c.score >= min_score)
+                             .order_by(dc.c.score.desc(), dc.c.member_id.desc()).limit(limit)).all()
+        ids = {p.member_id for p in pairs} | {p.other_id for p in pairs}
+        members = {r.id: member_dict(r._mapping) for r in conn.execute(
+            select(*[t.c[k] for k in _DEDUP_COLUMNS + ("submitted_at", "lang")]).where(t.c.id.in_(ids)))}
+    return {"items": [{"score": p.score, "reasons": p.reasons, "found_at": p.found_at.isoformat(),
+                       "member": members.get(p.member_id), "other": members.get(p.other_id)}
+                      for p in pairs]}
+
+
+# ------------------------------------------------------------------
+# Background catch-up
+#
+# Work that follows a checkpoint on members.id runs here, not in the
+# Finish request, so a backlog (after a bulk import, or journaled
+# submissions) never slows an applicant down. One thread per process,
+# started on first use; submissions wake it, and it also looks every
+# CATCH_UP_INTERVAL seconds for rows that arrived another way.
+# ------------------------------------------------------------------
+CATCH_UP_INTERVAL = float(os.environ.get("CATCH_UP_INTERVAL", 60))
+# Sleep between write transactions, so submissions get the lock in between.
+CATCH_UP_PAUSE = float(os.environ.get("CATCH_UP_PAUSE", 0.05))
+
+
+class CatchUp:
+    def __init__(self, interval=CATCH_UP_INTERVAL, pause=CATCH_UP_PAUSE):
+        self.interval = interval
+        self.pause = pause
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def kick(self):
+        """Wake the thread (starting it in this process if needed)."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Threads don't survive a fork.
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, name="catch-up", daemon=True).start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.run_once()
+
+    def run_once(self):
+        """Drain every backlog; failures are logged and retried next time."""
+        try:
+            while index_new_members(pause=self.pause):
+                time.sleep(self.pause)
+        except (_CheckpointRaced, IntegrityError):
+            pass  # another process is indexing the same rows
+        except Exception:
+            app.logger.exception("duplicate indexing failed; will retry")
+        try:
+            while roll_up_stats():
+                time.sleep(self.pause)
+        except (_CheckpointRaced, IntegrityError):
+            pass  # another process is counting the same rows
+        except Exception:
+            app.logger.exception("stats roll-up failed; will retry")
+
+
+catch_up = CatchUp()
+
+
+# ------------------------------------------------------------------
+# Membership statistics
+#
+# member_stats holds one count per (dimension, value) and is rolled up
+# from a checkpoint on members.id: each new member adds 1 to each of its
+# values, in the same transaction that moves the checkpoint. The
+# background catch-up thread rolls up after submissions, imports roll up
+# each chunk, the dashboard catches up on whatever is left, and `flask
+# roll-up-stats` can run from cron. Select values are counted
+# under their English option, so all languages land in one row.
+# ------------------------------------------------------------------
+STATS_FIELDS = ("membership_type", "pay_method", "gender", "education", "lang")
+STATS_DIMENSIONS = STATS_FIELDS + ("month",)
+STATS_BATCH = 5000
+STATS_CACHE_TTL = float(os.environ.get("STATS_CACHE_TTL", 30))
+_STATS_COLUMNS = ("id", "submitted_at") + STATS_FIELDS
+
+_stats_cache = {}
+
+
+@lru_cache(maxsize=None)
+def canonical_options(field):
+    """{option of `field` in any language pack: the English option}."""
+    english = OPTION_SOURCES[field](LABELS["en"])
+    mapping = {v: v for v in english}
+    for code in LABELS:
+        for value, canonical in zip(OPTION_SOURCES[field](LABELS[code]), english):
+            mapping.setdefault(value, canonical)
+    return mapping
+
+
+def stat_values(row):
+    """The (dimension, value) pairs a member counts towards."""
+    for dim in STATS_FIELDS:
+        value = (row[dim] or "").strip()
+        if dim in OPTION_SOURCES:
+            value = canonical_options(dim).get(value, value)
+        yield dim, value
+    yield "month", row["submitted_at"].strftime("%Y-%m") if row["submitted_at"] else ""
+
+
+def roll_up_stats(limit=STATS_BATCH):
+    """Add members newer than the "stats" checkpoint to member_stats.
+    Returns the number of members counted."""
+    t, st = Member.__table__, MemberStat.__table__
+    with engine.begin() as conn:
+        last_id = conn.execute(select(BackfillCheckpoint.last_id)
+                               .where(BackfillCheckpoint.name == "stats")).scalar()
+        if last_id is None:
+            last_id = 0
+            conn.execute(BackfillCheckpoint.__table__.insert().values(name="stats", last_id=0))
+        rows = conn.execute(select(*[t.c[k] for k in _STATS_COLUMNS])
+                            .where(t.c.id > last_id).order_by(t.c.id).limit(limit)).mappings().all()
+        if not rows:
+            return 0
+        counts = Counter(pair for row in rows for pair in stat_values(row))
+        for (dim, value), n in counts.items():
+            updated = conn.execute(st.update().where(st.c.dimension == dim, st.c.value == value)
+                                   .values(count=st.c.count + n)).rowcount
+            if not updated:
+                conn.execute(st.insert().values(dimension=dim, value=value, count=n))
+        moved = conn.execute(
+            BackfillCheckpoint.__table__.update()
+            .where(BackfillCheckpoint.name == "stats", BackfillCheckpoint.last_id == last_id)
+            .values(last_id=rows[-1]["id"], updated_at=datetime.utcnow())
+        ).rowcount
+        if not moved:
+            raise _CheckpointRaced()
+    _stats_cache.clear()
+    return len(rows)
+
+
+def roll_up_stats_quietly(limit=50):
+    """roll_up_stats() for imports and the dashboard: never fails the caller."""
+    try:
+        roll_up_stats(limit)
+    except (_CheckpointRaced, IntegrityError):
+        pass  # another worker is counting the same rows
+    except Exception:
+        app.logger.exception("stats roll-up failed; the next run catches up")
+
+
+def rebuild_stats():
+    """Recount member_stats from the whole members table. Returns the
+    number of members counted."""
+    t, st = Member.__table__, MemberStat.__table__
+    with engine.begin() as conn:
+        # Write first: this takes the lock, so no roll-up interleaves
+        # between the count and the new checkpoint.
+        conn.execute(BackfillCheckpoint.__table__.delete().where(BackfillCheckpoint.name == "stats"))
+        counts = Counter()
+        last_id = members = 0
+        result = conn.execution_options(stream_results=True).execute(
+            select(*[t.c[k] for k in _STATS_COLUMNS]).order_by(t.c.id))
+        for row in result.mappings():
+            counts.update(stat_values(row))
+            last_id = row["id"]
+            members += 1
+        conn.execute(st.delete())
+        if counts:
+            conn.execute(st.insert(), [{"dimension": dim, "value": value, "count": n}
+                                       for (dim, value), n in counts.items()])
+        conn.execute(BackfillCheckpoint.__table__.insert().values(name="stats", last_id=last_id))
+    _stats_cache.clear()
+    return members
+
+
+def member_stats():
+    """The dashboard summary, served from memory for STATS_CACHE_TTL
+    seconds: {"total", "pending", "as_of", "dimensions": {dim: [[value,
+    count], ...]}}. Months are listed in order, other values by count."""
+    cached = _stats_cache.get("summary")
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    roll_up_stats_quietly(STATS_BATCH)
+    t, st = Member.__table__, MemberStat.__table__
+    with engine.connect() as conn:
+        last_id = conn.execute(select(BackfillCheckpoint.last_id)
+                               .where(BackfillCheckpoint.name == "stats")).scalar() or 0
+        rows = conn.execute(select(st)).all()
+        pending = conn.execute(select(func.count()).select_from(t).where(t.c.id > last_id)).scalar()
+    dimensions = {dim: [] for dim in STATS_DIMENSIONS}
+    for row in rows:
+        if row.count and row.dimension in dimensions:
+            dimensions[row.dimension].append([row.value, row.count])
+    for dim, items in dimensions.items():
+        items.sort(key=(lambda item: item[0]) if dim == "month" else (lambda item: (-item[1], item[0])))
+    summary = {
+        "total": sum(n for _, n in dimensions["lang"]),
+        "pending": pending,
+        "as_of": datetime.utcnow().isoformat(timespec="seconds"),
+        "dimensions": dimensions,
+    }
+    _stats_cache["summary"] = (time.monotonic() + STATS_CACHE_TTL, summary)
+    return summary
+
+
+@app.cli.command("roll-up-stats")
+@click.option("--rebuild", is_flag=True, help="Recount from scratch instead of adding new members.")
+def roll_up_stats_command(rebuild):
+    """Bring the membership statistics up to date (safe to run from cron)."""
+    if rebuild:
+        click.echo(f"Done: {rebuild_stats()} member(s) counted.")
+        return
+    total = 0
+    while True:
+        n = roll_up_stats()
+        if not n:
+            break
+        total += n
+        click.echo(f"{total} member(s) counted")
+    click.echo("Done.")
+
+
+@app.route("/admin/api/stats")
+@admin_required
+def admin_stats_api():
+    resp = app.json.response(member_stats())
+    resp.cache_control.private = True
+    resp.cache_control.max_age = int(STATS_CACHE_TTL)
+    return resp
+
+
+@app.route("/admin/stats")
+@admin_required
+def admin_stats():
+    resp = app.make_response(page("admin_stats", stats=member_stats()))
+    resp.cache_control.private = True
+    resp.cache_control.max_age = int(STATS_CACHE_TTL)
+    return resp
+
+
+# ------------------------------------------------------------------
+# Upload garbage collection
+# ------------------------------------------------------------------
+
+def blob_refcounts():
+    """How many members reference each stored upload."""
+    db = DBSession()
+    try:
+        counts = Counter()
+        for col in (Member.doc_file, Member.payment_file):
+            for name, n in db.query(col, func.count()).filter(col.isnot(None)).group_by(col):
+                counts[name] += n
+        return counts
+    finally:
+        db.close()
+
+
+def gc_uploads(grace=DRAFT_TTL, dry_run=False):
+    """Remove uploads that no member or live draft references.
+
+    Files modified within `grace` seconds are kept: they may belong to a
+    draft that is mid-step. Returns the list of removed names.
+    """
+    keep = set(blob_refcounts()) | drafts.referenced_files()
+    now = time.time()
+    removed = []
+    derived = []  # previews, kept originals and source links
+    for root, dirs, files in os.walk(UPLOAD_DIR):
+        if root == UPLOAD_DIR:
+            dirs[:] = [d for d in dirs if d != ".tmp"]
+        for fn in files:
+            path = os.path.join(root, fn)
+            name = os.path.relpath(path, UPLOAD_DIR).replace(os.sep, "/")
+            if ".thumb." in fn or ".orig." in fn or fn.endswith(".src"):
+                derived.append(name)
+                continue
+            if name in keep or now - os.path.getmtime(path) < grace:
+                continue
+            if not dry_run:
+                os.unlink(path)
+            removed.append(name)
+    # Previews and kept originals go with their upload, source links with
+    # the processed image they point to.
+    gone = set(removed)
+    for name in derived:
+        if name.endswith(".src"):
+            target = os.path.normpath(os.path.join(os.path.dirname(name), os.readlink(os.path.join(UPLOAD_DIR, name))))
+            blob = target.replace(os.sep, "/")
+        else:
+            blob = re.sub(r"\.(thumb|orig)\.\w+$", "", name)
+        if blob in gone or not os.path.exists(os.path.join(UPLOAD_DIR, blob)):
+            if not dry_run:
+                os.unlink(os.path.join(UPLOAD_DIR, name))
+            removed.append(name)
+    # Temp files of uploads that died mid-request.
+    for fn in os.listdir(UPLOAD_TMP_DIR):
+        path = os.path.join(UPLOAD_TMP_DIR, fn)
+        if now - os.path.getmtime(path) > 3600 and not dry_run:
+            os.unlink(path)
+    return removed
+
+
+@app.cli.command("gc-uploads")
+@click.option("--grace", default=DRAFT_TTL, show_default=True, help="Keep files newer than this many seconds.")
+@click.option("--dry-run", is_flag=True, help="Only list what would be removed.")
+def gc_uploads_command(grace, dry_run):
+    """Delete uploads left behind by abandoned drafts."""
+    removed = gc_uploads(grace, dry_run)
+    for name in removed:
+        click.echo(name)
+    click.echo(f"{'Would remove' if dry_run else 'Removed'} {len(removed)} file(s).")
+
+
+@app.cli.command("drain-submissions")
+def drain_submissions_command():
+    """Insert every journaled write-behind submission now."""
+    journal = submit_journal or SubmitJournal(SUBMIT_JOURNAL_DIR)
+    journal._adopt_orphans()
+    click.echo("Journals drained.")
+
+
+# ------------------------------------------------------------------
+# Funnel report: where applicants give up, per language
+# ------------------------------------------------------------------
+
+def funnel_report(directory=FUNNEL_DIR, since=None, active_minutes=60):
+    """Aggregate the funnel event logs.
+
+    Returns {lang: {"drafts", "submitted", "in_progress", "steps": {step:
+    {"reached", "dropped", "median_seconds", "invalid", "uploads_ok",
+    "uploads_failed", "rejected"}}}}. A draft that isn't submitted counts
+    as dropped at the furthest step it saw, unless it was active in the
+    last `active_minutes`.
+    """
+    events = {}
+    for fn in sorted(os.listdir(directory)) if os.path.isdir(directory) else ():
+        if not fn.endswith(".jsonl"):
+            continue
+        with open(os.path.join(directory, fn)) as fh:
+            for line in fh:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue  # torn line at the end of a live file
+                if since is None or e["t"] >= since:
+                    events.setdefault(e["d"], []).append(e)
+
+    cutoff = time.time() - active_minutes * 60
+    report = {}
+    steps = range(2, REVIEW_STEP + 1)
+    for draft_events in events.values():
+        draft_events.sort(key=lambda e: e["t"])
+        r = report.get(draft_events[-1]["l"])
+        if r is None:
+            r = report[draft_events[-1]["l"]] = {
+                "drafts": 0, "submitted": 0, "in_progress": 0,
+                "steps": {n: {"reached": 0, "dropped": 0, "seconds": [], "invalid": 0,
+                              "uploads_ok": 0, "uploads_failed": 0, "rejected": 0} for n in steps},
+            }
+        r["drafts"] += 1
+        furthest, submitted, viewed, dwell = 0, False, {}, {}
+        for e in draft_events:
+            kind, n = e["e"], e.get("s")
+            if kind == "view":
+                furthest = max(furthest, n)
+                viewed[n] = e["t"]
+            elif kind == "leave" and n in r["steps"]:
+                if n in viewed:
+                    dwell[n] = dwell.get(n, 0) + e["t"] - viewed.pop(n)
+                st = r["steps"][n]
+                st["invalid"] += not e.get("ok", True)
+                for ok in e.get("uploads", {}).values():
+                    st["uploads_ok" if ok else "uploads_failed"] += 1
+            elif kind == "reject" and n in r["steps"]:
+                r["steps"][n]["rejected"] += 1
+            elif kind == "submit":
+                submitted = True
+        for n in steps:
+            if furthest >= n:
+                r["steps"][n]["reached"] += 1
+        for n, seconds in dwell.items():
+            r["steps"][n]["seconds"].append(seconds)
+        if submitted:
+            r["submitted"] += 1
+        elif draft_events[-1]["t"] >= cutoff:
+            r["in_progress"] += 1
+        elif furthest in r["steps"]:
+            r["steps"][furthest]["dropped"] += 1
+
+    for r in report.values():
+        for st in r["steps"].values():
+            seconds = st.pop("seconds")
+            st["median_seconds"] = round(statistics.median(seconds), 1) if seconds else None
+    return report
+
+
+@app.cli.command("funnel-report")
+@click.option("--since", default=None, help="Only events from this day on (YYYY-MM-DD).")
+@click.option("--active-minutes", default=60, show_default=True,
+              help="Unsubmitted drafts active this recently count as in progress, not dropped.")
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON.")
+def funnel_report_command(since, active_minutes, as_json):
+    """Drop-off and median time per wizard step, per language."""
+    since_ts = datetime.strptime(since, "%Y-%m-%d").timestamp() if since else None
+    report = funnel_report(since=since_ts, active_minutes=active_minutes)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    for lang, r in sorted(report.items()):
+        done = f"{r['submitted'] / r['drafts']:.0%}" if r["drafts"] else "-"
+        click.echo(f"[{lang}] {r['drafts']} draft(s), {r['submitted']} submitted ({done}), "
+                   f"{r['in_progress']} in progress")
+        click.echo(f"  {'step':>4} {'reached':>8} {'dropped':>8} {'drop%':>6} {'median s':>9} "
+                   f"{'invalid':>8} {'uploads ok/failed/too big':>26}")
+        for n, st in r["steps"].items():
+            drop = f"{st['dropped'] / st['reached']:.0%}" if st["reached"] else "-"
+            median = "-" if st["median_seconds"] is None else st["median_seconds"]
+            uploads = f"{st['uploads_ok']}/{st['uploads_failed']}/{st['rejected']}"
+            click.echo(f"  {n:>4} {st['reached']:>8} {st['dropped']:>8} {drop:>6} {median:>9} "
+                       f"{st['invalid']:>8} {uploads:>26}")
 
 
 if __name__ == "__main__":
     import os
+    upgrade_schema()  # development server; deploys run `flask upgrade-schema`
     app.run(
         debug=True, 
         host="0.0.0.0",  # allows the app to be accessed publicly
@@ -0,0 +1,161 @@
+"""ASGI entry point for the membership app.
+
+The Flask views stay synchronous. This adapter receives each request
+body on the event loop and spools it to a temp file, so a slow mobile
+upload costs a socket, not a thread. Only a fully received request
+reaches the thread pool that runs the app. Response chunks go back the
+same way: each chunk is produced in the pool and sent from the loop.
+
+Run it with uvicorn workers under gunicorn (see gunicorn.conf.py):
+
+    SERVE_ASGI=1 gunicorn -c gunicorn.conf.py
+
+or standalone for development: python asgi.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 32))
+SPOOL_MEMORY = 256 * 1024  # request bodies above this go to disk
+
+
+class WsgiToAsgi:
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, max_body=None):
+        self.wsgi_app = wsgi_app
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+        try:
+            length = _content_length(scope)
+            if self.max_body is not None and length is not None and length > self.max_body:
+                # Don't read it; the app rejects the declared length itself
+                # and answers the way it does for any oversized upload.
+                return await self._run(scope, body, send)
+            size = 0
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if self.max_body is not None and size > self.max_body:
+                    return await _plain(send, 413, b"Request body too large")
+                body.write(chunk)
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            await self._run(scope, body, send)
+        finally:
+            body.close()
+
+    async def _run(self, scope, body, send):
+        loop = asyncio.get_running_loop()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        def first_chunk():
+            result = self.wsgi_app(_environ(scope, body), start_response)
+            it = iter(result)
+            return result, it, next(it, None)
+
+        result, it, chunk = await loop.run_in_executor(self.executor, first_chunk)
+        try:
+            await send({"type": "http.response.start", "status": response["status"],
+                        "headers": response["headers"]})
+            while chunk is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, next, it, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self.executor, result.close)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def _content_length(scope):
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def _environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        # The whole body is spooled, so a chunked request (no
+        # Content-Length) can be read to EOF.
+        "wsgi.input_terminated": True,
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key == "CONTENT_LENGTH":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _plain(send, status, text):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(text)).encode()),
+                            (b"connection", b"close")]})
+    await send({"type": "http.response.body", "body": text})
+
+
+application = WsgiToAsgi(app, max_body=app.config.get("MAX_CONTENT_LENGTH"))
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(application, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,374 @@
+"""Benchmark the whole application flow.
+
+Each simulated applicant does the following, in order:
+- picks a language
+- goes through steps 2-8, uploading synthetic PDFs of mixed sizes on
+  steps 4 and 8
+- opens the review page
+- submits
+
+Every run uses a fresh temp directory for the database, drafts,
+uploads, metrics and funnel logs.
+
+    python bench.py client   --applicants 200              # Flask test client, in-process
+    python bench.py gunicorn --applicants 500 --workers 4 --concurrency 16
+    python bench.py compare  before.json after.json        # exit 1 on a regression
+
+The JSON written with --out contains:
+- the run's parameters and the git commit
+- throughput
+- p50/p95/p99 latency for each step (GET and POST separately)
+- memory per process
+- database growth
+
+Run `compare` on two of these files to find regressions.
+"""
+import atexit
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlencode
+
+import click
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_SIZES = (20 * 1024, 200 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+LANGS = ("en", "ne", "ji")
+
+
+def applicant(i, lang):
+    """Form data for steps 2-8 of applicant `i` (unique phone, email and
+    transaction id, so validation passes)."""
+    size = UPLOAD_SIZES[i % len(UPLOAD_SIZES)]
+    return lang, {
+        2: dict(name=f"Bench {i}", full_name_en=f"Bench Applicant {i}", dob_bs="2050-01-15", dob_ad="",
+                gender="", occupation="tester"),
+        3: dict(perm_address="Dolakha", temp_address="Kathmandu", phone=f"98{i:08d}", email=f"bench{i}@example.com"),
+        4: dict(doc_type="", doc_issued_date="2070-01-01", doc_file=("doc.pdf", size)),
+        5: dict(education=""),
+        6: dict(job_title="eng", experience_years="3", skills="python", org_name="org"),
+        7: dict(father_name="f", mother_name="m", spouse_name="", children="0", em_name="e",
+                em_relation="b", em_phone="9800000000", em_address="a"),
+        8: dict(membership_type="", pay_method="", transaction_id=f"BENCH{i:08d}", declaration="yes",
+                payment_file=("pay.pdf", size // 4)),
+    }
+
+
+def pdf_bytes(size):
+    # Random content: every upload is a new blob, like real scans.
+    return b"%PDF-1.4\n" + os.urandom(max(size - 9, 0))
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return {"count": len(s), "mean_ms": round(1000 * sum(s) / len(s), 3), "p50_ms": round(1000 * pick(0.5), 3),
+            "p95_ms": round(1000 * pick(0.95), 3), "p99_ms": round(1000 * pick(0.99), 3)}
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = []
+
+    def add(self, label, seconds, status, expected):
+        with self.lock:
+            self.samples.setdefault(label, []).append(seconds)
+            if status not in expected:
+                self.errors.append(f"{label}: HTTP {status}")
+
+
+def db_bytes(workdir):
+    return sum(os.path.getsize(os.path.join(workdir, fn)) for fn in os.listdir(workdir)
+               if fn.startswith("bench.db"))
+
+
+def run_env(workdir):
+    return {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "DRAFT_DB": os.path.join(workdir, "drafts.db"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "FUNNEL_DIR": os.path.join(workdir, "funnel"),
+        "SUBMIT_JOURNAL_DIR": os.path.join(workdir, "journal"),
+        # Every simulated applicant comes from 127.0.0.1.
+        "RATE_LIMIT_STORE": "off",
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ------------------------------------------------------------------
+# Drivers: one applicant's full flow
+# ------------------------------------------------------------------
+
+def drive_client(client, rec, lang, steps):
+    """Through the Flask test client (in-process, no HTTP)."""
+    def call(label, method, url, expected, **kw):
+        start = time.perf_counter()
+        r = getattr(client, method)(url, **kw)
+        rec.add(label, time.perf_counter() - start, r.status_code, expected)
+
+    call("index", "get", "/", (200,))
+    call("set_language", "post", "/set-language", (302,), data={"lang": lang})
+    for n, fields in steps.items():
+        call(f"step{n} GET", "get", f"/step/{n}", (200,))
+        data = {k: (io.BytesIO(pdf_bytes(v[1])), v[0]) if isinstance(v, tuple) else v for k, v in fields.items()}
+        call(f"step{n} POST", "post", f"/step/{n}", (302,), data={**data, "action": "next"},
+             content_type="multipart/form-data")
+    call("step9 GET", "get", "/step/9", (200,))
+    call("submit", "post", "/submit", (302,))
+
+
+def drive_http(host, port, rec, lang, steps):
+    """Over HTTP against a running server, keeping the session cookie."""
+    conn = HTTPConnection(host, port, timeout=60)
+    cookie = {}
+
+    def call(label, method, path, expected, body=None, content_type=None):
+        headers = {"Cookie": "; ".join(f"{k}={v}" for k, v in cookie.items())} if cookie else {}
+        if content_type:
+            headers["Content-Type"] = content_type
+        start = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers)
+        r = conn.getresponse()
+        r.read()
+        rec.add(label, time.perf_counter() - start, r.status, expected)
+        for value in r.headers.get_all("Set-Cookie") or ():
+            name, _, rest = value.partition("=")
+            cookie[name] = rest.split(";", 1)[0]
+
+    call("index", "GET", "/", (200,))
+    call("set_language", "POST", "/set-language", (302,), urlencode({"lang": lang}),
+         "application/x-www-form-urlencoded")
+    for n, fields in steps.items():
+        call(f"step{n} GET", "GET", f"/step/{n}", (200,))
+        body, ctype = multipart({**fields, "action": "next"})
+        call(f"step{n} POST", "POST", f"/step/{n}", (302,), body, ctype)
+    call("step9 GET", "GET", "/step/9", (200,))
+    call("submit", "POST", "/submit", (302,), b"", "application/x-www-form-urlencoded")
+    conn.close()
+
+
+def multipart(fields):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for k, v in fields.items():
+        if isinstance(v, tuple):
+            filename, size = v
+            head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"; filename="{filename}"\r\n'
+                    f"Content-Type: application/pdf\r\n\r\n")
+            parts += [head.encode(), pdf_bytes(size), b"\r\n"]
+        else:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+# ------------------------------------------------------------------
+# Process memory (Linux /proc)
+# ------------------------------------------------------------------
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def children(pid):
+    kids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as fh:
+                    if int(fh.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        kids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return kids
+
+
+def summarize(mode, params, rec, elapsed, applicants, db_before, db_after, memory):
+    total = sum(len(v) for v in rec.samples.values())
+    return {
+        "mode": mode,
+        "commit": git_commit(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": params,
+        "elapsed_s": round(elapsed, 3),
+        "applicants_per_s": round(applicants / elapsed, 2),
+        "requests_per_s": round(total / elapsed, 1),
+        "errors": len(rec.errors),
+        "error_samples": rec.errors[:10],
+        "steps": {label: percentiles(s) for label, s in rec.samples.items()},
+        "memory_mb": memory,
+        "db_bytes": {"before": db_before, "after": db_after,
+                     "per_applicant": round((db_after - db_before) / max(applicants, 1))},
+    }
+
+
+def report(result, out):
+    click.echo(f"{result['mode']}: {result['applicants_per_s']} applicants/s, "
+               f"{result['requests_per_s']} req/s, {result['errors']} error(s)")
+    click.echo(f"  {'step':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, p in result["steps"].items():
+        click.echo(f"  {label:<16}{p['count']:>6}{p['p50_ms']:>10}{p['p95_ms']:>10}{p['p99_ms']:>10}")
+    click.echo(f"  memory MB: {result['memory_mb']}")
+    click.echo(f"  db bytes/applicant: {result['db_bytes']['per_applicant']}")
+    if out:
+        with open(out, "w") as fh:
+            json.dump(result, fh, indent=2)
+        click.echo(f"  written to {out}")
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--applicants", default=100, show_default=True)
+@click.option("--seed", default=1, show_default=True)
+@click.option("--out", default=None, help="Write the results as JSON here.")
+@click.option("--keep", is_flag=True, help="Keep the temp directory.")
+def client(applicants, seed, out, keep):
+    """Run the flow in-process through Flask's test client."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    if not keep:
+        # Registered first, so it runs after the app's own exit flushes.
+        atexit.register(shutil.rmtree, workdir, True)
+    os.environ.update(run_env(workdir))
+    sys.path.insert(0, HERE)
+    import app as membership
+
+    membership.upgrade_schema()
+    membership.warm_templates()
+    rnd = random.Random(seed)
+    rec = Recorder()
+    db_before = db_bytes(workdir)
+    start = time.perf_counter()
+    for i in range(applicants):
+        lang, steps = applicant(i, rnd.choice(LANGS))
+        drive_client(membership.app.test_client(), rec, lang, steps)
+    elapsed = time.perf_counter() - start
+    memory = {"process_peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    result = summarize("client", {"applicants": applicants, "seed": seed}, rec, elapsed, applicants,
+                       db_before, db_bytes(workdir), memory)
+    report(result, out)
+
+
+@cli.command()
+@click.option("--applicants", default=200, show_default=True)
+@click.option("--workers", default=4, show_default=True)
+@click.option("--concurrency", default=8, show_default=True, help="Applicants in flight at once.")
+@click.option("--asgi", is_flag=True, help="Serve with uvicorn workers (SERVE_ASGI=1).")
+@click.option("--seed", default=1, show_default=True)
+@click.option("--out", default=None, help="Write the results as JSON here.")
+@click.option("--keep", is_flag=True, help="Keep the temp directory.")
+def gunicorn(applicants, workers, concurrency, asgi, seed, out, keep):
+    """Run the flow over HTTP against a local gunicorn."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {**os.environ, **run_env(workdir), "BIND": f"127.0.0.1:{port}", "WEB_CONCURRENCY": str(workers),
+           "DRAFT_STORE": "sqlite"}
+    if asgi:
+        env["SERVE_ASGI"] = "1"
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "upgrade-schema"], cwd=HERE, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], cwd=HERE, env=env,
+                              stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "gunicorn.log"), "w"))
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise click.ClickException(f"gunicorn didn't start; see {workdir}/gunicorn.log")
+                time.sleep(0.2)
+        # One warm-up applicant per worker so imports and template
+        # compilation aren't measured.
+        warm = Recorder()
+        for i in range(workers):
+            drive_http("127.0.0.1", port, warm, *applicant(10_000_000 + i, "en"))
+
+        rnd = random.Random(seed)
+        flows = [applicant(i, rnd.choice(LANGS)) for i in range(applicants)]
+        rec = Recorder()
+        db_before = db_bytes(workdir)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            for f in [pool.submit(drive_http, "127.0.0.1", port, rec, lang, steps) for lang, steps in flows]:
+                f.result()
+        elapsed = time.perf_counter() - start
+        memory = {"master": rss_mb(server.pid), "workers": [rss_mb(pid) for pid in children(server.pid)]}
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+    params = {"applicants": applicants, "workers": workers, "concurrency": concurrency, "asgi": asgi, "seed": seed}
+    result = summarize("gunicorn-asgi" if asgi else "gunicorn", params, rec, elapsed, applicants,
+                       db_before, db_bytes(workdir), memory)
+    report(result, out)
+    if not keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@cli.command()
+@click.argument("before", type=click.Path(exists=True))
+@click.argument("after", type=click.Path(exists=True))
+@click.option("--threshold", default=1.2, show_default=True, help="Slowdown ratio reported as a regression.")
+@click.option("--metric", default="p95_ms", show_default=True, type=click.Choice(["p50_ms", "p95_ms", "p99_ms"]))
+def compare(before, after, threshold, metric):
+    """Compare two result files; exit 1 if any step regressed."""
+    with open(before) as fh:
+        a = json.load(fh)
+    with open(after) as fh:
+        b = json.load(fh)
+    regressed = []
+    click.echo(f"{'step':<16}{'before':>10}{'after':>10}{'ratio':>8}")
+    for label in b["steps"]:
+        old, new = a["steps"].get(label, {}).get(metric), b["steps"][label][metric]
+        if not old:
+            click.echo(f"{label:<16}{'-':>10}{new:>10}")
+            continue
+        ratio = new / old
+        flag = "  REGRESSION" if ratio > threshold else ""
+        click.echo(f"{label:<16}{old:>10}{new:>10}{ratio:>8.2f}{flag}")
+        if flag:
+            regressed.append(label)
+    click.echo(f"throughput: {a['applicants_per_s']} -> {b['applicants_per_s']} applicants/s")
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
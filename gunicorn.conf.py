@@ -0,0 +1,41 @@
+# Gunicorn settings for the membership app.
+#
+#   gunicorn -c gunicorn.conf.py                 sync workers (app:app)
+#   SERVE_ASGI=1 gunicorn -c gunicorn.conf.py    uvicorn workers (asgi:application)
+#
+# Sync workers hold a whole process for the full length of a request,
+# including a slow phone uploading a scan on step 4 or 8. With SERVE_ASGI
+# each worker's event loop receives request bodies (needs
+# `pip install uvicorn`) and only complete requests use one of its
+# ASGI_THREADS app threads, so a few workers per core can carry thousands
+# of slow clients. With several workers, use the shared draft store
+# (DRAFT_STORE=sqlite or redis), not memory.
+#
+# Workers don't touch the schema; after a deploy, run
+# `flask --app app upgrade-schema` once before starting them.
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+if os.environ.get("SERVE_ASGI"):
+    wsgi_app = "asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+else:
+    wsgi_app = "app:app"
+    worker_class = "sync"
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+# Time allowed for one request. ASGI workers only count app time here, not
+# the time spent receiving an upload.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_worker_init(worker):
+    # Compile every page for every language before the first request.
+    from app import warm_templates
+
+    warm_templates()
@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py configures itself from the environment at import, so point every
+# file it writes at a scratch directory before any test imports it.
+WORKDIR = tempfile.mkdtemp(prefix="membership-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'members.db')}",
+    "DRAFT_DB": os.path.join(WORKDIR, "drafts.db"),
+    "UPLOAD_DIR": os.path.join(WORKDIR, "uploads"),
+    "METRICS_DIR": os.path.join(WORKDIR, "metrics"),
+    "FUNNEL_DIR": os.path.join(WORKDIR, "funnel"),
+    "SUBMIT_JOURNAL_DIR": os.path.join(WORKDIR, "journal"),
+    "IMPORT_DIR": os.path.join(WORKDIR, "imports"),
+    "SCHEMA_LOCK": os.path.join(WORKDIR, ".schema.lock"),
+    "RATE_LIMIT_STORE": "off",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import app
+    app.upgrade_schema()
+    app.app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,294 @@
+import io
+import re
+import uuid
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select
+
+REFERENCE_RE = re.compile(rb"[A-Z2-7]{5}-[A-Z2-7]{5}")
+
+
+def wizard_data(txid, doc_name="cit.pdf"):
+    """Form data of steps 2-8 for one Nepali-language applicant."""
+    return {
+        2: dict(name="राम जिरेल", full_name_en="Ram Jirel", dob_bs="2050-01-15", dob_ad="1993-04-28",
+                gender="पुरुष", occupation="किसान"),
+        3: dict(perm_address="Dolakha", temp_address="Kathmandu", phone="9841234567", email="ram@example.com"),
+        4: dict(doc_type="नागरिकता", doc_issued_date="2070-01-01",
+                doc_file=(io.BytesIO(b"%PDF-1.4 citizenship"), doc_name)),
+        5: dict(education="स्नातक"),
+        6: dict(job_title="eng", experience_years="3", skills="py", org_name="o"),
+        7: dict(father_name="f", mother_name="m", spouse_name="", children="0",
+                em_name="e", em_relation="b", em_phone="9800000000", em_address="a"),
+        8: dict(membership_type="आजीवन सदस्य", pay_method="खल्ती", transaction_id=txid, declaration="yes",
+                payment_file=(io.BytesIO(b"%PDF-1.4 receipt"), "pay.pdf")),
+    }
+
+
+def fill_wizard(client, txid, doc_name="cit.pdf"):
+    client.post("/set-language", data={"lang": "ne"})
+    for n, data in wizard_data(txid, doc_name).items():
+        r = client.post(f"/step/{n}", data={**data, "action": "next"}, content_type="multipart/form-data")
+        assert r.status_code == 302, (n, r.data[:500])
+        assert r.location.endswith(f"/step/{n + 1}")
+
+
+def new_txid():
+    return "TX" + uuid.uuid4().hex[:12]
+
+
+def current_draft(app_module, client):
+    with client.session_transaction() as s:
+        return s["draft"], app_module.drafts.load(s["draft"])
+
+
+# ------------------------------------------------------------------
+# Bikram Sambat dates
+# ------------------------------------------------------------------
+
+def test_bs_ad_known_dates(app_module):
+    assert app_module.bs_to_ad(1975, 1, 1) == date(1918, 4, 13)
+    assert app_module.bs_to_ad(2000, 1, 1) == date(1943, 4, 14)
+    assert app_module.bs_to_ad(2080, 1, 1) == date(2023, 4, 14)
+    assert app_module.ad_to_bs(date(2023, 4, 14)) == (2080, 1, 1)
+
+
+def test_bs_ad_round_trip_every_day(app_module):
+    d = app_module.BS_MIN_AD
+    expected = (app_module.BS_MIN_YEAR, 1, 1)
+    while d <= app_module.BS_MAX_AD:
+        bs = app_module.ad_to_bs(d)
+        assert bs == expected, d
+        assert app_module.bs_to_ad(*bs) == d
+        year, month, day = bs
+        if day < app_module.BS_MONTH_DAYS[year][month - 1]:
+            expected = (year, month, day + 1)
+        elif month < 12:
+            expected = (year, month + 1, 1)
+        else:
+            expected = (year + 1, 1, 1)
+        d += timedelta(days=1)
+
+
+@pytest.mark.parametrize("bs", [(2080, 13, 1), (2080, 1, 0), (2080, 1, 32), (1974, 12, 30), (2101, 1, 1)])
+def test_bs_to_ad_rejects_invalid(app_module, bs):
+    with pytest.raises(ValueError):
+        app_module.bs_to_ad(*bs)
+
+
+def test_ad_to_bs_rejects_out_of_range(app_module):
+    with pytest.raises(ValueError):
+        app_module.ad_to_bs(app_module.BS_MIN_AD - timedelta(days=1))
+    with pytest.raises(ValueError):
+        app_module.ad_to_bs(app_module.BS_MAX_AD + timedelta(days=1))
+
+
+def test_bs_strings_accept_devanagari_digits(app_module):
+    assert app_module.bs_string_to_ad("२०८०/०१/०१") == date(2023, 4, 14)
+    assert app_module.bs_string_to_ad("2080-02-33") is None
+    assert app_module.ad_to_bs_many([date(2023, 4, 14), "2023-04-14", "junk"]) == ["2080-01-01", "2080-01-01", None]
+
+
+def test_issued_date_is_not_guessed(app_module):
+    A = app_module
+    # A.D. 2070 is in the future, so only the B.S. reading fits.
+    assert A.issued_date_to_ad("2070-01-01") == date(2013, 4, 14)
+    # Both B.S. 2013 (1956 A.D.) and A.D. 2013 fit: no guess...
+    assert A.issued_date_to_ad("2013-04-14") is None
+    assert A.check_any_date("2013-04-14") == ("2013-04-14", "date_calendar")
+    # ...unless the applicant says which, or the birth date rules one out.
+    assert A.issued_date_to_ad("2013-04-14 A.D.") == date(2013, 4, 14)
+    assert A.issued_date_to_ad("२०१३/०४/१४ वि.सं.") == date(1956, 7, 29)
+    assert A.issued_date_to_ad("2013-04-14", dob=date(1990, 1, 1)) == date(2013, 4, 14)
+    assert A.check_any_date("2013-04-14 AD") == ("2013-04-14 AD", None)
+    assert A.check_any_date("2013-02-30 AD")[1] == "date"
+
+
+def test_backfill_flags_ambiguous_issue_dates(app_module):
+    A = app_module
+    t = A.Member.__table__
+    with A.engine.begin() as conn:
+        ids = [conn.execute(t.insert().values(
+            name="Backfill", submission_key=f"backfill-{n}-{new_txid()}", doc_issued_date=typed,
+            doc_issued_ad=stored)).inserted_primary_key[0]
+            for n, (typed, stored) in enumerate([
+                ("2013-04-14", date(1956, 7, 29)),  # guessed B.S. by older code
+                ("2070-01-01", None),
+                ("2013-04-14 AD", None)])]
+        conn.execute(A.BackfillCheckpoint.__table__.delete().where(A.BackfillCheckpoint.name == "dates"))
+    ambiguous = []
+    A.backfill_dates(pause=0, ambiguous=ambiguous)
+    assert ambiguous == ids[:1]
+    with A.engine.connect() as conn:
+        stored = dict(conn.execute(
+            select(t.c.id, t.c.doc_issued_ad).where(t.c.id.in_(ids))).all())
+    assert stored == {ids[0]: None, ids[1]: date(2013, 4, 14), ids[2]: date(2013, 4, 14)}
+
+
+# ------------------------------------------------------------------
+# Validation
+# ------------------------------------------------------------------
+
+def test_validate_step_normalizes_phone(app_module):
+    values = {"phone": "+977 984-123-4567", "email": "Ram@Example.com"}
+    assert app_module.validate_step(3, values) == {}
+    assert values["phone"] == "9841234567"
+    assert values["email"] == "ram@example.com"
+
+
+def test_validate_step_reports_bad_values(app_module):
+    errors = app_module.validate_step(3, {"phone": "12345", "email": "not-an-email"})
+    assert errors == {"phone": "phone", "email": "email"}
+
+
+@pytest.mark.parametrize("raw, stored", [
+    ("+977-1-4123456", "014123456"),   # Kathmandu landline dialled from abroad
+    ("977 61 523456", "061523456"),
+    ("01-4123456", "014123456"),
+    ("+९७७ ९८४१२३४५६७", "9841234567"),
+])
+def test_check_phone_landlines(app_module, raw, stored):
+    assert app_module.check_phone(raw) == (stored, None)
+
+
+def test_check_phone_rejects_trunk_zero_after_country_code_only_once(app_module):
+    assert app_module.check_phone("+977 0 98412345678")[1] == "phone"
+    assert app_module.check_phone("+977 123")[1] == "phone"
+
+
+def test_declaration_is_required(app_module, client):
+    client.post("/set-language", data={"lang": "en"})
+    data = wizard_data(new_txid())
+    for n in range(2, 8):
+        client.post(f"/step/{n}", data={**data[n], "action": "next"}, content_type="multipart/form-data")
+    step8 = dict(data[8], payment_file="")
+    del step8["declaration"]
+    r = client.post("/step/8", data={**step8, "action": "next"}, content_type="multipart/form-data")
+    assert r.status_code == 200
+    assert b"This field is required." in r.data
+    # Going back never blocks, and Finish re-checks the stored draft.
+    r = client.post("/step/8", data={**step8, "action": "prev"}, content_type="multipart/form-data")
+    assert r.location.endswith("/step/7")
+    r = client.post("/submit")
+    assert not r.location.endswith("/thank-you")
+    _, f = current_draft(app_module, client)
+    assert not f.get("declaration")
+
+
+def test_validate_form_unique_transaction_id(app_module):
+    txid = new_txid()
+    f = {k: "" for k in app_module.FIELDS}
+    f.update(name="Ram", phone="9841234567", email="ram@example.com", transaction_id=txid, declaration="yes")
+    app_module.save_member(f, "en", "key-a")
+
+    # The same transaction ID on another application is taken...
+    assert app_module.validate_form(f, "key-b") == (8, {"transaction_id": "taken"})
+    # ...but not on the application that saved it (a retried Finish).
+    assert app_module.validate_form(f, "key-a") == (None, {})
+    # Family members may share a phone and email.
+    assert app_module.validate_form(dict(f, transaction_id=new_txid()), "key-c") == (None, {})
+
+
+# ------------------------------------------------------------------
+# Wizard
+# ------------------------------------------------------------------
+
+def test_upload_with_devanagari_name(app_module, client):
+    client.post("/set-language", data={"lang": "ne"})
+    data = wizard_data(new_txid(), doc_name="नागरिकता.pdf")
+    for n in (2, 3, 4):
+        r = client.post(f"/step/{n}", data={**data[n], "action": "next"}, content_type="multipart/form-data")
+        assert r.status_code == 302, (n, r.data[:500])
+    _, f = current_draft(app_module, client)
+    assert f["doc_file"].endswith(".pdf")
+    assert client.get(f"/uploads/{f['doc_file']}").data == b"%PDF-1.4 citizenship"
+
+
+def test_upload_serving_revalidates_and_ranges(app_module, client):
+    client.post("/set-language", data={"lang": "ne"})
+    data = wizard_data(new_txid())
+    for n in (2, 3, 4):
+        client.post(f"/step/{n}", data={**data[n], "action": "next"}, content_type="multipart/form-data")
+    _, f = current_draft(app_module, client)
+    url = f"/uploads/{f['doc_file']}"
+
+    r = client.get(url)
+    assert r.status_code == 200
+    assert "immutable" in r.headers["Cache-Control"] and "private" in r.headers["Cache-Control"]
+    etag = r.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    r = client.get(url, headers={"Range": "bytes=0-3"})
+    assert r.status_code == 206
+    assert r.data == b"%PDF"
+    assert client.get("/uploads/../app.py").status_code == 404
+
+
+def test_upload_ignores_unknown_type(app_module, client):
+    client.post("/set-language", data={"lang": "ne"})
+    data = wizard_data(new_txid(), doc_name="नागरिकता.exe")
+    for n in (2, 3, 4):
+        client.post(f"/step/{n}", data={**data[n], "action": "next"}, content_type="multipart/form-data")
+    _, f = current_draft(app_module, client)
+    assert not f.get("doc_file")
+
+
+def test_retried_final_submit_gets_same_reference(app_module, client):
+    fill_wizard(client, new_txid())
+    draft_id, _ = current_draft(app_module, client)
+    old_cookie = client.get_cookie("session").value
+
+    r = client.post("/submit")
+    assert r.location.endswith("/thank-you")
+    reference = REFERENCE_RE.findall(client.get("/thank-you").data)
+    assert reference
+
+    # The first response was lost: the browser still has the old cookie.
+    client.set_cookie("session", old_cookie)
+    r = client.post("/submit")
+    assert r.location.endswith("/thank-you")
+    assert REFERENCE_RE.findall(client.get("/thank-you").data) == reference
+
+    db = app_module.DBSession()
+    try:
+        assert db.query(app_module.Member).filter_by(submission_key=draft_id).count() == 1
+    finally:
+        db.close()
+
+
+def test_finished_draft_is_not_reused(app_module, client):
+    fill_wizard(client, new_txid())
+    draft_id, _ = current_draft(app_module, client)
+    old_cookie = client.get_cookie("session").value
+    client.post("/submit")
+
+    client.set_cookie("session", old_cookie)
+    assert client.get("/step/2").status_code == 200
+    new_id, f = current_draft(app_module, client)
+    assert new_id != draft_id
+    assert not f
+
+
+def test_status_lookup_by_reference_and_phone(app_module, client):
+    fill_wizard(client, new_txid())
+    draft_id, _ = current_draft(app_module, client)
+    client.post("/submit")
+    reference = app_module.submission_reference(draft_id)
+
+    assert app_module.lookup_status(reference, "984-123-4567")["status"] == "received"
+    assert app_module.lookup_status(reference, "9800000001") is None
+
+
+# ------------------------------------------------------------------
+# Rate limiting
+# ------------------------------------------------------------------
+
+def test_token_buckets_take_all_or_nothing(app_module):
+    buckets = app_module.MemoryBuckets()
+    a, b = ("a", 1, 0.001, 2), ("b", 1, 0.001, 1)
+    assert buckets.take([a, b]) is None
+    refused = buckets.take([a, b])
+    assert refused is not None and refused[0] == 1
+    # The refused take left bucket "a" alone: one token is still there.
+    assert buckets.take([a]) is None
+    assert buckets.take([a])[0] == 0
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def asgi(app_module):
+    import asgi
+    return asgi
+
+
+def echo_app(environ, start_response):
+    body = environ["wsgi.input"].read()
+    start_response("200 OK", [("Content-Type", "text/plain"), ("X-Seen", environ.get("HTTP_X_TEST", ""))])
+    return [b"got ", str(len(body)).encode(), b": ", body[:10]]
+
+
+def call(adapter, messages, method="POST", path="/", headers=()):
+    """Run one request through the adapter; returns the sent messages."""
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": list(headers),
+             "http_version": "1.1", "scheme": "http", "server": ("test", 80), "client": ("127.0.0.1", 1234)}
+    incoming, sent = list(messages), []
+
+    async def receive():
+        return incoming.pop(0) if incoming else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(adapter(scope, receive, send))
+    return sent
+
+
+def body_of(sent):
+    return b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+
+
+def test_spools_chunked_body_and_streams_response(asgi):
+    adapter = asgi.WsgiToAsgi(echo_app, threads=2)
+    chunks = [{"type": "http.request", "body": b"x" * 200_000, "more_body": True},
+              {"type": "http.request", "body": b"y" * 200_000, "more_body": False}]
+    sent = call(adapter, chunks, headers=[(b"x-test", b"a"), (b"x-test", b"b")])
+    assert sent[0]["status"] == 200
+    assert (b"x-seen", b"a,b") in sent[0]["headers"]
+    assert body_of(sent) == b"got 400000: xxxxxxxxxx"
+    assert sent[-1] == {"type": "http.response.body", "body": b""}
+
+
+def test_oversized_body_never_reaches_app(asgi):
+    called = []
+
+    def app(environ, start_response):
+        called.append(environ)
+        return echo_app(environ, start_response)
+
+    adapter = asgi.WsgiToAsgi(app, threads=1, max_body=100)
+    sent = call(adapter, [{"type": "http.request", "body": b"z" * 60, "more_body": True},
+                          {"type": "http.request", "body": b"z" * 60, "more_body": False}])
+    assert sent[0]["status"] == 413
+    assert not called
+    # A client that goes away mid-upload doesn't reach the app either.
+    assert call(adapter, [{"type": "http.request", "body": b"z", "more_body": True}]) == []
+    assert not called
+
+
+def test_serves_the_membership_app(asgi):
+    sent = call(asgi.application, [{"type": "http.request", "body": b""}], method="GET", path="/status")
+    assert sent[0]["status"] == 200
+    assert b"<form" in body_of(sent)
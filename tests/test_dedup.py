@@ -0,0 +1,111 @@
+import random
+import threading
+import time
+
+from sqlalchemy import func, select
+
+FIRST = "Ram Sita Hari Gita Shyam Krishna Laxmi Maya Bikash Sunita Pemba Dawa Nima Lhakpa Mingma".split()
+LAST = "Jirel Sherpa Tamang Thapa Rai Gurung Shrestha Karki Magar Lama".split()
+
+
+def person(rng, i):
+    return dict(name=f"{rng.choice(FIRST)} {rng.choice(['', 'Kumar ', 'Bahadur '])}{rng.choice(LAST)}",
+                full_name_en=f"{rng.choice(FIRST)} {rng.choice(LAST)}",
+                phone=f"98{rng.randrange(10 ** 8):08d}", email=f"p{rng.randrange(3000)}@example.com",
+                dob_ad=f"{rng.randrange(1950, 2005)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 28):02d}",
+                transaction_id=f"DEDUP{i}")
+
+
+def bulk_insert(app_module, people, prefix):
+    rows = [app_module.member_values(p, "en", f"{prefix}-{i}") for i, p in enumerate(people)]
+    with app_module.engine.begin() as conn:
+        app_module.insert_members(conn, rows)
+
+
+def drain(app_module):
+    while True:
+        try:
+            if not app_module.index_new_members():
+                return
+        except app_module._CheckpointRaced:
+            pass  # the catch-up thread is on it too; go again
+
+
+def pairs(app_module):
+    dc = app_module.DuplicateCandidate.__table__
+    with app_module.engine.connect() as conn:
+        return {(min(r.member_id, r.other_id), max(r.member_id, r.other_id)): r.score
+                for r in conn.execute(select(dc))}
+
+
+def test_features_match_across_scripts(app_module):
+    A = app_module
+    devanagari = A.dedup_features(type("Row", (), dict(
+        name="राम जिरेल", full_name_en=None, phone="+977 9841234567", email=None,
+        dob_ad=None, transaction_id=None))())
+    latin = A.dedup_features(type("Row", (), dict(
+        name="Ram Jirel", full_name_en=None, phone="9841234567", email=None,
+        dob_ad=None, transaction_id=None))())
+    assert devanagari[0] & latin[0]  # share a name block and the phone block
+    score, reasons = A.duplicate_score(devanagari, latin)
+    assert score >= A.DEDUP_THRESHOLD
+    assert "phone" in reasons
+
+
+def test_incremental_index_matches_rebuild(app_module):
+    rng = random.Random(18)
+    bulk_insert(app_module, [person(rng, i) for i in range(600)], "dedup-a")
+    drain(app_module)
+    # Members indexed by their own Finish are skipped by the batch run.
+    for i in range(5):
+        f = {k: v for k, v in person(rng, 1000 + i).items()}
+        app_module.save_member({k: f.get(k, "") for k in app_module.FIELDS}, "en", f"dedup-live-{i}")
+    bulk_insert(app_module, [person(rng, 2000 + i) for i in range(300)], "dedup-b")
+    drain(app_module)
+    incremental = pairs(app_module)
+
+    app_module.rebuild_duplicates()
+    assert pairs(app_module) == incremental
+
+
+def test_finish_during_catch_up(app_module):
+    """A Finish must not wait out (or fail on) a catch-up run over a
+    large backlog: scoring happens outside the write lock."""
+    A = app_module
+    rng = random.Random(19)
+    bulk_insert(A, [person(rng, 5000 + i) for i in range(3000)], "dedup-c")
+
+    errors = []
+
+    def catch_up():
+        try:
+            A.CatchUp(pause=0.01).run_once()
+        except Exception as e:  # run_once() logs and swallows; anything here is a bug
+            errors.append(e)
+
+    worker = threading.Thread(target=catch_up)
+    worker.start()
+    saved = []
+    try:
+        while worker.is_alive() and len(saved) < 10:
+            f = person(rng, 9000 + len(saved))
+            key = f"dedup-finish-{len(saved)}"
+            start = time.perf_counter()
+            A.save_member({k: f.get(k, "") for k in A.FIELDS}, "en", key)
+            saved.append((key, time.perf_counter() - start))
+            time.sleep(0.05)
+    finally:
+        worker.join()
+    assert not errors
+    assert saved, "catch-up finished before any Finish ran"
+    # Each Finish should take milliseconds; a second means it queued
+    # behind a long write transaction.
+    assert max(seconds for _, seconds in saved) < 1.0, saved
+
+    drain(A)
+    t, mb = A.Member.__table__, A.MemberBlock.__table__
+    with A.engine.connect() as conn:
+        unindexed = conn.execute(
+            select(func.count()).select_from(t)
+            .where(~t.c.id.in_(select(mb.c.member_id)), t.c.name.is_not(None), t.c.name != "")).scalar()
+    assert unindexed == 0
@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def admin(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_PASSWORD", "secret")
+    return ("admin", "secret")
+
+
+@pytest.fixture
+def members(app_module):
+    """Three members of a membership type no other test uses."""
+    kind = f"export-{uuid.uuid4().hex[:8]}"
+    rows = []
+    for i, (name, day) in enumerate((("राम जिरेल", 1), ("Sita Jirel", 2), ("Hari, \"Jr\"", 3))):
+        values = app_module.member_values({"name": name, "membership_type": kind}, "en", f"export-{kind}-{i}")
+        rows.append(dict(values, submitted_at=datetime(2024, 5, day)))
+    with app_module.engine.begin() as conn:
+        app_module.insert_members(conn, rows)
+    return kind, [r["submission_key"] for r in rows]
+
+
+def test_csv_export_streams_filtered_rows(client, admin, members, monkeypatch, app_module):
+    kind, keys = members
+    monkeypatch.setattr(app_module, "EXPORT_BATCH", 2)
+    r = client.get(f"/admin/export?format=csv&membership_type={kind}&to=2024-05-02", auth=admin)
+    assert r.status_code == 200
+    assert r.is_streamed
+    text = r.data.decode()
+    assert text.startswith("﻿")  # for Excel and Devanagari
+    rows = list(csv.DictReader(io.StringIO(text[1:])))
+    assert [row["submission_key"] for row in rows] == keys[:2]
+    assert rows[0]["name"] == "राम जिरेल"
+    assert rows[0]["submitted_at"] == "2024-05-01T00:00:00"
+
+
+def test_jsonl_export_round_trips(client, admin, members):
+    kind, keys = members
+    r = client.get(f"/admin/export?format=jsonl&membership_type={kind}", auth=admin)
+    records = [json.loads(line) for line in r.data.decode().splitlines()]
+    assert [rec["submission_key"] for rec in records] == keys
+    assert records[2]["name"] == 'Hari, "Jr"'
+
+
+def test_xlsx_export_opens(client, admin, members):
+    openpyxl = pytest.importorskip("openpyxl")
+    kind, keys = members
+    r = client.get(f"/admin/export?format=xlsx&membership_type={kind}", auth=admin)
+    sheet = openpyxl.load_workbook(io.BytesIO(r.data), read_only=True).active
+    rows = list(sheet.iter_rows(values_only=True))
+    key_col = rows[0].index("submission_key")
+    assert [row[key_col] for row in rows[1:]] == keys
+
+
+def test_export_needs_admin(client, admin):
+    assert client.get("/admin/export").status_code == 401
+    assert client.get("/admin/export?format=pdf", auth=admin).status_code == 400
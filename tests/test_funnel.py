@@ -0,0 +1,47 @@
+import threading
+
+from flask import session
+
+
+def flusher_threads(name):
+    return sum(t.name == name for t in threading.enumerate())
+
+
+def test_concurrent_first_events_start_one_flusher(app_module, tmp_path):
+    log = app_module.FunnelLog(str(tmp_path), interval=60)
+    before = flusher_threads("funnel")
+    start = threading.Barrier(16)
+
+    def record(i):
+        with app_module.app.test_request_context():
+            session["draft"] = f"draft-{i}"
+            start.wait()
+            for _ in range(50):
+                log.record("view", s=2)
+
+    threads = [threading.Thread(target=record, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    log.flush()
+
+    assert flusher_threads("funnel") - before == 1
+    lines = sum(1 for fn in tmp_path.iterdir() for _ in fn.open())
+    assert lines == 16 * 50
+
+
+def test_funnel_report_counts_drop_off(app_module, client, tmp_path):
+    log = app_module.FunnelLog(str(tmp_path), interval=60)
+    for draft, furthest in (("a", 3), ("b", 3), ("c", 5)):
+        with app_module.app.test_request_context():
+            session["draft"] = draft
+            for n in range(2, furthest + 1):
+                log.record("view", s=n)
+            if draft == "c":
+                log.record("submit")
+    log.flush()
+    report = app_module.funnel_report(str(tmp_path), active_minutes=0)["en"]
+    assert report["drafts"] == 3
+    assert report["submitted"] == 1
+    assert report["steps"][3]["dropped"] == 2
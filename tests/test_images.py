@@ -0,0 +1,52 @@
+import io
+import os
+import time
+import uuid
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def jpeg(size=(3000, 1000), orientation=None):
+    buf = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    exif[0x010F] = "PhoneMaker"
+    Image.new("RGB", size, (200, 30, 30)).save(buf, "JPEG", quality=95, exif=exif.tobytes())
+    return buf.getvalue()
+
+
+def test_recompress_rotates_shrinks_and_strips(app_module, tmp_path):
+    src, dest = tmp_path / "in.jpg", tmp_path / "out"
+    src.write_bytes(jpeg(orientation=6))  # rotated 90 degrees by the camera
+    assert app_module.recompress_image(str(src), str(dest), 2000, 80) == "jpg"
+    with Image.open(dest) as im:
+        assert im.size == (667, 2000)  # upright and capped
+        assert not im.getexif()
+
+
+def test_recompress_keeps_png_that_would_grow(app_module, tmp_path):
+    src = tmp_path / "in.png"
+    Image.new("L", (10, 10), 255).save(src, "PNG", optimize=True)
+    assert app_module.recompress_image(str(src), str(tmp_path / "out"), 2000, 80) is None
+
+
+def test_preview_rendered_in_background(app_module, client):
+    name = f"zz/{uuid.uuid4().hex}.jpg"
+    path = os.path.join(app_module.UPLOAD_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(jpeg())
+    with app_module.app.test_request_context():
+        assert app_module.preview_url(name) is None
+        app_module.schedule_preview(name)
+        deadline = time.monotonic() + 10
+        while app_module.preview_url(name) is None:
+            assert time.monotonic() < deadline, "no preview rendered"
+            time.sleep(0.05)
+        url = app_module.preview_url(name)
+    with Image.open(io.BytesIO(client.get(url).data)) as im:
+        assert max(im.size) <= max(app_module.PREVIEW_SIZE)
+    assert app_module.make_preview(name) is False  # already there
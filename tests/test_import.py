@@ -0,0 +1,70 @@
+import csv
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+
+def write_sheet(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["Name", "phone number", "transaction_id", "lang"])
+        writer.writerows(rows)
+    return str(path)
+
+
+def imported(app_module, file_id):
+    t = app_module.Member.__table__
+    with app_module.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(t)
+                            .where(t.c.submission_key.like(f"import-{file_id}-%"))).scalar()
+
+
+def test_import_rejects_bad_and_taken_rows(app_module, tmp_path):
+    tag = uuid.uuid4().hex[:8].upper()
+    app_module.save_member({**{k: "" for k in app_module.FIELDS}, "name": "Ram", "transaction_id": f"TAKEN{tag}"},
+                           "en", f"import-taken-{tag}")
+    path = write_sheet(tmp_path / "members.csv", [
+        ["Sita Jirel", "9841000001", f"OK{tag}1", "ne"],
+        ["Hari Jirel", "12345", f"OK{tag}2", ""],         # bad phone
+        ["Gita Jirel", "9841000003", f"TAKEN{tag}", ""],   # already a member's
+        ["Maya Jirel", "9841000004", f"OK{tag}1", ""],     # earlier in this file
+        ["", "", "", ""],                                 # blank line
+        ["Pemba Jirel", "+977-1-4123456", f"OK{tag}5", ""],
+    ])
+    summary = app_module.import_members(path)
+    assert (summary["accepted"], summary["rejected"]) == (2, 3)
+    assert imported(app_module, summary["file"]) == 2
+    with open(summary["errors_csv"], newline="") as fh:
+        assert list(csv.reader(fh))[1:] == [["3", "phone", "phone"], ["4", "transaction_id", "taken"],
+                                            ["5", "transaction_id", "taken"]]
+
+    # A second run of a finished file inserts nothing again.
+    again = app_module.import_members(path)
+    assert again["resumed_after_row"] == 7 and again["accepted"] == 0
+    assert imported(app_module, summary["file"]) == 2
+
+
+def test_import_resumes_after_last_committed_chunk(app_module, tmp_path, monkeypatch):
+    tag = uuid.uuid4().hex[:8].upper()
+    path = write_sheet(tmp_path / "big.csv",
+                       [[f"Member {i}", f"98{i:08d}", f"RESUME{tag}{i}", "en"] for i in range(7)])
+    monkeypatch.setattr(app_module, "IMPORT_CHUNK", 2)
+    real_taken = app_module.import_taken
+    calls = []
+
+    def crash_on_third_chunk(checked):
+        calls.append(checked)
+        if len(calls) == 3:
+            raise RuntimeError("killed")
+        return real_taken(checked)
+
+    monkeypatch.setattr(app_module, "import_taken", crash_on_third_chunk)
+    with pytest.raises(RuntimeError):
+        app_module.import_members(path)
+    monkeypatch.setattr(app_module, "import_taken", real_taken)
+
+    summary = app_module.import_members(path)
+    assert summary["resumed_after_row"] == 5  # rows 2-5 were committed
+    assert summary["accepted"] == 3
+    assert imported(app_module, summary["file"]) == 7
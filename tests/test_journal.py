@@ -0,0 +1,81 @@
+import json
+import os
+import time
+import uuid
+
+from sqlalchemy import func, select
+
+
+def form(app_module, **values):
+    return {**{k: "" for k in app_module.FIELDS}, "name": "Journal Jirel", **values}
+
+
+def stored(app_module, keys):
+    t = app_module.Member.__table__
+    with app_module.engine.connect() as conn:
+        return dict(conn.execute(
+            select(t.c.submission_key, func.count()).where(t.c.submission_key.in_(keys))
+            .group_by(t.c.submission_key)).all())
+
+
+def test_writer_drains_appended_entries(app_module, tmp_path):
+    journal = app_module.SubmitJournal(str(tmp_path), interval=60)
+    keys = [f"journal-{uuid.uuid4().hex}" for _ in range(3)]
+    for key in keys:
+        journal.append(form(app_module, transaction_id=key[-12:]), "en", key)
+    # An append wakes the writer thread; no need to wait out the interval.
+    deadline = time.monotonic() + 5
+    while stored(app_module, keys) != {key: 1 for key in keys}:
+        assert time.monotonic() < deadline, "journal not drained"
+        time.sleep(0.02)
+    # Fully drained: the journal starts over.
+    with journal._drain_lock:
+        assert os.path.getsize(journal.path) == 0
+        assert journal._read_offset(journal.path) == 0
+
+
+def test_drain_alongside_writer_keeps_offset(app_module, tmp_path):
+    """An explicit drain (close() at exit) racing the writer thread must
+    not leave a stale offset past the truncated file."""
+    journal = app_module.SubmitJournal(str(tmp_path), interval=60)
+    for _ in range(3):
+        keys = [f"journal-{uuid.uuid4().hex}" for _ in range(3)]
+        for key in keys:
+            journal.append(form(app_module, transaction_id=key[-12:]), "en", key)
+        journal.drain()
+        assert stored(app_module, keys) == {key: 1 for key in keys}
+        assert journal._read_offset(journal.path) == os.path.getsize(journal.path)
+
+
+def test_orphaned_journal_is_replayed_once(app_module, tmp_path):
+    """A crashed worker's journal is drained by another; entries it had
+    already inserted (the offset was not written yet) are not doubled."""
+    keys = [f"orphan-{uuid.uuid4().hex}" for _ in range(3)]
+    app_module.save_member(form(app_module), "en", keys[0])
+    orphan = tmp_path / "4242-deadbeef.jsonl"
+    orphan.write_text("".join(json.dumps({"form": form(app_module), "lang": "ne", "key": key}) + "\n"
+                              for key in keys))
+
+    journal = app_module.SubmitJournal(str(tmp_path))
+    journal._adopt_orphans()
+    assert stored(app_module, keys) == {key: 1 for key in keys}
+    assert not os.listdir(tmp_path)
+
+
+def test_drain_resumes_from_offset(app_module, tmp_path):
+    keys = [f"offset-{uuid.uuid4().hex}" for _ in range(2)]
+    lines = [json.dumps({"form": form(app_module), "lang": "en", "key": key}) + "\n" for key in keys]
+    path = tmp_path / "4343-cafebabe.jsonl"
+    # The first entry was committed (and since deleted by an admin); the
+    # second line is still being written.
+    path.write_text(lines[0] + lines[1][:-5])
+    app_module.SubmitJournal._write_offset(str(path), len(lines[0].encode()))
+
+    journal = app_module.SubmitJournal(str(tmp_path))
+    journal._drain_file(str(path))
+    assert stored(app_module, keys) == {}
+    with open(path, "a") as fh:
+        fh.write(lines[1][-5:])
+    journal._drain_file(str(path))
+    assert stored(app_module, keys) == {keys[1]: 1}
+    assert journal._read_offset(str(path)) == path.stat().st_size
@@ -0,0 +1,41 @@
+import threading
+
+
+def series(app_module, name):
+    return [dict(labels) for n, labels, _ in app_module.metrics.snapshot() if n == name]
+
+
+def test_request_latency_labels(client, app_module):
+    client.get("/step/3")
+    client.get("/step/100")
+    client.get("/step/101")
+    views = {labels["view"] for labels in series(app_module, "http_request_duration_seconds")}
+    assert "step3" in views
+    assert "step_other" in views
+    assert not any(v in views for v in ("step100", "step101"))
+
+
+def test_metrics_endpoint_exposes_histograms(client, app_module):
+    client.get("/")
+    text = app_module.metrics.collect()
+    assert 'http_request_duration_seconds_bucket{view="index",le="+Inf"}' in text
+
+
+def test_concurrent_first_observations_start_one_flusher(app_module, tmp_path):
+    m = app_module.Metrics(str(tmp_path), interval=60)
+    before = sum(t.name == "metrics" for t in threading.enumerate())
+    start = threading.Barrier(16)
+
+    def observe():
+        start.wait()
+        for _ in range(100):
+            m.observe("x_seconds", 0.01)
+
+    threads = [threading.Thread(target=observe) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(t.name == "metrics" for t in threading.enumerate()) - before == 1
+    [[_, _, histogram]] = m.snapshot()
+    assert sum(histogram[:-1]) == 1600
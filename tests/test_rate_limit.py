@@ -0,0 +1,49 @@
+import pytest
+
+
+@pytest.fixture
+def buckets(app_module, monkeypatch):
+    """Rate limiting on (the suite runs with RATE_LIMIT_STORE=off)."""
+    store = app_module.MemoryBuckets()
+    monkeypatch.setattr(app_module, "rate_buckets", store)
+    return store
+
+
+def test_ip_limit_refuses_after_burst(app_module, client, buckets):
+    burst = {key: b for key, _, b in app_module.RATE_LIMITS["application_status"]}["ip"]
+    for _ in range(burst):
+        assert client.get("/status").status_code == 200
+    r = client.get("/status")
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
+    # Other endpoints have their own buckets.
+    assert client.get("/step/2").status_code == 200
+
+
+def test_upload_budget_counts_body_bytes(app_module, client, buckets, monkeypatch):
+    monkeypatch.setattr(app_module, "_BYTE_RULES", (("bytes:draft", "draft", 1.0, 3000),))
+    client.get("/step/2")  # opens a draft
+    body = {"name": "x" * 2000, "action": "next"}
+    assert client.post("/step/2", data=body).status_code != 429
+    assert client.post("/step/2", data=body).status_code == 429
+
+
+def test_admins_are_not_limited(app_module, client, buckets, monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_PASSWORD", "secret")
+    burst = {key: b for key, _, b in app_module.RATE_LIMITS["application_status"]}["ip"]
+    for _ in range(burst + 5):
+        assert client.get("/status", auth=("admin", "secret")).status_code == 200
+
+
+def test_sqlite_buckets_are_shared_and_all_or_nothing(app_module, tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    worker_a, worker_b = app_module.SQLiteBuckets(path), app_module.SQLiteBuckets(path)
+    ip, draft = ("ip:1.2.3.4", 1, 0.001, 3), ("draft:d1", 1, 0.001, 1)
+    assert worker_a.take([ip, draft]) is None
+    # The other worker sees the spent draft token; the refusal leaves the
+    # ip bucket alone.
+    refused = worker_b.take([ip, draft])
+    assert refused is not None and refused[0] == 1
+    assert worker_b.take([ip]) is None
+    assert worker_a.take([ip]) is None
+    assert worker_b.take([ip])[0] == 0
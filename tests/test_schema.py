@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import subprocess
+import sys
+from contextlib import closing
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_app(tmp_path, *args):
+    db = tmp_path / "fresh.db"
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db}", "SCHEMA_LOCK": str(tmp_path / ".schema.lock")}
+    subprocess.run([sys.executable, *args], cwd=HERE, env=env, check=True, capture_output=True)
+    with sqlite3.connect(db) as conn:
+        return {name for name, in conn.execute("SELECT name FROM sqlite_master")}
+
+
+def test_import_does_not_touch_the_schema(tmp_path):
+    assert not run_app(tmp_path, "-c", "import app")
+    assert not (tmp_path / ".schema.lock").exists()
+
+
+def test_upgrade_schema_command(tmp_path):
+    names = run_app(tmp_path, "-m", "flask", "--app", "app", "upgrade-schema")
+    assert {"members", "member_blocks", "members_fts", "members_fts_au"} <= names
+
+
+def test_fts_trigger_fires_only_for_indexed_columns(app_module):
+    db = app_module.engine.url.database
+    with closing(sqlite3.connect(db, timeout=10)) as conn, conn:
+        member_id = conn.execute(
+            "INSERT INTO members (name, submission_key) VALUES ('Pemba Jirel', 'fts-trigger')").lastrowid
+        before = conn.total_changes
+        conn.execute("UPDATE members SET status = 'approved' WHERE id = ?", (member_id,))
+        assert conn.total_changes - before == 1  # just the row, no FTS delete + insert
+        conn.execute("UPDATE members SET name = 'Zangmo Jirel' WHERE id = ?", (member_id,))
+        assert conn.execute("SELECT rowid FROM members_fts WHERE members_fts MATCH 'Zangmo'").fetchall() == [
+            (member_id,)]
+
+
+def test_upgrade_replaces_old_fts_trigger(app_module, tmp_path):
+    # A database of its own: DDL on the shared one would make the
+    # catch-up thread's writes fail.
+    engine = app_module.make_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    app_module.upgrade_schema(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TRIGGER members_fts_au")
+        conn.exec_driver_sql("""CREATE TRIGGER members_fts_au AFTER UPDATE ON members BEGIN
+              INSERT INTO members_fts (members_fts, rowid, name) VALUES ('delete', old.id, old.name);
+              INSERT INTO members_fts (rowid, name) VALUES (new.id, new.name);
+            END""")
+    assert app_module.upgrade_schema(engine)
+    with engine.connect() as conn:
+        sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'members_fts_au'").scalar()
+    engine.dispose()
+    assert "AFTER UPDATE OF name, full_name_en" in sql
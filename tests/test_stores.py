@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+
+def test_sqlite_file_reopens_after_fork(app_module, tmp_path):
+    conn = app_module.SQLiteFile(str(tmp_path / "side.db"))
+    parent = conn()
+    assert conn() is parent  # cached per thread
+    pid = os.fork()
+    if pid == 0:
+        # Child: must get its own connection, and be able to use it.
+        try:
+            child = conn()
+            child.execute("CREATE TABLE t (x)")
+            os._exit(0 if child is not parent else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+def test_engine_connections_are_tuned(app_module):
+    with app_module.engine.connect() as conn:
+        pragma = lambda name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("busy_timeout") == app_module.SQLITE_PRAGMAS["busy_timeout"]
+
+
+def test_engine_pool_not_shared_after_fork(app_module):
+    with app_module.engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1")  # the pool holds a parent connection
+    pid = os.fork()
+    if pid == 0:
+        try:
+            with app_module.engine.connect() as conn:
+                ok = conn.connection.info["pid"] == os.getpid() and conn.exec_driver_sql("SELECT 1").scalar()
+            os._exit(0 if ok else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_draft_store_writes_only_changes(app_module, tmp_path, kind):
+    store = (app_module.MemoryDraftStore() if kind == "memory"
+             else app_module.SQLiteDraftStore(str(tmp_path / "drafts.db")))
+    assert store.load("d1") is None
+    store.update("d1", {"name": "Ram", "doc_file": "ab/cd/x.pdf"})
+    store.update("d1", {"phone": "9841234567"})
+    assert store.load("d1") == {"name": "Ram", "doc_file": "ab/cd/x.pdf", "phone": "9841234567"}
+    assert store.referenced_files() == {"ab/cd/x.pdf"}
+    store.delete("d1")
+    assert store.load("d1") is None
+
+
+def test_sqlite_draft_store_expires(app_module, tmp_path):
+    store = app_module.SQLiteDraftStore(str(tmp_path / "drafts.db"), ttl=-1)
+    store.update("d1", {"name": "Ram"})
+    assert store.load("d1") is None
+    store.purge()
+    assert store.referenced_files() == set()
+
+
+def test_status_cache_reads_through_tiers(app_module, tmp_path):
+    shared = app_module.SQLiteStatusCache(str(tmp_path / "status.db"))
+    cache = app_module.StatusCache(app_module.LocalStatusCache(), shared)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"status": "received"}
+
+    assert cache.get("K", load) == {"status": "received"}
+    assert cache.get("K", load) == {"status": "received"}
+    assert len(loads) == 1
+    # Another worker: empty local tier, same shared file.
+    other = app_module.StatusCache(app_module.LocalStatusCache(), shared)
+    assert other.get("K", load) == {"status": "received"}
+    assert len(loads) == 1
+    cache.invalidate("K")
+    assert shared.get("K") is None